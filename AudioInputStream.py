@@ -1,25 +1,173 @@
-import pyaudio
+import time
 import numpy as np
+from RingBuffer import RingBuffer, SharedRingBuffer
+from Instrumentation import Instrumentation
+from Wakeup import Wakeup
 
-WIDTH = 2
-# CHUNK = 2048
-# FORMAT = pyaudio.paInt32
+# PortAudio is only needed for real devices, synthetic backends (AudioSources) work without it
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+# pyaudio.paContinue, paInputUnderflow, paInputOverflow
+PA_CONTINUE = 0
+PA_INPUT_UNDERFLOW = 1
+PA_INPUT_OVERFLOW = 2
+# how many recent blocks remember their capture time
+BLOCK_TIMES = 256
+
+# pyaudio.paFloat32, paInt32, paInt24, paInt16
+PA_FLOAT32 = 1
+PA_INT32 = 2
+PA_INT24 = 4
+PA_INT16 = 8
+# Capture formats: PortAudio format, dtype of the delivered bytes, ring dtype and the
+# gain that brings samples to int16 full scale (None: stored as they come). Everything
+# else works in int16 units, so 24/32-bit and float input only adds resolution, not
+# level. Packed int24 has no numpy dtype, it is unpacked into the top of an int32 first.
+SAMPLE_FORMATS = {
+    'int16': (PA_INT16, '<i2', np.int16, None),
+    'int24': (PA_INT24, None, np.float32, 2.0 ** -16),
+    'int32': (PA_INT32, '<i4', np.float32, 2.0 ** -16),
+    'float32': (PA_FLOAT32, '<f4', np.float32, 32768.0),
+}
 
 class AudioIn:
-    def __init__(self, chunk=1024, sample_rate=44100):
-        self.p = pyaudio.PyAudio()
+    def __init__(self, chunk=1024, sample_rate=44100, blocks=8, history=0, channels=1, shared=False, backend=None,
+                 stats=None, sample_format='int16'):
+        # backend is anything with the PyAudio interface, e.g. AudioSources.SyntheticBackend
+        self.p = backend if backend is not None else pyaudio.PyAudio()
         self.chunk = chunk
-        self.audio = np.empty(chunk, dtype="int16")
+        self.rate = sample_rate
+        # callback timing, overflow counters and capture times shared with the consumers
+        self.stats = stats if stats is not None else Instrumentation()
+        # ring index at the end of each recent block and the perf_counter time of its first sample
+        self.block_ends = np.zeros(BLOCK_TIMES, dtype=np.int64)
+        self.block_times = np.zeros(BLOCK_TIMES)
+        self.block_count = 0
+        # bumped after every block written to the ring; unlike block_count it is never
+        # reset, so consumers can wait for it across stream restarts
+        self.new_block = Wakeup()
+        self.channels = channels
+        # one of SAMPLE_FORMATS
+        self.sample_format = sample_format
+        # scratch for unpacking int24 blocks, (samples, 4) bytes with the low byte zero
+        self.unpack = np.zeros((0, 4), dtype=np.uint8)
+        self.device = None
+        self.output = False
+        # the open PortAudio stream, None while stopped
+        self.stream = None
+        self.blocks = blocks
+        # minimum number of samples kept, for consumers analysing windows longer than a chunk
+        self.history = history
+        # shared rings live in shared memory so a DspProcess can read them
+        self.shared = shared
+        # the capture ring holds the last `blocks` chunks, allocated once up front
+        self.ring = self.make_ring(chunk, channels)
+
+    def make_ring(self, chunk, channels):
+        ring_class = SharedRingBuffer if self.shared else RingBuffer
+        return ring_class(self.ring_capacity(chunk), dtype=SAMPLE_FORMATS[self.sample_format][2], channels=channels)
+
+    def ring_capacity(self, chunk):
+        return max(chunk * self.blocks, self.history)
 
     def __del__(self):
+        self.ring.close()
         self.p.terminate()
 
+    @property
+    def audio(self):
+        # most recent chunk as a read-only view into the ring
+        return self.ring.latest(self.chunk)
+
+    def latest(self, n=None):
+        return self.ring.latest(self.chunk if n is None else n)
+
+    def read_block(self):
+        # next unread chunk for gapless consumers, None if nothing new arrived
+        return self.ring.read(self.chunk)
+
+    @property
+    def block_sequence(self):
+        # blocks delivered since the instance was created
+        return self.new_block.sequence
+
+    @property
+    def overruns(self):
+        return self.ring.overruns
+
     def callback(self, in_data, frame_count, time_info, status):
-        self.audio = np.fromstring(in_data, dtype=np.int16)
-        return (in_data, pyaudio.paContinue)
+        started = time.perf_counter()
+        if status:
+            if status & PA_INPUT_OVERFLOW:
+                self.stats.count('input_overflow')
+            if status & PA_INPUT_UNDERFLOW:
+                self.stats.count('input_underflow')
+        # no allocation here: frombuffer wraps the PortAudio bytes, write converts them
+        # into the ring in the same copy
+        _, wire_dtype, _, gain = SAMPLE_FORMATS[self.sample_format]
+        if wire_dtype is None:
+            packed = np.frombuffer(in_data, dtype=np.uint8).reshape(-1, 3)
+            if len(self.unpack) < len(packed):
+                self.unpack = np.zeros((len(packed), 4), dtype=np.uint8)
+            unpack = self.unpack[:len(packed)]
+            unpack[:, 1:] = packed
+            data = unpack.view('<i4')[:, 0]
+        else:
+            data = np.frombuffer(in_data, dtype=wire_dtype)
+        if self.channels > 1:
+            # interleaved frames -> (frames, channels) view
+            data = data.reshape(-1, self.channels)
+        self.ring.write(data, gain)
+
+        # map the stream clock onto perf_counter; host APIs without ADC timestamps report 0,
+        # then the block is assumed to have just finished recording
+        adc_time = time_info.get('input_buffer_adc_time', 0) if time_info else 0
+        if adc_time:
+            captured = started - (time_info['current_time'] - adc_time)
+        else:
+            captured = started - frame_count / self.rate
+        slot = self.block_count % BLOCK_TIMES
+        self.block_ends[slot] = self.ring.write_index
+        self.block_times[slot] = captured
+        self.block_count += 1
+        self.new_block.bump()
+        self.stats.record('callback', time.perf_counter() - started)
+        return (in_data, PA_CONTINUE)
+
+    def sample_time(self, index):
+        # perf_counter time the frame at absolute ring index `index` was captured,
+        # None if its block is older than the remembered ones
+        later = self.block_ends > index
+        if self.block_count == 0 or not later.any():
+            return None
+        slot = int(np.argmin(np.where(later, self.block_ends, np.iinfo(np.int64).max)))
+        first = self.block_ends[slot] - self.chunk
+        if index < first:
+            return None
+        return self.block_times[slot] + (index - first) / self.rate
+
+    def prepare(self, rate, chunk, channels):
+        # settings for the next stream; the ring is only replaced if it is too small or
+        # has the wrong channel count, consumers re-read self.ring and pick up the new one
+        self.chunk = chunk
+        if (self.ring.capacity < self.ring_capacity(chunk) or self.ring.channels != channels
+                or self.ring.dtype != SAMPLE_FORMATS[self.sample_format][2]):
+            old_ring = self.ring
+            self.ring = self.make_ring(chunk, channels)
+            old_ring.close()
+        self.channels = channels
+        self.rate = rate
+        self.block_ends[:] = 0
+        self.block_count = 0
 
     def start_stream(self, rate=44100, chunk=44100, output=False, device=None, channels=1):
-        self.stream = self.p.open(format=self.p.get_format_from_width(WIDTH),
+        self.prepare(rate, chunk, channels)
+        self.device = device
+        self.output = output
+        self.stream = self.p.open(format=SAMPLE_FORMATS[self.sample_format][0],
                                   channels=channels,
                                   rate=rate,
                                   input=True,
@@ -30,8 +178,35 @@ class AudioIn:
         self.stream.start_stream()
 
     def stop_stream(self):
-        self.stream.stop_stream()
-        self.stream.close()
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+
+    def close(self):
+        # stops capture and releases the ring (shared memory included),
+        # the PortAudio context goes with the instance
+        self.stop_stream()
+        self.ring.close()
+
+    def reconfigure(self, rate=None, chunk=None, channels=None, device=None, history=None, sample_format=None):
+        # Changes settings of this instance in place. The PortAudio context is kept, only
+        # the stream is reopened (PortAudio can't change rate or buffer size of an open
+        # stream) and only if it was running; None keeps the current value.
+        if history is not None:
+            self.history = history
+        if sample_format is not None:
+            self.sample_format = sample_format
+        rate = self.rate if rate is None else rate
+        chunk = self.chunk if chunk is None else chunk
+        channels = self.channels if channels is None else channels
+        if device is not None:
+            self.device = device
+        if self.stream is None:
+            self.prepare(rate, chunk, channels)
+            return
+        self.stop_stream()
+        self.start_stream(rate=rate, chunk=chunk, output=self.output, device=self.device, channels=channels)
 
     def get_all_devices_info(self):
         device_count = self.p.get_device_count()
@@ -64,6 +239,9 @@ class AudioIn:
                 device_id = device.get('index')
         return device_id
 
+    def get_device_info(self, index):
+        return self.p.get_device_info_by_index(index)
+
     def get_default_input_device(self):
         return self.p.get_default_input_device_info()
 
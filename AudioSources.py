@@ -0,0 +1,190 @@
+import threading
+import time
+import numpy as np
+
+from OfflineAnalysis import open_wav, full_scale
+from AudioInputStream import PA_INT16, PA_INT24, PA_INT32, PA_FLOAT32
+
+INT16_MAX = 32767
+
+
+def encode_block(block, sample_format):
+    # int16 (frames, channels) block -> interleaved bytes in a PortAudio sample format
+    if sample_format == PA_FLOAT32:
+        return (block / 32768.0).astype('<f4').tobytes()
+    if sample_format == PA_INT32:
+        return (block.astype('<i4') << 16).tobytes()
+    if sample_format == PA_INT24:
+        # low three bytes of each little-endian int32
+        wide = (block.astype('<i4') << 8).reshape(-1, 1).view(np.uint8)
+        return wide[:, :3].tobytes()
+    return block.astype('<i2').tobytes()
+
+
+class SignalGenerator:
+    # Deterministic test signal in int16 units: any mix of steady tones, a repeating
+    # linear sweep and white noise. The same (start, frames) always gives the same
+    # samples, except noise which is a seeded sequence read front to back.
+
+    def __init__(self, tones=((440.0, 8000.0),), sweep=None, noise=0.0, seed=0):
+        # tones: (hz, amplitude) pairs; sweep: (start_hz, stop_hz, seconds, amplitude)
+        self.tones = list(tones)
+        self.sweep = sweep
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.position = 0
+
+    def generate(self, start, frames, rate):
+        t = (start + np.arange(frames)) / rate
+        signal = np.zeros(frames)
+        for hz, amplitude in self.tones:
+            signal += amplitude * np.sin(2 * np.pi * hz * t)
+        if self.sweep is not None:
+            start_hz, stop_hz, seconds, amplitude = self.sweep
+            ts = t % seconds
+            phase = 2 * np.pi * (start_hz * ts + (stop_hz - start_hz) * ts ** 2 / (2 * seconds))
+            signal += amplitude * np.sin(phase)
+        if self.noise:
+            signal += self.rng.normal(0.0, self.noise, frames)
+        return signal
+
+    def read(self, frames, channels, rate):
+        # next block as (frames, channels) int16, the same signal on every channel
+        signal = self.generate(self.position, frames, rate)
+        self.position += frames
+        block = np.clip(signal, -INT16_MAX, INT16_MAX).astype(np.int16)
+        return np.repeat(block[:, None], channels, axis=1)
+
+
+class WavReplay:
+    # Plays a WAV file back block by block (memory-mapped, looping at the end).
+    # Samples are passed on at whatever rate the stream was opened with.
+
+    def __init__(self, path, loop=True):
+        self.samples, self.rate = open_wav(path)
+        self.gain = (INT16_MAX + 1) / full_scale(self.samples.dtype)
+        self.loop = loop
+        self.position = 0
+
+    def read(self, frames, channels, rate):
+        # next block as (frames, channels) int16; file channels repeat if more are asked for,
+        # silence after the end when not looping
+        total = self.samples.shape[0]
+        index = self.position + np.arange(frames)
+        if self.loop:
+            index %= total
+        self.position += frames
+        valid = index < total
+        block = np.zeros((frames, channels))
+        block[valid] = self.samples[index[valid]][:, np.arange(channels) % self.samples.shape[1]] * self.gain
+        return np.clip(block, -INT16_MAX, INT16_MAX).astype(np.int16)
+
+
+class SyntheticStream:
+    # Drives an AudioIn callback from a source on its own thread, paced like a sound
+    # card at `speed` times real time (speed=0 runs as fast as the consumer allows).
+    # `delivered` keeps (frames delivered so far, wall time) of the last blocks for
+    # latency measurements.
+
+    def __init__(self, source, rate, channels, frames_per_buffer, stream_callback, speed=1.0,
+                 sample_format=PA_INT16):
+        self.source = source
+        self.sample_format = sample_format
+        self.rate = rate
+        self.channels = channels
+        self.frames = frames_per_buffer
+        self.callback = stream_callback
+        self.speed = speed
+        self.frame_index = 0
+        self.delivered = []
+        self.running = threading.Event()
+        self.thread = None
+
+    def start_stream(self):
+        self.running.set()
+        self.thread = threading.Thread(target=self.run, name='synthetic-stream', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        period = self.frames / (self.rate * self.speed) if self.speed else 0.0
+        next_time = time.perf_counter()
+        while self.running.is_set():
+            block = self.source.read(self.frames, self.channels, self.rate)
+            now = time.perf_counter()
+            time_info = {'input_buffer_adc_time': now - self.frames / self.rate,
+                         'current_time': now, 'output_buffer_dac_time': 0.0}
+            self.callback(encode_block(block, self.sample_format), self.frames, time_info, 0)
+            self.frame_index += self.frames
+            self.delivered.append((self.frame_index, time.perf_counter()))
+            del self.delivered[:-1024]
+            if period:
+                next_time += period
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # fell behind, don't try to catch up with a burst
+                    next_time = time.perf_counter()
+
+    def stop_stream(self):
+        self.running.clear()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def close(self):
+        self.stop_stream()
+
+    def is_active(self):
+        return self.running.is_set()
+
+
+class SyntheticBackend:
+    # The part of the PyAudio interface AudioIn uses, backed by a SignalGenerator or
+    # WavReplay instead of a device: AudioIn(backend=SyntheticBackend(SignalGenerator()))
+    # A list of sources gives one device per source, for multi-device setups.
+
+    def __init__(self, source=None, speed=1.0, name='Synthetic input', max_channels=8):
+        sources = list(source) if isinstance(source, (list, tuple)) else [source]
+        self.sources = [s if s is not None else SignalGenerator() for s in sources]
+        self.source = self.sources[0]
+        self.speed = speed
+        self.devices = [{'index': i, 'name': name if len(self.sources) == 1 else f'{name} {i}',
+                         'maxInputChannels': max_channels, 'maxOutputChannels': 0, 'defaultSampleRate': 44100.0}
+                        for i in range(len(self.sources))]
+        self.device_info = self.devices[0]
+        # the most recently opened stream, and all of them
+        self.stream = None
+        self.streams = []
+
+    def get_format_from_width(self, width):
+        return {2: PA_INT16, 3: PA_INT24, 4: PA_INT32}[width]
+
+    def open(self, format=PA_INT16, channels=1, rate=44100, input=True, output=False, stream_callback=None,
+             input_device_index=None, frames_per_buffer=1024):
+        source = self.sources[input_device_index or 0]
+        self.stream = SyntheticStream(source, rate, channels, frames_per_buffer, stream_callback,
+                                      speed=self.speed, sample_format=format)
+        self.streams = [stream for stream in self.streams if stream.is_active()] + [self.stream]
+        return self.stream
+
+    def get_device_count(self):
+        return len(self.devices)
+
+    def get_device_info_by_host_api_device_index(self, host_api, index):
+        if not 0 <= index < len(self.devices):
+            raise IOError(f'Invalid device index {index}')
+        return self.devices[index]
+
+    def get_device_info_by_index(self, index):
+        return self.get_device_info_by_host_api_device_index(0, index)
+
+    def get_default_input_device_info(self):
+        return self.device_info
+
+    def get_default_output_device_info(self):
+        return self.device_info
+
+    def terminate(self):
+        for stream in self.streams:
+            stream.close()
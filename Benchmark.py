@@ -0,0 +1,327 @@
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import numpy as np
+
+from AudioInputStream import AudioIn
+from AudioSources import SyntheticBackend, SignalGenerator
+from DspWorker import SpectrumTask, DspWorker
+from SpectralEngine import SpectralEngine, zoom_plan
+from RingBuffer import RingBuffer
+from ToneDetector import ToneTask
+from PitchTracker import PITCH_DETECTORS, make_detector
+
+# render benchmarks run without a screen
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+RATE = 44100
+FFT_SIZES = [1024, 4096, 16384, 44100]
+BAND_SCALES = ['linear', 'log', 'octave']
+# FrequencyMonitor x ranges, 0 is the full band without zoom
+ZOOM_RANGES = [0, 1000, 2000, 5000, 10000]
+# tone monitor bank sizes: one pilot tone, mains hum harmonics, a dense bank
+TONE_COUNTS = [1, 8, 40]
+# modules whose import time is measured in a fresh interpreter; numpy is the floor
+STARTUP_MODULES = ['numpy', 'DspWorker', 'HeadlessMonitor', 'SpectrumServer', 'ToneDetector', 'PyAudioSpectro',
+                   'FrequencyMonitor']
+
+
+def summarize(times):
+    times = np.asarray(times) * 1e3
+    return {
+        'runs': int(times.size),
+        'mean_ms': float(times.mean()),
+        'median_ms': float(np.median(times)),
+        'p95_ms': float(np.percentile(times, 95)),
+        'min_ms': float(times.min()),
+    }
+
+
+def measure(func, repeat, warmup=3):
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return summarize(times)
+
+
+def test_block(size, channels=1):
+    source = SignalGenerator(tones=[(440.0, 8000.0), (3150.0, 2000.0)], noise=50.0)
+    block = source.read(size, channels, RATE)
+    return block[:, 0].copy() if channels == 1 else block
+
+
+def bench_fft(repeat, backend='auto'):
+    engine = SpectralEngine(backend=backend)
+    results = []
+    for size in FFT_SIZES:
+        data = test_block(size)
+        stats = measure(lambda: engine.magnitude(data, RATE), repeat)
+        stats.update(chunk=size, backend=engine.backend,
+                     msamples_per_s=size / (stats['median_ms'] * 1e3))
+        results.append(stats)
+    return results
+
+
+def bench_bands(repeat, count=40):
+    engine = SpectralEngine()
+    results = []
+    for size in FFT_SIZES:
+        spectrum = engine.magnitude(test_block(size), RATE)
+        for scale in BAND_SCALES:
+            band_map = engine.bands(size, RATE, count, scale=scale)
+            stats = measure(lambda: band_map.apply(spectrum), repeat)
+            stats.update(chunk=size, scale=scale, bands=count)
+            results.append(stats)
+    return results
+
+
+def bench_pitch(repeat):
+    # one pitch estimate per hop; hop_budget_ms is the time a 512 sample hop allows
+    engine = SpectralEngine()
+    data = test_block(RATE)
+    results = []
+    for name in PITCH_DETECTORS:
+        detector = make_detector(name, engine)
+        stats = measure(lambda: detector(data, RATE), repeat)
+        stats.update(method=name, window=detector.size, hop_budget_ms=512 / RATE * 1e3)
+        results.append(stats)
+    return results
+
+
+def bench_zoom(repeat, size=RATE, hop=RATE // 10):
+    # one FrequencyMonitor analysis step (spectrum plus peak estimate) per hop, full band
+    # against the decimate-then-FFT zoom on 0..zoom Hz
+    data = test_block(size + repeat * hop)
+    results = []
+    for zoom in ZOOM_RANGES:
+        task = SpectrumTask(size, RATE, hop, zoom=zoom)
+        task.setup()
+        ring = RingBuffer(2 * size)
+        ring.write(data[:size])
+        task(ring)
+        times = []
+        for i in range(repeat):
+            ring.write(data[size + i * hop:size + (i + 1) * hop])
+            started = time.perf_counter()
+            task(ring)
+            times.append(time.perf_counter() - started)
+        factor, length = zoom_plan(size, RATE, zoom)
+        stats = summarize(times)
+        stats.update(zoom_hz=zoom, factor=factor, fft_size=length, resolution_hz=RATE / factor / length)
+        results.append(stats)
+    return results
+
+
+def bench_tones(repeat, hop=512):
+    # tone monitor update per capture block; block_budget_ms is the time one block allows
+    data = test_block(RATE + repeat * hop)
+    results = []
+    for count in TONE_COUNTS:
+        task = ToneTask(50.0 * np.arange(1, count + 1), RATE, hop=hop)
+        task.setup()
+        ring = RingBuffer(2 * RATE)
+        ring.write(data[:RATE])
+        task(ring)
+        times = []
+        for i in range(repeat):
+            ring.write(data[RATE + i * hop:RATE + (i + 1) * hop])
+            started = time.perf_counter()
+            task(ring)
+            times.append(time.perf_counter() - started)
+        stats = summarize(times)
+        stats.update(tones=count, hop=hop, window=task.bank.size, block_budget_ms=hop / RATE * 1e3)
+        results.append(stats)
+    return results
+
+
+def bench_startup(repeat):
+    # start-up cost in fresh interpreters: import time of every entry point, and the time
+    # from start to HeadlessMonitor's first result of a full window on the synthetic input
+    # (earlier ones are zero padded); that includes the window's own length of capture
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for module in STARTUP_MODULES:
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, '-c', f'import {module}'], cwd=here, capture_output=True, check=True)
+            times.append(time.perf_counter() - started)
+        stats = summarize(times)
+        stats.update(module=module)
+        results.append(stats)
+    for backend in ('auto', 'numpy'):
+        first = []
+        for _ in range(repeat):
+            command = [sys.executable, 'HeadlessMonitor.py', '--synthetic', '--full-window', '--count', '1',
+                       '--backend', backend]
+            done = subprocess.run(command, cwd=here, capture_output=True, text=True, check=True)
+            match = re.search(r'first result (\d+) ms', done.stderr)
+            if match:
+                first.append(int(match.group(1)) / 1e3)
+        stats = summarize(first) if first else {'runs': 0}
+        stats.update(entry='HeadlessMonitor first full-window result', backend=backend)
+        results.append(stats)
+    return results
+
+
+def bench_update_plot(repeat):
+    try:
+        from PyQt5 import QtWidgets
+        from FrequencyMonitor import MplCanvas
+    except ImportError as e:
+        return [{'skipped': str(e)}]
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    engine = SpectralEngine()
+    data = engine.magnitude(test_block(RATE), RATE)
+    results = []
+    for blit in (True, False):
+        canvas = MplCanvas(blit=blit)
+        canvas.show()
+        app.processEvents()
+        stats = measure(lambda: canvas.update_plot(data), repeat)
+        stats.update(blit=blit, points=int(data.size))
+        results.append(stats)
+        canvas.close()
+    return results
+
+
+def bench_update_cells(repeat):
+    try:
+        import pygame
+        from PyAudioSpectro import Spectrum, BOARD_WIDTH, BOARD_HEIGHT
+    except ImportError as e:
+        return [{'skipped': str(e)}]
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, BOARD_HEIGHT + 1, size=(64, BOARD_WIDTH))
+    results = []
+    for bars in (False, True):
+        # a real analyzer opened on the synthetic input, its own frames replaced by the
+        # random ones; the capture and DSP thread run alongside as they would in use
+        board = Spectrum(bars=bars, backend=SyntheticBackend())
+        board.open()
+        counter = iter(range(10 ** 9))
+
+        def frame():
+            rects = board.update_cells(frames[next(counter) % len(frames)])
+            pygame.display.update(rects)
+
+        stats = measure(frame, repeat)
+        stats.update(bars=bars, columns=BOARD_WIDTH)
+        results.append(stats)
+        board.close()
+    return results
+
+
+def bench_latency(seconds, hop=512, size=RATE):
+    # Capture-to-display latency: time from the synthetic stream handing over the block
+    # holding a frame's newest sample to that frame drawn by MplCanvas.update_plot and
+    # painted. The 'result' entry stops where the polling side sees the frame, without
+    # the render step; without PyQt5 / matplotlib only that one is measured.
+    try:
+        from PyQt5 import QtWidgets
+        from FrequencyMonitor import MplCanvas
+        app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+        canvas = MplCanvas()
+        canvas.show()
+        app.processEvents()
+    except ImportError as e:
+        canvas = None
+        skipped = str(e)
+    backend = SyntheticBackend(SignalGenerator(noise=50.0), speed=1.0)
+    audio = AudioIn(chunk=hop, history=2 * size, backend=backend)
+    task = SpectrumTask(size, RATE, hop)
+    worker = DspWorker(audio, task)
+    if canvas is not None:
+        canvas.set_frequencies(*task.spectrum_layout())
+    audio.start_stream(rate=RATE, chunk=hop, device=0)
+    worker.start()
+    stream = backend.stream
+    seen_latencies = []
+    shown_latencies = []
+    last_sequence = 0
+    stop_at = time.perf_counter() + seconds
+    while time.perf_counter() < stop_at:
+        sequence, result = worker.latest()
+        if result is not None and sequence != last_sequence:
+            seen = time.perf_counter()
+            last_sequence = sequence
+            delivered = next((t for frame_index, t in list(stream.delivered) if frame_index >= result.end), None)
+            if canvas is not None:
+                canvas.update_plot(result.spectrum)
+                app.processEvents()
+            shown = time.perf_counter()
+            if delivered is not None:
+                seen_latencies.append(seen - delivered)
+                shown_latencies.append(shown - delivered)
+        time.sleep(0.001)
+    worker.stop()
+    audio.stop_stream()
+    details = dict(hop=hop, fft_size=size, overruns=audio.overruns, skipped_hops=task.analyzer.skipped)
+    results = []
+    if canvas is not None:
+        canvas.close()
+        stats = summarize(shown_latencies) if shown_latencies else {'runs': 0}
+        stats.update(stage='capture-to-display', **details)
+    else:
+        stats = {'stage': 'capture-to-display', 'skipped': skipped}
+    results.append(stats)
+    stats = summarize(seen_latencies) if seen_latencies else {'runs': 0}
+    stats.update(stage='capture-to-result', **details)
+    results.append(stats)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Spectrum analyzer benchmarks, results as JSON')
+    parser.add_argument('-o', '--output', help='write JSON here instead of stdout')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--latency-seconds', type=float, default=5.0)
+    parser.add_argument('--startup-repeat', type=int, default=5, help='fresh interpreters per start-up measurement')
+    parser.add_argument('--backend', default='auto', help='FFT backend: auto, numpy, scipy or fftw')
+    parser.add_argument('--only', nargs='*', help='run only these benchmarks')
+    args = parser.parse_args(argv)
+
+    benchmarks = {
+        'fft': lambda: bench_fft(args.repeat, args.backend),
+        'bands': lambda: bench_bands(args.repeat),
+        'pitch': lambda: bench_pitch(args.repeat),
+        'zoom': lambda: bench_zoom(args.repeat),
+        'tones': lambda: bench_tones(args.repeat),
+        'startup': lambda: bench_startup(args.startup_repeat),
+        'update_plot': lambda: bench_update_plot(args.repeat),
+        'update_cells': lambda: bench_update_cells(args.repeat),
+        'latency': lambda: bench_latency(args.latency_seconds),
+    }
+    report = {'meta': {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+    }}
+    for name, run in benchmarks.items():
+        if args.only and name not in args.only:
+            continue
+        print(f'running {name}', file=sys.stderr)
+        report[name] = run()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,465 @@
+import multiprocessing
+import queue
+import threading
+from multiprocessing.shared_memory import SharedMemory
+import time
+from collections import namedtuple
+import numpy as np
+
+from RingBuffer import SharedRingBuffer, attach_shared_memory
+from SpectralEngine import SpectralEngine, SlidingSpectrum, ZoomSpectrum, select_channels, zoom_plan
+from PeakEstimator import make_estimator
+from PitchTracker import PitchTracker
+from Instrumentation import Instrumentation
+from Wakeup import Wakeup, WAIT_TIMEOUT
+
+# seconds between the stats reports of a worker process
+STATS_INTERVAL = 0.5
+
+# pitch is the smoothed fundamental (nan when unvoiced or tracking is off),
+# confidence that of the newest raw estimate
+AnalysisResult = namedtuple('AnalysisResult', ['spectrum', 'hz', 'error', 'end', 'pitch', 'confidence'],
+                            defaults=(np.nan, 0.0))
+
+
+class SpectrumTask:
+    # The FrequencyMonitor analysis as one callable: sliding spectrum of the ring plus
+    # the peak estimate, and optionally a pitch track ('yin', 'hps', 'cepstrum' or 'off')
+    # over a short window ending at the same sample. With `zoom` set to a frequency in
+    # Hz only 0..zoom is analysed, from a decimated copy of the input (ZoomSpectrum);
+    # 0 analyses the full band. `backend` picks the SpectralEngine's FFT. Only plain settings
+    # are stored until setup(), so the task can be pickled into a worker process (whose
+    # copy of `stats` reports back to this one, see process_main).
+
+    def __init__(self, size, rate, hop, mode='sum', estimator='gaussian', pitch='off', zoom=0, backend='auto',
+                 stats=None):
+        self.size = size
+        self.rate = rate
+        self.hop = hop
+        self.mode = mode
+        self.estimator = estimator
+        self.pitch = pitch
+        self.zoom = zoom
+        self.backend = backend
+        self.stats = stats if stats is not None else Instrumentation()
+        self.analyzer = None
+        self.skipped = 0
+
+    def setup(self):
+        self.engine = SpectralEngine(backend=self.backend)
+        self.analyzer = self.make_analyzer()
+        self.peak_estimator = make_estimator(self.estimator, self.engine)
+        self.pitch_tracker = self.make_pitch_tracker()
+        self.skipped = 0
+
+    def make_analyzer(self):
+        if zoom_plan(self.size, self.rate, self.zoom)[0] == 1:
+            return SlidingSpectrum(self.engine, self.size, self.rate, self.hop, mode=self.mode)
+        return ZoomSpectrum(self.engine, self.size, self.rate, self.hop, self.zoom, mode=self.mode)
+
+    def make_pitch_tracker(self):
+        return None if self.pitch == 'off' else PitchTracker(self.engine, self.pitch)
+
+    def configure(self, hop=None, mode=None, estimator=None, size=None, rate=None, pitch=None, zoom=None):
+        before = (self.size, self.rate, zoom_plan(self.size, self.rate, self.zoom)[0])
+        if size is not None:
+            self.size = size
+        if rate is not None:
+            self.rate = rate
+        if hop is not None:
+            self.hop = hop
+        if mode is not None:
+            self.mode = mode
+        if estimator is not None:
+            self.estimator = estimator
+        if pitch is not None:
+            self.pitch = pitch
+        if zoom is not None:
+            self.zoom = zoom
+        if self.analyzer is not None:
+            if (self.size, self.rate, zoom_plan(self.size, self.rate, self.zoom)[0]) != before:
+                # new FFT size or rate, or zoom switched on, off or to another decimation factor
+                self.analyzer = self.make_analyzer()
+                self.skipped = 0
+            if hop is not None:
+                self.analyzer.set_hop(hop)
+            if mode is not None:
+                self.analyzer.mode = mode
+            if estimator is not None:
+                self.peak_estimator = make_estimator(estimator, self.engine)
+            if pitch is not None:
+                self.pitch_tracker = self.make_pitch_tracker()
+
+    def spectrum_layout(self):
+        # (FFT size, sample rate) of the spectra produced, they have size // 2 bins
+        factor, length = zoom_plan(self.size, self.rate, self.zoom)
+        return length, self.rate / factor
+
+    def result_shape(self, channels):
+        bins = self.spectrum_layout()[0] // 2
+        return (channels, bins) if self.mode == 'channels' and channels > 1 else (bins,)
+
+    def __call__(self, ring):
+        started = time.perf_counter()
+        # configure() may swap in a new analyzer from another thread meanwhile
+        analyzer = self.analyzer
+        spectrum = analyzer.update(ring)
+        if spectrum is None:
+            return None
+        self.stats.record('fft', time.perf_counter() - started)
+        if analyzer.skipped != self.skipped:
+            # hops coalesced because analysis fell behind
+            self.stats.count('dropped_frames', analyzer.skipped - self.skipped)
+            self.skipped = analyzer.skipped
+        with self.stats.timer('peak'):
+            end = analyzer.end
+            samples = analyzer.samples(ring, analyzer.output_size + self.peak_estimator.lookback)
+            samples = select_channels(samples, analyzer.mode)
+            peak_data = spectrum.max(axis=0) if spectrum.ndim == 2 else spectrum
+            hz, error = self.peak_estimator.estimate(peak_data, analyzer.output_rate, samples=samples)
+        if self.pitch_tracker is None:
+            return AnalysisResult(spectrum, hz, error, end)
+        with self.stats.timer('pitch'):
+            # the pitch detectors always see the full rate input
+            window = min(self.pitch_tracker.window_size(self.rate), ring.capacity)
+            if end < window:
+                # the window still reaches into the zeros before the first sample; leave
+                # the track alone until it holds input only
+                return AnalysisResult(spectrum, hz, error, end)
+            if window > samples.shape[0] or analyzer.output_rate != self.rate:
+                samples = select_channels(ring.window(end, window), analyzer.mode)
+            pitch, confidence = self.pitch_tracker(samples, self.rate)
+        return AnalysisResult(spectrum, hz, error, end, pitch, confidence)
+
+
+class ResultSlot:
+    # Latest-wins hand-over between one writer thread and any number of readers.
+    # publish() replaces the front reference in one assignment, readers never block
+    # and simply see the newest (sequence, result) pair; `wakeup` tells them when to look.
+
+    def __init__(self):
+        self.front = (0, None)
+        self.wakeup = Wakeup()
+
+    def publish(self, result):
+        self.front = (self.front[0] + 1, result)
+        self.wakeup.bump()
+
+    def latest(self):
+        return self.front
+
+
+class SharedResultSlot:
+    # Double-buffered latest-wins slot in shared memory for results coming from another
+    # process. The writer fills the back buffer, then flips `front` and bumps the
+    # sequence; readers copy the front buffer and retry if the sequence moved meanwhile.
+    # Layout: int64 [sequence, front], float64 [hz, error, end, pitch, confidence] x 2,
+    # float32 spectrum x 2.
+
+    def __init__(self, shape, name=None):
+        self.shape = tuple(shape)
+        count = int(np.prod(self.shape))
+        nbytes = 16 + 2 * 40 + 2 * count * 4
+        if name is None:
+            self.shm = SharedMemory(create=True, size=nbytes)
+            self.owner = True
+        else:
+            self.shm = attach_shared_memory(name)
+            self.owner = False
+        self.name = self.shm.name
+        self.header = np.ndarray((2,), dtype=np.int64, buffer=self.shm.buf)
+        self.scalars = np.ndarray((2, 5), dtype=np.float64, buffer=self.shm.buf, offset=16)
+        self.spectra = np.ndarray((2,) + self.shape, dtype=np.float32, buffer=self.shm.buf, offset=96)
+        if self.owner:
+            self.header[:] = 0
+
+    def publish(self, result):
+        back = 1 - int(self.header[1])
+        self.spectra[back] = result.spectrum
+        self.scalars[back] = (result.hz, result.error, result.end, result.pitch, result.confidence)
+        self.header[1] = back
+        self.header[0] += 1
+
+    def sequence(self):
+        # newest sequence without copying the result; 0 once closed
+        if self.header is None:
+            return 0
+        return int(self.header[0])
+
+    def latest(self):
+        if self.header is None:
+            # closed by stop(), a wakeup queued before it may still ask
+            return 0, None
+        while True:
+            sequence = int(self.header[0])
+            if sequence == 0:
+                return 0, None
+            front = int(self.header[1])
+            spectrum = self.spectra[front].copy()
+            hz, error, end, pitch, confidence = self.scalars[front]
+            if int(self.header[0]) == sequence:
+                return sequence, AnalysisResult(spectrum, hz, error, int(end), pitch, confidence)
+
+    def close(self):
+        self.header = self.scalars = self.spectra = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class InlineWorker:
+    # DspWorker interface without a thread: the task runs when the UI polls for a result,
+    # so the UI is woken by new blocks rather than new results
+    def __init__(self, source, task):
+        self.source = source
+        self.task = task
+        self.sequence = 0
+        self.result = None
+        self.wakeup = source.new_block
+        self.task.setup()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def configure(self, **changes):
+        self.task.configure(**changes)
+
+    def latest(self):
+        result = self.task(self.source.ring)
+        if result is not None:
+            self.sequence += 1
+            self.result = result
+        return self.sequence, self.result
+
+
+class DspWorker:
+    # Runs a task on its own thread against source.ring (re-read every pass, so ring
+    # swaps on stream restarts are picked up) and publishes into a ResultSlot. Between
+    # results it sleeps until the source's next block (sources without new_block are
+    # polled every `interval`), readers wait on `wakeup`.
+
+    def __init__(self, source, task, interval=0.002):
+        self.source = source
+        self.task = task
+        self.interval = interval
+        self.slot = ResultSlot()
+        self.wakeup = self.slot.wakeup
+        self.running = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.task.setup()
+        self.running.set()
+        self.thread = threading.Thread(target=self.run, name='dsp-worker', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        new_block = getattr(self.source, 'new_block', None)
+        while self.running.is_set():
+            # taken before the task runs, a block landing meanwhile ends the wait at once
+            seen = new_block.sequence if new_block is not None else 0
+            result = self.task(self.source.ring)
+            if result is not None:
+                self.slot.publish(result)
+            elif new_block is not None:
+                new_block.wait(seen)
+            else:
+                time.sleep(self.interval)
+
+    def configure(self, **changes):
+        self.task.configure(**changes)
+
+    def latest(self):
+        return self.slot.latest()
+
+    def stop(self):
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def send_reports(reporters, reports):
+    for index, stats in reporters:
+        stages, counters = report = stats.report()
+        if stages or counters:
+            reports.put((index, report))
+
+
+def process_main(tasks, indices, ring_specs, slot_specs, control, stop, interval, published, reports):
+    # entry point of DspPool / DspProcess children: runs the tasks of their sources in
+    # turn; control messages name the source by its position here, `published` is set
+    # after every pass that produced a result. What the tasks record in their `stats`
+    # goes back as (source index, Instrumentation.report()) on `reports` every
+    # STATS_INTERVAL; tasks sharing one Instrumentation report it once.
+    for task in tasks:
+        task.setup()
+    reporters = {}
+    for index, task in zip(indices, tasks):
+        stats = getattr(task, 'stats', None)
+        if stats is not None and id(stats) not in reporters:
+            # the history that came along in the pickle is the parent's own
+            stats.report()
+            reporters[id(stats)] = (index, stats)
+    reporters = list(reporters.values())
+    next_report = time.perf_counter() + STATS_INTERVAL
+    rings = [SharedRingBuffer(*spec[:3], name=spec[3]) for spec in ring_specs]
+    slots = [SharedResultSlot(*spec) for spec in slot_specs]
+    while not stop.is_set():
+        while not control.empty():
+            command, position, value = control.get()
+            if command == 'configure':
+                tasks[position].configure(**value)
+            elif command == 'ring':
+                rings[position].close()
+                rings[position] = SharedRingBuffer(*value[:3], name=value[3])
+            elif command == 'slot':
+                slots[position].close()
+                slots[position] = SharedResultSlot(*value)
+        produced = False
+        for task, ring, slot in zip(tasks, rings, slots):
+            result = task(ring)
+            # frames computed across a ring/slot swap are dropped
+            if result is not None and result.spectrum.shape == slot.shape:
+                slot.publish(result)
+                produced = True
+        if produced:
+            published.set()
+        else:
+            time.sleep(interval)
+        if time.perf_counter() >= next_report:
+            send_reports(reporters, reports)
+            next_report = time.perf_counter() + STATS_INTERVAL
+    send_reports(reporters, reports)
+    for ring in rings:
+        ring.close()
+    for slot in slots:
+        slot.close()
+
+
+class DspPool:
+    # Several sources, each capturing into a SharedRingBuffer (AudioIn(shared=True)),
+    # analysed by `processes` worker processes: sources are dealt round-robin onto the
+    # processes (default one each), a process runs the tasks of its sources in turn.
+    # Every source has its own SharedResultSlot, latest(index) reads one of them.
+    # The children poll their shared rings every `interval`, the capture callback's
+    # Condition does not cross processes; a relay thread turns their `published` event
+    # into bumps of `wakeup` here, on a new result of any source.
+
+    def __init__(self, sources, tasks, processes=None, interval=0.002):
+        self.sources = list(sources)
+        self.tasks = list(tasks)
+        count = len(self.sources)
+        self.processes = count if processes is None else max(1, min(int(processes), count))
+        self.interval = interval
+        # (process, control queue) per child, empty while stopped
+        self.children = []
+        self.rings = []
+        self.slots = []
+        self.wakeup = Wakeup()
+        self.relay_thread = None
+
+    def start(self):
+        self.rings = [source.ring for source in self.sources]
+        self.slots = [SharedResultSlot(task.result_shape(ring.channels)) for task, ring in zip(self.tasks, self.rings)]
+        self.stopping = multiprocessing.Event()
+        self.published = multiprocessing.Event()
+        self.reports = multiprocessing.Queue()
+        self.children = []
+        for child in range(self.processes):
+            members = range(child, len(self.sources), self.processes)
+            control = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=process_main, name=f'dsp-process-{child}', daemon=True,
+                args=([self.tasks[i] for i in members], list(members), [self.rings[i].spec() for i in members],
+                      [(self.slots[i].shape, self.slots[i].name) for i in members],
+                      control, self.stopping, self.interval, self.published, self.reports))
+            process.start()
+            self.children.append((process, control))
+        self.relay_thread = threading.Thread(target=self.relay, name='dsp-relay', daemon=True)
+        self.relay_thread.start()
+
+    def relay(self):
+        while not self.stopping.is_set():
+            if self.published.wait(WAIT_TIMEOUT):
+                # cleared before the bump: a result published in between sets it again
+                self.published.clear()
+                self.wakeup.bump()
+            elif any(source.ring is not ring for source, ring in zip(self.sources, self.rings)):
+                # a source swapped its ring and the children went quiet; the reader's
+                # latest() re-attaches them
+                self.wakeup.bump()
+            self.merge_reports()
+
+    def merge_reports(self):
+        # the children's stage timings and counters into the tasks' stats here
+        while True:
+            try:
+                index, report = self.reports.get_nowait()
+            except queue.Empty:
+                return
+            self.tasks[index].stats.merge(report)
+
+    def send(self, index, command, value):
+        # control message about source `index` to the child running it
+        _, control = self.children[index % self.processes]
+        control.put((command, index // self.processes, value))
+
+    def sync_ring(self, index):
+        # the source replaced its ring (stream restarted with other settings), re-attach
+        ring = self.sources[index].ring
+        if self.children and ring is not self.rings[index]:
+            self.rings[index] = ring
+            self.send(index, 'ring', ring.spec())
+            self.sync_slot(index)
+
+    def sync_slot(self, index):
+        shape = self.tasks[index].result_shape(self.rings[index].channels)
+        if shape != self.slots[index].shape:
+            old = self.slots[index]
+            self.slots[index] = SharedResultSlot(shape)
+            self.send(index, 'slot', (shape, self.slots[index].name))
+            old.close()
+
+    def configure(self, index=None, **changes):
+        # the task of source `index`, or of every source with None; before start() the
+        # changed tasks are simply pickled into the children
+        for i in range(len(self.tasks)) if index is None else [index]:
+            self.tasks[i].configure(**changes)
+            if self.children:
+                self.send(i, 'configure', changes)
+                self.sync_slot(i)
+
+    def latest(self, index=0):
+        self.sync_ring(index)
+        return self.slots[index].latest()
+
+    def sequence(self, index=0):
+        # cheap check before latest(), which copies the spectrum out of shared memory
+        self.sync_ring(index)
+        return self.slots[index].sequence()
+
+    def stop(self):
+        if self.children:
+            self.stopping.set()
+            for process, _ in self.children:
+                process.join()
+            self.relay_thread.join()
+            # the children's last reports
+            self.merge_reports()
+            self.children = []
+            for slot in self.slots:
+                slot.close()
+
+
+class DspProcess(DspPool):
+    # Same interface as DspWorker, but the task runs in a separate process so the FFT
+    # gets its own core regardless of the GIL: a DspPool of one source.
+
+    def __init__(self, source, task, interval=0.002):
+        super().__init__([source], [task], processes=1, interval=interval)
+        self.source = source
+        self.task = task
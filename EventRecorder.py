@@ -0,0 +1,192 @@
+import os
+import queue
+import sys
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+
+from RingBuffer import MappedRingBuffer
+from OfflineAnalysis import write_wav, analyze
+from Instrumentation import Instrumentation
+
+# an event waiting for its post-trigger samples; `end` is a history ring index
+Event = namedtuple('Event', ['name', 'end', 'time', 'spectrum', 'hz'])
+
+
+class LevelTrigger:
+    # Fires when the spectrum peak between fmin and fmax rises above `threshold`
+    # (magnitude in int16 units, the scale of bar_data). Re-arms once it drops below.
+    def __init__(self, threshold, fmin=0.0, fmax=None, name='level'):
+        self.threshold = threshold
+        self.fmin = fmin
+        self.fmax = fmax
+        self.name = name
+        self.active = False
+
+    def __call__(self, result, rate):
+        spectrum = result.spectrum.max(axis=0) if result.spectrum.ndim == 2 else result.spectrum
+        resolution = rate / (2 * len(spectrum))
+        first = int(self.fmin / resolution)
+        last = len(spectrum) if self.fmax is None else int(self.fmax / resolution) + 1
+        above = spectrum[first:last].max(initial=0) > self.threshold
+        fired = above and not self.active
+        self.active = above
+        return fired
+
+
+class BandTrigger:
+    # Fires when the Hz readout enters [low, high], re-arms when it leaves
+    def __init__(self, low, high, name='band'):
+        self.low = low
+        self.high = high
+        self.name = name
+        self.active = False
+
+    def __call__(self, result, rate):
+        inside = self.low <= result.hz <= self.high
+        fired = inside and not self.active
+        self.active = inside
+        return fired
+
+
+class EventRecorder:
+    # Keeps the last `seconds` of raw capture in a file-backed MappedRingBuffer and
+    # dumps `pre` + `post` seconds around every trigger to <directory>/<time>_<rule>.wav,
+    # with the triggering spectrum and a spectrogram/peak track of the window
+    # (OfflineAnalysis.analyze) next to it.
+    # The capture callback is never involved: a recorder thread copies new blocks from
+    # source.ring into the history, and a writer thread does the dumps. Results are
+    # handed in with submit() by whoever already polls the worker.
+
+    def __init__(self, source, triggers, directory='events', seconds=30.0, pre=2.0, post=2.0, interval=0.05,
+                 max_pending=8, stats=None):
+        self.source = source
+        self.triggers = list(triggers)
+        self.directory = directory
+        self.seconds = seconds
+        self.pre = pre
+        self.post = post
+        self.interval = interval
+        self.stats = stats if stats is not None else Instrumentation()
+        os.makedirs(directory, exist_ok=True)
+        self.history = None
+        self.ring = None
+        self.rate = source.rate
+        # history index = capture ring index + offset, re-based on ring swaps
+        self.offset = 0
+        self.pending = []
+        self.lock = threading.Lock()
+        self.dumps = queue.Queue(maxsize=max_pending)
+        self.running = threading.Event()
+        self.threads = []
+
+    def start(self):
+        self.attach()
+        self.running.set()
+        self.threads = [threading.Thread(target=self.run, name='event-recorder', daemon=True),
+                        threading.Thread(target=self.write_events, name='event-writer', daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def attach(self):
+        # (re)start copying from the source's current ring
+        ring = self.source.ring
+        rate = self.source.rate
+        capacity = int(self.seconds * rate)
+        if (self.history is None or self.history.channels != ring.channels or self.history.dtype != ring.dtype
+                or self.history.capacity != capacity):
+            if self.history is not None:
+                self.history.close()
+            self.history = MappedRingBuffer(capacity, os.path.join(self.directory, 'history.raw'),
+                                            dtype=ring.dtype, channels=ring.channels)
+            with self.lock:
+                self.pending = []
+        self.ring = ring
+        self.rate = rate
+        self.offset = self.history.write_index - ring.write_index
+
+    def run(self):
+        while self.running.is_set():
+            if self.source.ring is not self.ring or self.source.rate != self.rate:
+                self.attach()
+            self.copy()
+            self.release()
+            time.sleep(self.interval)
+
+    def copy(self):
+        # new capture samples into the history, straight from the ring's views
+        written = self.ring.write_index
+        missing = written + self.offset - self.history.write_index
+        if missing <= 0:
+            return
+        if missing > self.ring.capacity:
+            # fell behind the capture ring, the gap is skipped
+            self.stats.count('history_overruns')
+            self.history.write_index += missing - self.ring.capacity
+            missing = self.ring.capacity
+        self.history.write(self.ring.window(written, missing))
+
+    def submit(self, result):
+        # check one AnalysisResult against the triggers, cheap enough for the UI thread
+        for trigger in self.triggers:
+            if trigger(result, self.rate):
+                event = Event(trigger.name, result.end + self.offset, time.time(), result.spectrum, result.hz)
+                with self.lock:
+                    self.pending.append(event)
+                self.stats.count('events')
+
+    def release(self):
+        # events whose post-trigger samples have arrived go to the writer
+        post = int(self.post * self.rate)
+        written = self.history.write_index
+        with self.lock:
+            ready = [event for event in self.pending if written >= event.end + post]
+            self.pending = [event for event in self.pending if written < event.end + post]
+        for event in ready:
+            try:
+                self.dumps.put_nowait(event)
+            except queue.Full:
+                self.stats.count('events_dropped')
+
+    def write_events(self):
+        while self.running.is_set() or not self.dumps.empty():
+            try:
+                event = self.dumps.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                with self.stats.timer('event_dump'):
+                    self.dump(event)
+            except (OSError, ValueError) as e:
+                # a full disk or a history swapped mid-dump must not end the writer
+                print(f'event {event.name}: {e}', file=sys.stderr)
+                self.stats.count('event_write_errors')
+
+    def dump(self, event):
+        history = self.history
+        pre, post = int(self.pre * self.rate), int(self.post * self.rate)
+        size = min(pre + post, history.capacity)
+        end = event.end + post
+        if history.write_index - end + size > history.capacity:
+            # overwritten while queued
+            self.stats.count('events_dropped')
+            return
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(event.time)) + f'.{int(event.time * 1000) % 1000:03d}'
+        prefix = os.path.join(self.directory, f'{stamp}_{event.name}')
+        # views into the mapped history, nothing is copied as a whole
+        window = history.window(end, size)
+        write_wav(prefix + '.wav', window, self.rate)
+        np.save(prefix + '_trigger_spectrum.npy', event.spectrum)
+        # spectrogram and peak track of the first channel
+        analyze(window if window.ndim == 1 else window[:, 0], self.rate, prefix, batch=32, gain=1.0)
+        if history.write_index - end + size > history.capacity:
+            self.stats.count('events_truncated')
+
+    def stop(self):
+        self.running.clear()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.history is not None:
+            self.history.close()
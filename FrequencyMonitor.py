@@ -1,9 +1,21 @@
 import sys
-from AudioInputStream import AudioIn
+import time
+from collections import deque
+from AudioInputStream import AudioIn, SAMPLE_FORMATS
+from SpectralEngine import CHANNEL_MODES
+from PeakEstimator import ESTIMATORS
+from PitchTracker import PITCH_DETECTORS
+from RingBuffer import RingBuffer
+from DspWorker import SpectrumTask, InlineWorker, DspWorker, DspProcess, DspPool
+from Instrumentation import Instrumentation, JsonDumper
+from Waterfall import Waterfall
+from SpectrumServer import RemoteWorker, RemoteSource
+from ToneDetector import ToneTask
 import numpy as np
 
-from PyQt5.QtCore import QTimer
-from PyQt5.QtWidgets import QWidget, QPushButton, QHBoxLayout, QVBoxLayout, QLabel, QComboBox, QSlider
+from PyQt5.QtCore import QTimer, QObject, pyqtSignal
+from PyQt5.QtWidgets import (QWidget, QPushButton, QHBoxLayout, QVBoxLayout, QGridLayout, QLabel, QComboBox,
+                             QSlider, QFrame, QProgressBar, QLineEdit)
 from PyQt5 import QtWidgets
 from PyQt5.QtCore import Qt
 
@@ -13,10 +25,40 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
 
 SAMPLE_RATE = 44100
+# PortAudio buffer size, also the shortest useful hop
+BLOCK_SIZE = 512
+HOP_NORMAL = SAMPLE_RATE // 10
+HOP_FAST = BLOCK_SIZE
+# FFT sizes offered, SAMPLE_RATE gives 1 Hz bins
+FFT_SIZES = (4096, 8192, 16384, 22050, 44100, 88200)
+MAX_CHANNELS = 8
+# one colour per channel in 'channels' mode
+LINE_COLORS = ['r', 'y', 'c', 'm', 'g', 'w', 'b', 'orange']
+# waterfall history, image size (bins and frames are max-pooled down to it) and dB colour scale
+WATERFALL_SECONDS = 60
+WATERFALL_ROWS = 300
+WATERFALL_COLUMNS = 1024
+WATERFALL_FLOOR_DB = 0.0
+WATERFALL_RANGE_DB = 80.0
+WATERFALL_CMAP = 'inferno'
+PITCH_COLOR = 'c'
+# device grid: tiles per row and the range of the level meters in dB below int16 full scale
+GRID_COLUMNS = 4
+LEVEL_RANGE_DB = 96
+# tone monitor: watched frequencies (mains hum and harmonics), on threshold in dBFS, event lines shown
+DEFAULT_TONES = (50.0, 100.0, 150.0, 200.0, 250.0)
+TONE_THRESHOLD_DB = -60.0
+TONE_LOG_LINES = 6
+
+class ResultSignal(QObject):
+    # carries worker wakeups from the worker's thread to the UI thread (queued connection)
+    arrived = pyqtSignal()
+
 
 class MainWindow(QtWidgets.QMainWindow):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, dsp='thread', backend=None, stats_file=None, remote=None, sample_format='int16',
+                 **kwargs):
         super(MainWindow, self).__init__(*args, **kwargs)
         self.title = 'Frequency Monitor and Analyzer'
         self.setWindowTitle(self.title)
@@ -26,17 +68,75 @@ class MainWindow(QtWidgets.QMainWindow):
         self.left = 10
         self.top = 10
 
+        # FFT size from the FFT size box (1 Hz bins to start with), fast mode only shortens
+        # the hop between spectra
         self.chunk = SAMPLE_RATE
+        self.block = BLOCK_SIZE
+        self.rate = SAMPLE_RATE
+        self.hop = HOP_NORMAL
         self.refresh_rate = 10
+        # 'mono' captures one channel, the CHANNEL_MODES capture every input channel of the device
+        self.channel_mode = 'mono'
+        self.channels = 1
 
         self.monitor_on = False
         self.fast_mode_on = False
+        # zoom analyses only the slider's 0..x_range band, decimated to a smaller FFT
+        self.zoom_on = False
+        self.x_range = 5000
         self.input_device_id = None
 
+        # update_data runs when the worker signals a new result (or, for the inline worker,
+        # a new block); one signal at most is in flight, a busy UI coalesces results.
+        # Workers without a wakeup are polled every refresh_rate ms instead.
+        self.result_signal = ResultSignal()
+        self.result_signal.arrived.connect(self.update_data)
+        self.update_pending = False
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_data)
 
-        self.myaudio = AudioIn(chunk=self.chunk)
+        # analysis runs 'inline' in update_data, on a DSP 'thread' or in a DSP 'process';
+        # update_data only fetches the worker's latest result and draws it
+        self.dsp = dsp
+        # None opens PortAudio, or pass e.g. AudioSources.SyntheticBackend()
+        self.backend = backend
+        # stage timings and counters, shown by the STATS overlay and dumped to stats_file as JSON
+        self.stats = Instrumentation()
+        self.stats_dumper = None
+        if stats_file:
+            self.stats_dumper = JsonDumper(self.stats, stats_file)
+            self.stats_dumper.start()
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.update_stats)
+        # thin client: with remote='host:port' spectra come from a SpectrumServer, no device is opened
+        self.remote = remote
+        if remote:
+            self.myaudio = RemoteSource(remote, stats=self.stats)
+        else:
+            self.myaudio = AudioIn(chunk=self.block, history=2 * self.chunk, shared=(dsp == 'process'),
+                                   backend=backend, stats=self.stats, sample_format=sample_format)
+        self.task = SpectrumTask(self.chunk, self.rate, self.hop, estimator='gaussian', stats=self.stats)
+        self.worker = self.make_worker()
+        self.last_sequence = 0
+        # every displayed spectrum becomes a waterfall row, shown or not
+        self.waterfall = Waterfall(WATERFALL_ROWS, self.chunk // 2, columns=WATERFALL_COLUMNS,
+                                   stride=self.waterfall_stride(), floor_db=WATERFALL_FLOOR_DB,
+                                   range_db=WATERFALL_RANGE_DB)
+        self.waterfall_on = False
+        # smoothed pitch at every waterfall row, drawn over the image while tracking
+        self.pitch_track = RingBuffer(WATERFALL_ROWS, dtype=np.float32)
+        self.pitch_track.buffer[:] = np.nan
+        self.pitch_row = np.empty(1, dtype=np.float32)
+        # tone monitor: a ToneTask on a DspWorker of its own next to the spectrum worker,
+        # only running while TONES is on; its results wake update_tones like update_data
+        self.tone_task = ToneTask(DEFAULT_TONES, self.rate, hop=self.block, threshold=TONE_THRESHOLD_DB,
+                                  stats=self.stats)
+        self.tone_worker = None
+        self.tone_signal = ResultSignal()
+        self.tone_signal.arrived.connect(self.update_tones)
+        self.tone_pending = False
+        self.last_tone_end = 0
+        self.tone_log = deque(maxlen=TONE_LOG_LINES)
 
         self.initUI()
         self.show()
@@ -60,6 +160,56 @@ class MainWindow(QtWidgets.QMainWindow):
         comboBox.activated[str].connect(self.input_choice)
         input_layout.addWidget(comboBox)
 
+        # Drop down menu for the peak frequency estimator
+        estimator_box = QComboBox(self)
+        estimator_box.setMaximumWidth(100)
+        estimator_box.setToolTip('Peak frequency estimator')
+        for name in ESTIMATORS:
+            estimator_box.addItem(name)
+        estimator_box.setCurrentText(self.task.estimator)
+        estimator_box.activated[str].connect(self.estimator_choice)
+        input_layout.addWidget(estimator_box)
+
+        # Drop down menu for the pitch tracker, when on the readout shows the fundamental
+        pitch_box = QComboBox(self)
+        pitch_box.setMaximumWidth(90)
+        pitch_box.setToolTip('Pitch (fundamental) tracker')
+        for name in ('off',) + tuple(PITCH_DETECTORS):
+            pitch_box.addItem(name)
+        pitch_box.setCurrentText(self.task.pitch)
+        pitch_box.activated[str].connect(self.pitch_choice)
+        input_layout.addWidget(pitch_box)
+
+        # Drop down menu for the multi-channel display mode
+        channel_box = QComboBox(self)
+        channel_box.setMaximumWidth(100)
+        channel_box.setToolTip('Channel display mode')
+        for mode in ('mono',) + CHANNEL_MODES:
+            channel_box.addItem(mode)
+        channel_box.activated[str].connect(self.channel_mode_choice)
+        input_layout.addWidget(channel_box)
+
+        # Drop down menu for the capture sample format
+        format_box = QComboBox(self)
+        format_box.setMaximumWidth(80)
+        format_box.setToolTip('Capture sample format')
+        for name in SAMPLE_FORMATS:
+            format_box.addItem(name)
+        format_box.setCurrentText(getattr(self.myaudio, 'sample_format', 'int16'))
+        format_box.activated[str].connect(self.sample_format_choice)
+        input_layout.addWidget(format_box)
+
+        # Drop down menu for the FFT size, changed without restarting the monitor
+        fft_size_box = QComboBox(self)
+        fft_size_box.setMaximumWidth(80)
+        fft_size_box.setToolTip('FFT size in samples')
+        for size in FFT_SIZES:
+            fft_size_box.addItem(str(size))
+        fft_size_box.setCurrentText(str(self.chunk))
+        fft_size_box.setEnabled(not self.remote)
+        fft_size_box.activated[str].connect(self.fft_size_choice)
+        input_layout.addWidget(fft_size_box)
+
         # ON-OFF Monitor
         self.button_on = QPushButton('MONITOR - OFF', self)
         self.button_on.setToolTip('Turn Line-In/Mic  On / Off')
@@ -79,6 +229,44 @@ class MainWindow(QtWidgets.QMainWindow):
         self.button_fast.clicked.connect(self.toggle_fastmode)
         input_layout.addWidget(self.button_fast)
 
+        self.button_zoom = QPushButton('ZOOM', self)
+        self.button_zoom.setToolTip('Analyse only the frequency range of the slider, decimated to a smaller FFT')
+        self.button_zoom.setStyleSheet("background-color: #777777")
+        self.button_zoom.setMinimumHeight(50)
+        self.button_zoom.setMaximumWidth(80)
+        self.button_zoom.clicked.connect(self.toggle_zoom)
+        input_layout.addWidget(self.button_zoom)
+
+        self.button_waterfall = QPushButton('WATERFALL', self)
+        self.button_waterfall.setToolTip(f'Show / hide the last {WATERFALL_SECONDS} s as a spectrogram')
+        self.button_waterfall.setStyleSheet("background-color: #777777")
+        self.button_waterfall.setMinimumHeight(50)
+        self.button_waterfall.setMaximumWidth(100)
+        self.button_waterfall.clicked.connect(self.toggle_waterfall)
+        input_layout.addWidget(self.button_waterfall)
+
+        self.button_stats = QPushButton('STATS', self)
+        self.button_stats.setToolTip('Show / hide timing statistics')
+        self.button_stats.setStyleSheet("background-color: #777777")
+        self.button_stats.setMinimumHeight(50)
+        self.button_stats.setMaximumWidth(80)
+        self.button_stats.clicked.connect(self.toggle_stats)
+        input_layout.addWidget(self.button_stats)
+
+        self.button_tones = QPushButton('TONES', self)
+        self.button_tones.setToolTip('Show / hide the level of every frequency listed next to it')
+        self.button_tones.setStyleSheet("background-color: #777777")
+        self.button_tones.setMinimumHeight(50)
+        self.button_tones.setMaximumWidth(80)
+        self.button_tones.clicked.connect(self.toggle_tones)
+        input_layout.addWidget(self.button_tones)
+
+        self.tones_edit = QLineEdit(' '.join(f'{hz:g}' for hz in DEFAULT_TONES), self)
+        self.tones_edit.setToolTip('Frequencies of the tone monitor in Hz, Enter applies')
+        self.tones_edit.setMaximumWidth(150)
+        self.tones_edit.returnPressed.connect(self.tones_changed)
+        input_layout.addWidget(self.tones_edit)
+
         input_widget = QWidget()
         input_widget.setMaximumHeight(50)
         input_widget.setLayout(input_layout)
@@ -106,6 +294,18 @@ class MainWindow(QtWidgets.QMainWindow):
         self.hz_txt_label.setStyleSheet("color : red; font-size:30px;")
         info_layout.addWidget(self.hz_txt_label)
 
+        self.stats_label = QLabel()
+        self.stats_label.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self.stats_label.setStyleSheet("color : #dddddd; font-size:10px; font-family: monospace;")
+        self.stats_label.hide()
+        info_layout.addWidget(self.stats_label)
+
+        self.tones_label = QLabel()
+        self.tones_label.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self.tones_label.setStyleSheet("color : #dddddd; font-size:10px; font-family: monospace;")
+        self.tones_label.hide()
+        info_layout.addWidget(self.tones_label)
+
         control_label_layout = QHBoxLayout()
         self.freq_label = QLabel("Frequency")
         self.freq_label.setAlignment(Qt.AlignCenter)
@@ -126,7 +326,7 @@ class MainWindow(QtWidgets.QMainWindow):
         slider0 = QSlider(Qt.Horizontal)
         slider0.setMinimum(1000)
         slider0.setMaximum(10000)
-        slider0.setValue(5000)
+        slider0.setValue(self.x_range)
         slider0.setMaximumWidth(300)
         slider0.setStyleSheet(
             "QSlider::handle:horizontal {background: qlineargradient(x1:0, y1:0, x2:1, y2:1, stop:0 #b4b4b4, stop:1 #3a3a3a); border: 1px solid #5c5c5c; width: 10px; border-radius: 3px; margin: -7px 0;} \
@@ -171,82 +371,446 @@ class MainWindow(QtWidgets.QMainWindow):
             self.stop_stream()
 
     def start_stream(self):
-        self.myaudio.start_stream(chunk=self.chunk, device=self.input_device_id)
+        self.myaudio.start_stream(rate=self.rate, chunk=self.block, device=self.input_device_id,
+                                  channels=self.channels)
+        self.last_sequence = 0
+        self.worker.start()
         self.monitor_on = True
         self.button_on.setText('MONITOR - ON')
         self.button_on.setStyleSheet("background-color: #3a3a3a; color: green")
-        self.timer.start(self.refresh_rate)
-        
+        wakeup = getattr(self.worker, 'wakeup', None)
+        if wakeup is None:
+            self.timer.start(self.refresh_rate)
+        else:
+            wakeup.subscribe(self.result_arrived)
+        if self.tone_worker is not None:
+            self.start_tones()
+
     def stop_stream(self):
+        if self.tone_worker is not None:
+            self.stop_tones()
+        self.worker.stop()
         self.myaudio.stop_stream()
         self.monitor_on = False
         self.button_on.setText('MONITOR - OFF')
         self.button_on.setStyleSheet("background-color: #777777")
+        wakeup = getattr(self.worker, 'wakeup', None)
+        if wakeup is not None:
+            wakeup.unsubscribe(self.result_arrived)
         self.timer.stop()
 
-    def restart_stream(self):
+    def restart_stream(self, chunk=None, block=None, rate=None):
+        # New FFT size, capture block or sample rate without rebuilding anything: AudioIn
+        # reopens just its stream on the same PortAudio context, the worker keeps running
+        # and swaps its FFT plan, the plot moves its x data in place.
+        self.chunk = chunk or self.chunk
+        self.block = block or self.block
+        self.rate = rate or self.rate
+        # the ring grows first so the task never asks for more history than it holds
+        self.myaudio.reconfigure(rate=self.rate, chunk=self.block, channels=self.channels,
+                                 device=self.input_device_id, history=2 * self.chunk)
+        self.configure(size=self.chunk, rate=self.rate)
+        self.mpl_canvas.set_frequencies(*self.task.spectrum_layout())
+        self.configure_tones(rate=self.rate, hop=self.block)
+
+    def make_worker(self):
+        if self.remote:
+            return RemoteWorker(self.remote, stats=self.stats)
+        if self.dsp == 'thread':
+            return DspWorker(self.myaudio, self.task)
+        if self.dsp == 'process':
+            return DspProcess(self.myaudio, self.task)
+        return InlineWorker(self.myaudio, self.task)
+
+    def configure(self, **changes):
+        self.worker.configure(**changes)
+
+    def closeEvent(self, event):
         if self.monitor_on:
-            self.myaudio.stop_stream()
-        self.mpl_canvas.bx.clear()
-        self.mpl_canvas.init_plot(chunk=self.chunk)
-        self.myaudio = AudioIn(chunk=self.chunk)
-        if self.monitor_on:
-            self.start_stream()
+            self.stop_stream()
+        self.myaudio.close()
+        if self.stats_dumper is not None:
+            self.stats_dumper.stop()
+        super(MainWindow, self).closeEvent(event)
 
     def toggle_fastmode(self):
         if not self.fast_mode_on:
             self.fast_mode_on = True
-            self.chunk=4100
+            self.hop = HOP_FAST
             self.button_fast.setText('FAST MODE - ON')
             self.button_fast.setStyleSheet("background-color: #3a3a3a; color: green")
         else:
             self.fast_mode_on = False
-            self.chunk = 41000
+            self.hop = HOP_NORMAL
             self.button_fast.setText('FAST MODE - OFF')
             self.button_fast.setStyleSheet("background-color: #777777")
-        self.restart_stream()
+        self.configure(hop=self.hop)
+        self.waterfall.set_stride(self.waterfall_stride())
+        if self.waterfall_on:
+            self.mpl_canvas.set_waterfall(self.waterfall, self.waterfall_span())
+
+    def toggle_zoom(self):
+        if self.remote:
+            # the server decides what is analysed
+            return
+        self.zoom_on = not self.zoom_on
+        self.configure(zoom=self.x_range if self.zoom_on else 0)
+        self.mpl_canvas.set_frequencies(*self.task.spectrum_layout())
+        if self.zoom_on:
+            self.button_zoom.setStyleSheet("background-color: #3a3a3a; color: green")
+        else:
+            self.button_zoom.setStyleSheet("background-color: #777777")
+
+    def waterfall_stride(self):
+        # spectra per waterfall row so that WATERFALL_ROWS cover WATERFALL_SECONDS
+        return max(1, round(WATERFALL_SECONDS * self.rate / (self.hop * WATERFALL_ROWS)))
+
+    def waterfall_span(self):
+        return self.waterfall.depth * self.waterfall.stride * self.hop / self.rate
+
+    def toggle_waterfall(self):
+        self.waterfall_on = not self.waterfall_on
+        if self.waterfall_on:
+            self.mpl_canvas.set_waterfall(self.waterfall, self.waterfall_span())
+            self.button_waterfall.setStyleSheet("background-color: #3a3a3a; color: green")
+        else:
+            self.mpl_canvas.set_waterfall(None)
+            self.button_waterfall.setStyleSheet("background-color: #777777")
+
+    def result_arrived(self, sequence):
+        # runs on the worker (or capture) thread
+        if not self.update_pending:
+            self.update_pending = True
+            self.result_signal.arrived.emit()
 
     def update_data(self):
-        bar_data = self.calc_FFT(self.myaudio.audio)
-        hz = bar_data.argmax(axis=0) * SAMPLE_RATE / self.chunk
-        self.mpl_canvas.update_plot(bar_data)
-        self.hz_label.setText(str(int(hz)))
-
-    def calc_FFT(self, data):
-        N = data.size
-        fft = np.fft.fft(data)
-        abs_data = np.abs(fft)
-        bar_data = abs_data[:N // 2] * 1 / N
-        return bar_data
+        self.update_pending = False
+        if not self.monitor_on:
+            # a wakeup queued before MONITOR OFF or close; the worker is stopped
+            return
+        sequence, result = self.worker.latest()
+        if result is None or sequence == self.last_sequence:
+            return
+        if self.last_sequence and sequence - self.last_sequence > 1:
+            # results the UI never showed because it was slower than the analysis
+            self.stats.count('dropped_results', sequence - self.last_sequence - 1)
+        self.last_sequence = sequence
+        band_frames = False
+        if self.remote:
+            # the server decides FFT size and rate, and whether frames hold bins or bands
+            bands = self.worker.bands
+            band_frames = bands is not None
+            if band_frames:
+                self.mpl_canvas.set_bands(bands)
+            else:
+                self.mpl_canvas.set_frequencies(self.worker.size, self.worker.rate)
+        with self.stats.timer('render'):
+            # bands are not evenly spaced in Hz, they stay out of the waterfall image
+            if not band_frames and self.waterfall.push(result.spectrum):
+                self.pitch_row[0] = result.pitch
+                self.pitch_track.write(self.pitch_row)
+            tracking = self.task.pitch != 'off' or not np.isnan(result.pitch)
+            self.mpl_canvas.set_pitch(result.pitch, self.pitch_track.latest(WATERFALL_ROWS) if tracking else None)
+            self.mpl_canvas.update_plot(result.spectrum)
+            if not tracking:
+                self.hz_label.setText(f'{result.hz:.1f}')
+                self.hz_label.setToolTip(f'\u00b1 {result.error:.2f} Hz ({self.task.estimator})')
+            else:
+                self.hz_label.setText('-' if np.isnan(result.pitch) else f'{result.pitch:.1f}')
+                self.hz_label.setToolTip(f'pitch ({self.task.pitch}), confidence {result.confidence:.2f}; '
+                                         f'peak {result.hz:.1f} Hz')
+        captured = self.myaudio.sample_time(result.end - 1)
+        if captured is not None:
+            self.stats.record('latency', time.perf_counter() - captured)
+
+    def toggle_stats(self):
+        if self.stats_label.isVisible():
+            self.stats_label.hide()
+            self.stats_timer.stop()
+            self.button_stats.setStyleSheet("background-color: #777777")
+        else:
+            self.update_stats()
+            self.stats_label.show()
+            self.stats_timer.start(500)
+            self.button_stats.setStyleSheet("background-color: #3a3a3a; color: green")
+
+    def toggle_tones(self):
+        if self.remote:
+            # needs the samples, a thin client only gets spectra
+            return
+        if self.tone_worker is None:
+            self.tone_worker = DspWorker(self.myaudio, self.tone_task)
+            if self.monitor_on:
+                self.start_tones()
+            self.tones_label.setText('')
+            self.tones_label.show()
+            self.button_tones.setStyleSheet("background-color: #3a3a3a; color: green")
+        else:
+            if self.monitor_on:
+                self.stop_tones()
+            self.tone_worker = None
+            self.tones_label.hide()
+            self.button_tones.setStyleSheet("background-color: #777777")
+
+    def start_tones(self):
+        self.last_tone_end = 0
+        self.tone_worker.start()
+        self.tone_worker.wakeup.subscribe(self.tone_result_arrived)
+
+    def stop_tones(self):
+        self.tone_worker.wakeup.unsubscribe(self.tone_result_arrived)
+        self.tone_worker.stop()
+
+    def configure_tones(self, **changes):
+        if self.tone_worker is not None:
+            self.tone_worker.configure(**changes)
+        else:
+            self.tone_task.configure(**changes)
+
+    def tones_changed(self):
+        try:
+            tones = [float(value) for value in self.tones_edit.text().replace(',', ' ').split()]
+        except ValueError:
+            tones = []
+        if not tones:
+            self.tones_edit.setText(' '.join(f'{hz:g}' for hz in self.tone_task.tones))
+            return
+        self.tone_log.clear()
+        self.configure_tones(tones=tones)
+
+    def tone_result_arrived(self, sequence):
+        # runs on the tone worker's thread
+        if not self.tone_pending:
+            self.tone_pending = True
+            self.tone_signal.arrived.emit()
+
+    def update_tones(self):
+        self.tone_pending = False
+        if self.tone_worker is None:
+            return
+        _, result = self.tone_worker.latest()
+        if result is None or result.end == self.last_tone_end or len(result.levels) != len(self.tone_task.tones):
+            # nothing new, or measured before a change of the tone list
+            return
+        for event in result.events:
+            if event.end > self.last_tone_end:
+                stamp = time.strftime('%H:%M:%S')
+                self.tone_log.append(f'{stamp} {event.hz:8.1f} Hz {event.kind:>3} {event.level:6.1f} dB')
+        self.last_tone_end = result.end
+        lines = [f'{hz:8.1f} Hz {level:6.1f} dBFS {"ON" if on else ""}'
+                 for hz, level, on in zip(self.tone_task.tones, result.levels, result.active)]
+        self.tones_label.setText('\n'.join(lines + [''] + list(self.tone_log)))
+
+    def update_stats(self):
+        self.stats_label.setText('\n'.join(self.stats.summary_lines()))
+
+    def estimator_choice(self, choice):
+        self.configure(estimator=choice)
+
+    def pitch_choice(self, choice):
+        self.configure(pitch=choice)
+        self.pitch_track.buffer[:] = np.nan
 
     def input_choice(self, choice):
         self.input_device_id = self.myaudio.get_device_index_by_name(choice)
-        if self.monitor_on:
-            self.myaudio.stop_stream()
-            self.myaudio.start_stream(chunk=self.chunk, device=self.input_device_id)
+        self.myaudio.reconfigure(device=self.input_device_id)
+
+    def input_channels(self):
+        info = self.myaudio.get_device_info(self.input_device_id)
+        return max(1, min(int(info.get('maxInputChannels', 1)), MAX_CHANNELS))
+
+    def sample_format_choice(self, choice):
+        self.myaudio.reconfigure(sample_format=choice)
+
+    def channel_mode_choice(self, choice):
+        self.channel_mode = choice
+        channels = 1 if choice == 'mono' else self.input_channels()
+        if choice == 'diff' and channels < 2:
+            channels, choice = 1, 'sum'
+        self.configure(mode='sum' if choice == 'mono' else choice)
+        if channels != self.channels:
+            self.channels = channels
+            self.myaudio.reconfigure(channels=channels)
+
+    def fft_size_choice(self, choice):
+        self.restart_stream(chunk=int(choice))
 
     def slider_change(self, value):
+        self.x_range = value
+        if self.zoom_on:
+            # the task only re-plans when the decimation factor changes
+            self.configure(zoom=value)
+            self.mpl_canvas.set_frequencies(*self.task.spectrum_layout())
         self.mpl_canvas.bx.set_xlim([0, value])
+        self.mpl_canvas.invalidate_background()
         self.mpl_canvas.draw()
 
     def amplitude_change(self, value):
         self.mpl_canvas.bx.set_ylim([0, value])
+        self.mpl_canvas.invalidate_background()
         self.mpl_canvas.draw()
 
 
+class DeviceTile(QFrame):
+    # one device of the DeviceGridWindow: name, peak frequency, level meter and counters
+    def __init__(self, name, parent=None):
+        super(DeviceTile, self).__init__(parent)
+        self.setStyleSheet("background-color: #3a3a3a")
+        layout = QVBoxLayout()
+        self.name_label = QLabel(name)
+        self.name_label.setStyleSheet("color : #dddddd; font-size:12px;")
+        layout.addWidget(self.name_label)
+        self.hz_label = QLabel('-')
+        self.hz_label.setAlignment(Qt.AlignRight)
+        self.hz_label.setStyleSheet("color : red; font-size:24px")
+        layout.addWidget(self.hz_label)
+        self.level_bar = QProgressBar()
+        self.level_bar.setRange(-LEVEL_RANGE_DB, 0)
+        self.level_bar.setValue(-LEVEL_RANGE_DB)
+        self.level_bar.setTextVisible(False)
+        self.level_bar.setMaximumHeight(8)
+        layout.addWidget(self.level_bar)
+        self.info_label = QLabel()
+        self.info_label.setStyleSheet("color : #dddddd; font-size:10px; font-family: monospace;")
+        layout.addWidget(self.info_label)
+        self.setLayout(layout)
+
+    def show_result(self, result):
+        self.hz_label.setText(f'{result.hz:.1f} Hz')
+        self.hz_label.setToolTip(f'\u00b1 {result.error:.2f} Hz')
+
+    def show_input(self, level_db, counters):
+        self.level_bar.setValue(int(max(level_db, -LEVEL_RANGE_DB)))
+        self.info_label.setText(f'{level_db:6.1f} dBFS  overflows {counters.get("input_overflow", 0)}')
+
+    def show_error(self, message):
+        self.hz_label.setText('-')
+        self.info_label.setText(message)
+
+
+def block_level(audio):
+    # RMS of the newest block in dB relative to int16 full scale
+    block = audio.latest(audio.chunk)
+    rms = np.sqrt(np.mean(np.square(block, dtype=np.float64)))
+    return 20 * np.log10(max(rms, 1e-3) / 32768)
+
+
+class DeviceGridWindow(QtWidgets.QMainWindow):
+    # Several input devices at once: one AudioIn per device (device indices, default
+    # every input) capturing into a shared ring, analysed by a DspPool with `processes`
+    # worker processes (default one per device), shown as a grid of tiles with each
+    # device's peak frequency, input level and overflow counter. Devices that fail to
+    # open keep their tile with the error and are left out of the pool.
+
+    def __init__(self, *args, devices=None, processes=None, backend=None, hop=HOP_NORMAL, estimator='gaussian',
+                 columns=GRID_COLUMNS, **kwargs):
+        super(DeviceGridWindow, self).__init__(*args, **kwargs)
+        self.setWindowTitle('Frequency Monitor - devices')
+        self.setStyleSheet("background-color: #595959")
+        # the first AudioIn lists the devices and then captures the first one
+        probe = audio = AudioIn(chunk=BLOCK_SIZE, shared=True, backend=backend, stats=Instrumentation())
+        if devices is None:
+            devices = [info.get('index') for info in probe.get_input_devices_info()]
+        grid = QGridLayout()
+        self.audios = []
+        self.tiles = []
+        for i, device in enumerate(devices):
+            if audio is None:
+                audio = AudioIn(chunk=BLOCK_SIZE, shared=True, backend=backend, stats=Instrumentation())
+            tile = DeviceTile(str(device))
+            grid.addWidget(tile, i // columns, i % columns)
+            try:
+                info = probe.get_device_info(device)
+                tile.name_label.setText(f'{device}: {info.get("name")}')
+                rate = int(info.get('defaultSampleRate', SAMPLE_RATE))
+                # FFT of one second (1 Hz bins), the ring holds two
+                audio.history = 2 * rate
+                audio.start_stream(rate=rate, chunk=BLOCK_SIZE, device=device, channels=1)
+            except OSError as e:
+                tile.show_error(str(e))
+                continue
+            self.audios.append(audio)
+            self.tiles.append(tile)
+            audio = None
+        if audio is not None:
+            # left over from a device that failed to open
+            audio.close()
+        tasks = [SpectrumTask(a.rate, a.rate, hop * a.rate // SAMPLE_RATE, estimator=estimator) for a in self.audios]
+        self.pool = DspPool(self.audios, tasks, processes=processes)
+        self.sequences = [0] * len(self.audios)
+
+        grid_widget = QWidget()
+        grid_widget.setLayout(grid)
+        self.setCentralWidget(grid_widget)
+
+        # same coalescing wakeup as MainWindow: at most one update in flight
+        self.result_signal = ResultSignal()
+        self.result_signal.arrived.connect(self.update_tiles)
+        self.update_pending = False
+        if self.audios:
+            self.pool.start()
+            self.pool.wakeup.subscribe(self.result_arrived)
+        self.show()
+
+    def result_arrived(self, sequence):
+        if not self.update_pending:
+            self.update_pending = True
+            self.result_signal.arrived.emit()
+
+    def update_tiles(self):
+        self.update_pending = False
+        for i, (audio, tile) in enumerate(zip(self.audios, self.tiles)):
+            sequence = self.pool.sequence(i)
+            if sequence != self.sequences[i]:
+                self.sequences[i] = sequence
+                _, result = self.pool.latest(i)
+                if result is not None:
+                    tile.show_result(result)
+                tile.show_input(block_level(audio), audio.stats.counters)
+
+    def closeEvent(self, event):
+        self.pool.wakeup.unsubscribe(self.result_arrived)
+        self.pool.stop()
+        for audio in self.audios:
+            audio.close()
+        super(DeviceGridWindow, self).closeEvent(event)
+
+
+def frequency_axis(chunk, rate):
+    # centre frequency of each displayed rfft bin (the Nyquist bin is dropped)
+    return np.arange(chunk // 2) * (rate / chunk)
+
+
 class MplCanvas(FigureCanvasQTAgg):
 
-    def __init__(self, parent=None, width=5, height=4, dpi=100):
+    def __init__(self, parent=None, width=5, height=4, dpi=100, blit=True):
         self.fig = Figure(figsize=(width, height), dpi=dpi)
         super(MplCanvas, self).__init__(self.fig)
         self.fig.set_facecolor('#595959')
         self.fig.tight_layout(h_pad=3)
         self.bx = self.fig.add_subplot(111)
 
+        # with blitting on, axes, ticks and labels are rendered once into a cached
+        # background and every update only redraws the animated line on top of it
+        self.blit_enabled = blit
+        self.background = None
+        self.mpl_connect('draw_event', self.on_draw)
+
+        # optional waterfall image in a second axes below the spectrum
+        self.waterfall = None
+        self.wx = None
+        self.image = None
+        # waterfall write_index the image was last drawn at
+        self.image_index = -1
+        # pitch track over the waterfall
+        self.track_line = None
+
         self.init_plot(chunk=44100)
 
-    def init_plot(self, chunk=44100):
+    def init_plot(self, chunk=44100, rate=SAMPLE_RATE):
         self.chunk = chunk
+        # BandMap of the band frames shown, None while x are rfft bins
+        self.bands = None
         self.bx.set(xlabel='Frequency [Hz]', facecolor='#3a3a3a')
         self.bx.xaxis.label.set_fontsize('small')
         self.bx.set(facecolor='#3a3a3a')
@@ -254,17 +818,152 @@ class MplCanvas(FigureCanvasQTAgg):
         self.bx.tick_params(axis='both', which='major', labelsize=6, labelcolor='#000000')
         self.bx.set_ylim([0, 1000])
         self.bx.set_xlim([0, 5000])
-        x = np.arange(0, SAMPLE_RATE/2, SAMPLE_RATE/chunk)
-        y = [0 for x in range(int(chunk/2))]
-        self.bar1, = self.bx.plot(x, y, 'r-')
+        self.x = frequency_axis(chunk, rate)
+        self.lines = []
+        self.set_line_count(1)
+        # vertical marker at the tracked pitch, x in Hz and y spanning the axes
+        self.pitch_marker, = self.bx.plot([np.nan, np.nan], [0, 1], '--', color=PITCH_COLOR, linewidth=1,
+                                          transform=self.bx.get_xaxis_transform(), animated=self.blit_enabled)
+
+    def set_frequencies(self, chunk, rate=SAMPLE_RATE):
+        # new FFT size / rate: existing lines get the new x data, nothing is re-plotted
+        if self.bands is None and chunk == self.chunk and self.x.size and self.x[1] == rate / chunk:
+            return
+        self.chunk = chunk
+        self.bands = None
+        self.set_x(frequency_axis(chunk, rate))
+
+    def set_bands(self, band_map):
+        # band energies of a SpectrumServer --bands: one point per band, at its centre
+        if band_map is self.bands:
+            return
+        self.bands = band_map
+        self.set_x(band_map.centres)
+
+    def set_x(self, x):
+        self.x = x
+        zeros = np.zeros(len(self.x))
+        for line in self.lines:
+            line.set_data(self.x, zeros)
+        self.invalidate_background()
+        self.draw_idle()
+
+    def set_waterfall(self, waterfall, span=1.0, cmap=WATERFALL_CMAP):
+        # show a Waterfall covering `span` seconds under the spectrum, None hides it again
+        if self.wx is not None:
+            self.fig.delaxes(self.wx)
+            self.wx = self.image = self.track_line = None
+        self.waterfall = waterfall
+        grid = self.fig.add_gridspec(1 if waterfall is None else 2, 1)
+        self.bx.set_subplotspec(grid[0])
+        # the frequency label moves to the lowest axes
+        self.bx.set_xlabel('Frequency [Hz]' if waterfall is None else '')
+        if waterfall is not None:
+            xlim = self.bx.get_xlim()
+            self.wx = self.fig.add_subplot(grid[1], sharex=self.bx)
+            self.wx.set(facecolor='#3a3a3a', xlabel='Frequency [Hz]', ylabel='Time [s]')
+            self.wx.xaxis.label.set_fontsize('small')
+            self.wx.yaxis.label.set_fontsize('small')
+            self.wx.tick_params(axis='both', which='major', labelsize=6, labelcolor='#000000')
+            # rows are oldest first, so with origin='lower' the newest row is on top
+            self.image = self.wx.imshow(waterfall.image(), origin='lower', aspect='auto', cmap=cmap,
+                                        interpolation='nearest', animated=self.blit_enabled,
+                                        vmin=waterfall.floor_db, vmax=waterfall.floor_db + waterfall.range_db,
+                                        extent=(0, self.waterfall_top(), -span, 0))
+            self.track_line, = self.wx.plot([], [], '-', color=PITCH_COLOR, linewidth=1,
+                                            animated=self.blit_enabled)
+            # imshow rescales the shared x axis, keep the slider's range
+            self.bx.set_xlim(xlim)
+        self.invalidate_background()
+        self.draw_idle()
+
+    def waterfall_top(self):
+        # frequency at the right edge of the waterfall image
+        return self.waterfall.columns * self.waterfall.column_width * (self.x[1] - self.x[0])
+
+    def set_pitch(self, hz, track=None):
+        # marker at `hz` (nan hides it); `track` is the pitch per waterfall row, oldest first
+        self.pitch_marker.set_xdata([hz, hz])
+        if self.track_line is not None:
+            if track is None:
+                self.track_line.set_data([], [])
+            else:
+                _, _, bottom, top = self.image.get_extent()
+                step = (top - bottom) / len(track)
+                self.track_line.set_data(track, bottom + step * (np.arange(len(track)) + 0.5))
+
+    def set_line_count(self, count):
+        # one line per displayed spectrum, bar1 stays the first one
+        for line in self.lines[count:]:
+            line.remove()
+        del self.lines[count:]
+        while len(self.lines) < count:
+            color = LINE_COLORS[len(self.lines) % len(LINE_COLORS)]
+            line, = self.bx.plot(self.x, np.zeros(len(self.x)), '-', color=color, animated=self.blit_enabled)
+            self.lines.append(line)
+        self.bar1 = self.lines[0]
+        self.invalidate_background()
+
+    def invalidate_background(self):
+        self.background = None
+
+    def on_draw(self, event):
+        # every full draw (first show, resize, axis limit change) refreshes the cached background
+        if self.blit_enabled:
+            self.background = self.copy_from_bbox(self.fig.bbox)
+            self.draw_animated()
+
+    def draw_animated(self):
+        for line in self.lines:
+            self.bx.draw_artist(line)
+        self.bx.draw_artist(self.pitch_marker)
+        if self.image is not None:
+            self.wx.draw_artist(self.image)
+            self.wx.draw_artist(self.track_line)
+            self.image_index = self.waterfall.ring.write_index
+
+    def resizeEvent(self, event):
+        self.invalidate_background()
+        super(MplCanvas, self).resizeEvent(event)
 
     def update_plot(self, graph_data):
-        self.bar1.set_ydata(graph_data)
-        self.fig.canvas.draw()
+        # graph_data is one spectrum or a (channels, bins) array
+        graph_data = np.atleast_2d(graph_data)
+        if graph_data.shape[-1] != len(self.x):
+            # computed before an FFT size change
+            return
+        if len(graph_data) != len(self.lines):
+            self.set_line_count(len(graph_data))
+        for line, data in zip(self.lines, graph_data):
+            line.set_ydata(data)
+        new_row = self.image is not None and self.waterfall.ring.write_index != self.image_index
+        if new_row:
+            # the whole history goes over as one texture update
+            self.image.set_data(self.waterfall.image())
+            _, _, bottom, top = self.image.get_extent()
+            self.image.set_extent((0, self.waterfall_top(), bottom, top))
+        if self.blit_enabled and self.background is not None and self.image is not None and not new_row:
+            # waterfall unchanged, only the spectrum axes is redrawn
+            self.restore_region(self.background, bbox=self.bx.bbox, xy=self.bx.bbox.p0)
+            for line in self.lines:
+                self.bx.draw_artist(line)
+            self.bx.draw_artist(self.pitch_marker)
+            self.blit(self.bx.bbox)
+        elif self.blit_enabled and self.background is not None:
+            self.restore_region(self.background)
+            self.draw_animated()
+            self.blit(self.fig.bbox)
+        else:
+            self.fig.canvas.draw()
         self.fig.canvas.flush_events()
 
 
 if __name__ == '__main__':
     app = QtWidgets.QApplication(sys.argv)
-    w = MainWindow()
+    if len(sys.argv) > 1 and sys.argv[1] == '--devices':
+        # FrequencyMonitor.py --devices [index ...] monitors several inputs at once (all without indices)
+        w = DeviceGridWindow(devices=[int(index) for index in sys.argv[2:]] or None)
+    else:
+        # FrequencyMonitor.py host:port shows the spectra of a SpectrumServer instead of a local input
+        w = MainWindow(remote=sys.argv[1] if len(sys.argv) > 1 else None)
     app.exec_()
\ No newline at end of file
@@ -0,0 +1,120 @@
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import json
+import sys
+import numpy as np
+
+# Console front end: captures, analyses and prints one JSON line (or text line) per result
+# on stdout. Meant to be restarted often by a supervisor, so it never imports a GUI toolkit
+# and the capture / DSP modules only follow once the arguments are parsed; scipy comes in
+# with the first SpectralEngine (or not at all with --backend numpy).
+# python Benchmark.py --only startup measures the import time and the time to the first
+# result of a full window (--full-window).
+
+FULL_SCALE = 32768.0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Headless spectrum monitor, results as JSON lines on stdout')
+    parser.add_argument('--rate', type=int, default=44100)
+    parser.add_argument('--size', type=int, default=44100, help='FFT size in samples')
+    parser.add_argument('--hop', type=int, default=4410, help='samples between results')
+    parser.add_argument('--block', type=int, default=512, help='capture block size')
+    parser.add_argument('--device', type=int)
+    parser.add_argument('--channels', type=int, default=1)
+    # AudioInputStream.SAMPLE_FORMATS, spelled out so parsing needs no capture imports
+    parser.add_argument('--format', default='int16', choices=['int16', 'int24', 'int32', 'float32'],
+                        help='capture sample format')
+    parser.add_argument('--mode', default='sum', help='channel mode: sum, diff or a channel number')
+    parser.add_argument('--estimator', default='gaussian')
+    parser.add_argument('--pitch', default='off', help='pitch tracker: off, yin, hps or cepstrum')
+    parser.add_argument('--zoom', type=float, default=0, help='analyse only 0..ZOOM Hz (decimated)')
+    parser.add_argument('--backend', default='auto', help='FFT backend: auto, numpy, scipy or fftw')
+    parser.add_argument('--bands', type=int, help='add this many log-spaced band magnitudes to every line')
+    parser.add_argument('--interval', type=float, default=0.0, help='at most one line per this many seconds')
+    parser.add_argument('--count', type=int, help='stop after this many lines')
+    parser.add_argument('--seconds', type=float, help='stop after this long')
+    parser.add_argument('--full-window', action='store_true',
+                        help='no lines until the analysis window holds input only (the first ones are zero padded)')
+    parser.add_argument('--text', action='store_true', help='plain text lines instead of JSON')
+    parser.add_argument('--synthetic', action='store_true', help='analyse the synthetic test signal')
+    return parser.parse_args(argv)
+
+
+def result_line(result, task, engine, bands, text):
+    spectrum = result.spectrum.max(axis=0) if result.spectrum.ndim == 2 else result.spectrum
+    peak_db = 20 * np.log10(max(2 * float(spectrum.max()) / FULL_SCALE, 1e-7))
+    if text:
+        line = f'{result.hz:10.2f} Hz  {peak_db:6.1f} dBFS'
+        if task.pitch != 'off':
+            line += f'  pitch {result.pitch:8.2f} ({result.confidence:.2f})'
+        return line
+    values = {'time': round(time.time(), 3), 'end': int(result.end), 'hz': round(float(result.hz), 3),
+              'error': round(float(result.error), 3), 'peak_db': round(float(peak_db), 1)}
+    if task.pitch != 'off':
+        pitch = float(result.pitch)
+        values.update(pitch=None if np.isnan(pitch) else round(pitch, 3),
+                      confidence=round(float(result.confidence), 3))
+    if bands:
+        size, rate = task.spectrum_layout()
+        values['bands'] = [round(float(v), 2) for v in engine.bands(size, rate, bands, scale='log').apply(spectrum)]
+    return json.dumps(values)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from AudioInputStream import AudioIn
+    from DspWorker import SpectrumTask, DspWorker
+    from SpectralEngine import SpectralEngine
+    from Instrumentation import Instrumentation
+    backend = None
+    if args.synthetic:
+        from AudioSources import SyntheticBackend
+        backend = SyntheticBackend()
+    imported = time.perf_counter()
+
+    stats = Instrumentation()
+    audio = AudioIn(chunk=args.block, history=2 * args.size, channels=args.channels, backend=backend, stats=stats,
+                    sample_format=args.format)
+    task = SpectrumTask(args.size, args.rate, args.hop, mode=args.mode, estimator=args.estimator, pitch=args.pitch,
+                        zoom=args.zoom, backend=args.backend, stats=stats)
+    worker = DspWorker(audio, task)
+    engine = SpectralEngine(backend=args.backend) if args.bands else None
+    audio.start_stream(rate=args.rate, chunk=args.block, device=args.device, channels=args.channels)
+    worker.start()
+
+    lines = 0
+    sequence = handled = 0
+    next_line = 0.0
+    try:
+        while args.count is None or lines < args.count:
+            if args.seconds is not None and time.perf_counter() - imported > args.seconds:
+                break
+            sequence = worker.wakeup.wait(sequence)
+            result_sequence, result = worker.latest()
+            if result is None or result_sequence == handled:
+                continue
+            handled = result_sequence
+            if args.full_window and result.end < args.size:
+                continue
+            now = time.perf_counter()
+            if now < next_line:
+                continue
+            next_line = now + args.interval
+            print(result_line(result, task, engine, args.bands, args.text), flush=True)
+            if lines == 0:
+                print(f'imports {(imported - STARTED) * 1e3:.0f} ms, first result '
+                      f'{(now - STARTED) * 1e3:.0f} ms after start', file=sys.stderr)
+            lines += 1
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    worker.stop()
+    audio.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+# histogram bin edges for stage durations, 10 us .. 1 s
+HISTOGRAM_EDGES_MS = np.geomspace(0.01, 1000, 21)
+
+
+class RollingStat:
+    # last `size` values of one measurement in a preallocated ring, recording is one store
+    def __init__(self, size=1024):
+        self.values = np.zeros(size)
+        self.count = 0
+
+    def record(self, value):
+        self.values[self.count % self.values.size] = value
+        self.count += 1
+
+    def recent(self):
+        return self.values[:min(self.count, self.values.size)]
+
+    def since(self, count):
+        # values recorded after the first `count`, oldest first (at most the last `size`)
+        n = min(self.count - count, self.values.size)
+        return self.values[np.arange(self.count - n, self.count) % self.values.size]
+
+    def extend(self, values, count=None):
+        # `count` values were recorded elsewhere, `values` are the ones of them still held
+        for value in values:
+            self.record(value)
+        if count is not None:
+            self.count += count - len(values)
+
+    def summary(self):
+        values = self.recent()
+        if values.size == 0:
+            return {'count': 0}
+        histogram, _ = np.histogram(values, bins=HISTOGRAM_EDGES_MS)
+        return {
+            'count': self.count,
+            'mean_ms': float(values.mean()),
+            'p50_ms': float(np.percentile(values, 50)),
+            'p95_ms': float(np.percentile(values, 95)),
+            'max_ms': float(values.max()),
+            'histogram': histogram.tolist(),
+        }
+
+
+class Instrumentation:
+    # Per-stage timings (callback, fft, peak, binning, render, latency) as rolling
+    # histograms in milliseconds, plus plain event counters (input_overflow, dropped
+    # frames, ...). Cheap enough to leave on: a perf_counter pair and an array store.
+    # A copy in another process (a DspPool child) sends report()s that merge() adds here.
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.stages = {}
+        self.counters = {}
+        self.started = time.time()
+        # stage counts and counter values at the last report()
+        self.reported_stages = {}
+        self.reported_counters = {}
+
+    def stage(self, name):
+        stat = self.stages.get(name)
+        if stat is None:
+            stat = self.stages[name] = RollingStat(self.size)
+        return stat
+
+    def record(self, name, seconds):
+        self.stage(name).record(seconds * 1e3)
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        # what was recorded since the previous report(): per stage the number of new
+        # values and those still held (ms), and counter increments, as plain picklable
+        # data for merge()
+        stages = {}
+        for name, stat in list(self.stages.items()):
+            previous = self.reported_stages.get(name, 0)
+            self.reported_stages[name] = stat.count
+            if stat.count > previous:
+                stages[name] = (stat.count - previous, stat.since(previous))
+        counters = {}
+        for name, value in list(self.counters.items()):
+            increment = value - self.reported_counters.get(name, 0)
+            self.reported_counters[name] = value
+            if increment:
+                counters[name] = increment
+        return stages, counters
+
+    def merge(self, report):
+        stages, counters = report
+        for name, (count, values) in stages.items():
+            self.stage(name).extend(values, count)
+        for name, increment in counters.items():
+            self.count(name, increment)
+
+    def snapshot(self):
+        return {
+            'time': time.time(),
+            'uptime_s': time.time() - self.started,
+            'histogram_edges_ms': HISTOGRAM_EDGES_MS.tolist(),
+            'stages': {name: stat.summary() for name, stat in list(self.stages.items())},
+            'counters': dict(self.counters),
+        }
+
+    def summary_lines(self):
+        # short text for the on-screen overlays
+        lines = []
+        for name, stat in list(self.stages.items()):
+            values = stat.recent()
+            if values.size:
+                lines.append(f'{name}: {np.median(values):.2f} / {values.max():.2f} ms')
+        for name, value in list(self.counters.items()):
+            lines.append(f'{name}: {value}')
+        return lines
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+
+class JsonDumper:
+    # writes a snapshot of `stats` to `path` every `interval` seconds from a background thread
+    def __init__(self, stats, path, interval=5.0):
+        self.stats = stats
+        self.path = path
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='stats-dump', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.stats.dump(self.path)
+
+    def stop(self):
+        self.stopping.set()
+        self.stats.dump(self.path)
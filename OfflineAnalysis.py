@@ -0,0 +1,203 @@
+import argparse
+import struct
+import sys
+import time
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from SpectralEngine import SpectralEngine
+from PeakEstimator import interpolate_peaks
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# everything is scaled to int16 full scale so levels match the live monitors
+INT16_FULL_SCALE = 32768.0
+# packed 24-bit PCM has no numpy dtype, it is mapped as groups of 3 bytes
+PACKED_INT24 = np.dtype(('u1', (3,)))
+
+
+def wav_dtype(format_tag, bits):
+    if format_tag == WAVE_FORMAT_PCM:
+        if bits == 16:
+            return np.dtype('<i2')
+        if bits == 24:
+            return PACKED_INT24
+        if bits == 32:
+            return np.dtype('<i4')
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        return np.dtype('<f4')
+    raise ValueError(f'unsupported WAV sample format: tag {format_tag}, {bits} bit')
+
+
+def unpack_int24(packed):
+    # (..., 3) little-endian 24-bit samples -> int32 (...) with the sample in the top 24 bits
+    unpacked = np.zeros(packed.shape[:-1] + (4,), dtype=np.uint8)
+    unpacked[..., 1:] = packed
+    return unpacked.view('<i4')[..., 0]
+
+
+class PackedInt24:
+    # (frames, channels) stand-in for memory-mapped 24-bit PCM: indexing unpacks only the
+    # selected samples, into int32 like AudioIn does for int24 capture, so full_scale()
+    # is that of int32
+    dtype = np.dtype('<i4')
+
+    def __init__(self, packed):
+        # (frames, channels, 3) uint8
+        self.packed = packed
+        self.shape = packed.shape[:2]
+
+    def __getitem__(self, key):
+        return unpack_int24(self.packed[key])
+
+
+def full_scale(dtype):
+    if dtype.kind == 'f':
+        return 1.0
+    return float(np.iinfo(dtype).max) + 1
+
+
+def open_wav(path):
+    # memory-maps the data chunk of a RIFF/WAVE file, returns ((frames, channels) array, rate)
+    with open(path, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError(f'{path} is not a WAV file')
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f'{path} has no data chunk')
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                body = f.read(size + size % 2)
+                format_tag, channels, rate, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE:
+                    format_tag = struct.unpack('<H', body[24:26])[0]
+                fmt = (format_tag, channels, rate, bits)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise ValueError(f'{path} has data before fmt chunk')
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + size % 2, 1)
+    format_tag, channels, rate, bits = fmt
+    dtype = wav_dtype(format_tag, bits)
+    frames = size // (dtype.itemsize * channels)
+    samples = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(frames, channels))
+    if dtype == PACKED_INT24:
+        samples = PackedInt24(samples)
+    return samples, rate
+
+
+def open_raw(path, rate, dtype='<i2', channels=1):
+    samples = np.memmap(path, dtype=np.dtype(dtype), mode='r')
+    frames = samples.size // channels
+    return samples[:frames * channels].reshape(frames, channels), rate
+
+
+def write_wav(path, samples, rate, block=65536):
+    # (frames[, channels]) samples in int16 units to a WAV file: int16 as 16-bit PCM,
+    # anything else as 32-bit float. Written block by block through one scratch
+    # buffer, so long windows never get copied as a whole.
+    samples = samples.reshape(samples.shape[0], -1)
+    frames, channels = samples.shape
+    pcm = samples.dtype == np.int16
+    dtype = np.dtype('<i2' if pcm else '<f4')
+    data_size = frames * channels * dtype.itemsize
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sI4s', b'RIFF', 36 + data_size, b'WAVE'))
+        f.write(struct.pack('<4sIHHIIHH', b'fmt ', 16, WAVE_FORMAT_PCM if pcm else WAVE_FORMAT_IEEE_FLOAT,
+                            channels, rate, rate * channels * dtype.itemsize, channels * dtype.itemsize,
+                            dtype.itemsize * 8))
+        f.write(struct.pack('<4sI', b'data', data_size))
+        scratch = np.empty((min(block, frames), channels), dtype=dtype)
+        for start in range(0, frames, block):
+            part = samples[start:start + block]
+            out = scratch[:len(part)]
+            if pcm:
+                out[:] = part
+            else:
+                np.multiply(part, 1.0 / INT16_FULL_SCALE, out=out, casting='unsafe')
+            out.tofile(f)
+
+
+def frame_view(samples, size, hop):
+    # (frames, size) strided view over a 1-D signal, no copy
+    if samples.shape[0] < size:
+        return np.empty((0, size), dtype=samples.dtype)
+    return sliding_window_view(samples, size)[::hop]
+
+
+def analyze(samples, rate, out_prefix, size=4096, hop=1024, batch=256, bands=40, scale='log', engine=None,
+            gain=None):
+    # Streams spectrogram, peak track and band energies of a 1-D signal to
+    # <out_prefix>_spectrogram.npy, <out_prefix>_bands.npy and <out_prefix>_peaks.csv.
+    # Only one batch of frames is ever held in memory. `gain` overrides the scaling to
+    # int16 units derived from the dtype (float captures already are in int16 units).
+    engine = engine or SpectralEngine()
+    frames = frame_view(samples, size, hop)
+    count = frames.shape[0]
+    bins = size // 2
+    band_map = engine.bands(size, rate, bands, scale=scale)
+    if gain is None:
+        gain = INT16_FULL_SCALE / full_scale(samples.dtype)
+
+    spectrogram = np.lib.format.open_memmap(f'{out_prefix}_spectrogram.npy', mode='w+',
+                                            dtype=np.float32, shape=(count, bins))
+    band_energies = np.lib.format.open_memmap(f'{out_prefix}_bands.npy', mode='w+',
+                                              dtype=np.float32, shape=(count, bands))
+    work = np.empty((batch, size), dtype=np.float32)
+    with open(f'{out_prefix}_peaks.csv', 'w') as peaks_file:
+        peaks_file.write('time_s,peak_hz,level\n')
+        for start in range(0, count, batch):
+            stop = min(start + batch, count)
+            magnitudes = engine.magnitudes(frames[start:stop], rate, work=work)
+            if gain != 1.0:
+                magnitudes *= gain
+            spectrogram[start:stop] = magnitudes
+            band_energies[start:stop] = band_map.apply(magnitudes)
+            hz, levels = interpolate_peaks(magnitudes, rate)
+            times = (np.arange(start, stop) * hop + size / 2) / rate
+            np.savetxt(peaks_file, np.column_stack((times, hz, levels)), fmt='%.6f', delimiter=',')
+    spectrogram.flush()
+    band_energies.flush()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline spectrum analysis of WAV or raw PCM files')
+    parser.add_argument('input')
+    parser.add_argument('-o', '--output', help='output prefix, defaults to the input name')
+    parser.add_argument('--size', type=int, default=4096, help='FFT size in samples')
+    parser.add_argument('--hop', type=int, default=1024, help='hop between frames in samples')
+    parser.add_argument('--batch', type=int, default=256, help='frames per FFT call')
+    parser.add_argument('--bands', type=int, default=40)
+    parser.add_argument('--scale', default='log', choices=['linear', 'log', 'octave'])
+    parser.add_argument('--channel', type=int, default=0)
+    parser.add_argument('--raw', action='store_true', help='input is headerless PCM')
+    parser.add_argument('--rate', type=int, default=44100, help='sample rate of raw input')
+    parser.add_argument('--dtype', default='<i2', help='numpy dtype of raw input')
+    parser.add_argument('--channels', type=int, default=1, help='channel count of raw input')
+    args = parser.parse_args(argv)
+
+    if args.raw:
+        samples, rate = open_raw(args.input, args.rate, args.dtype, args.channels)
+    else:
+        samples, rate = open_wav(args.input)
+    out_prefix = args.output or args.input.rsplit('.', 1)[0]
+
+    started = time.perf_counter()
+    count = analyze(samples[:, args.channel], rate, out_prefix, size=args.size, hop=args.hop,
+                    batch=args.batch, bands=args.bands, scale=args.scale)
+    elapsed = time.perf_counter() - started
+    duration = samples.shape[0] / rate
+    print(f'{count} frames, {duration:.1f} s of audio in {elapsed:.2f} s '
+          f'({duration / max(elapsed, 1e-9):.0f}x real time)', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import numpy as np
+
+# chirp-z is optional, the zoom estimator falls back to evaluating the DTFT directly.
+# scipy.signal takes most of a second to import, so only a ZoomEstimator loads it.
+czt = None
+
+
+def load_czt():
+    global czt
+    if czt is None:
+        try:
+            from scipy.signal import czt as scipy_czt
+        except ImportError:
+            return None
+        czt = scipy_czt
+    return czt
+
+# worst-case bias of the interpolators on a noise-free Hann-windowed tone, in bins
+PARABOLIC_BIAS = 0.1
+GAUSSIAN_BIAS = 0.02
+
+
+def coarse_peak(magnitude):
+    # strongest bin, kept one bin away from the edges so both neighbours exist
+    return int(np.argmax(magnitude[1:-1])) + 1
+
+
+def parabolic_offset(left, center, right):
+    # vertex of the parabola through three equally spaced points, in bins relative to center
+    denominator = left - 2 * center + right
+    if denominator == 0:
+        return 0.0
+    return float(0.5 * (left - right) / denominator)
+
+
+def interpolate_peaks(magnitudes, rate, log=True):
+    # vectorized parabolic / Gaussian interpolation for a batch of spectra (frames, bins),
+    # returns peak frequencies in Hz and the magnitude at the coarse peak
+    resolution = rate / (2 * magnitudes.shape[-1])
+    k = np.argmax(magnitudes[..., 1:-1], axis=-1) + 1
+    values = np.take_along_axis(magnitudes, np.stack([k - 1, k, k + 1], axis=-1), axis=-1)
+    if log:
+        values = np.log(values.astype(np.float64) + 1e-12)
+    left, center, right = values[..., 0], values[..., 1], values[..., 2]
+    denominator = left - 2 * center + right
+    safe = np.where(denominator == 0, 1, denominator)
+    offset = np.where(denominator == 0, 0, 0.5 * (left - right) / safe)
+    levels = np.take_along_axis(magnitudes, k[..., None], axis=-1)[..., 0]
+    return (k + offset) * resolution, levels
+
+
+def wrap_phase(phase):
+    return (phase + np.pi) % (2 * np.pi) - np.pi
+
+
+class PeakEstimator:
+    # Base estimator: plain argmax. estimate() returns (hz, expected_error_hz).
+    # `lookback` is how many samples before the analysed window an estimator needs,
+    # callers pass window + lookback samples in `samples`.
+    name = 'argmax'
+    lookback = 0
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def estimate(self, magnitude, rate, samples=None):
+        resolution = rate / (2 * magnitude.size)
+        return np.argmax(magnitude) * resolution, resolution / 2
+
+
+class ParabolicEstimator(PeakEstimator):
+    name = 'parabolic'
+    bias = PARABOLIC_BIAS
+
+    def values(self, magnitude, k):
+        return magnitude[k - 1:k + 2]
+
+    def estimate(self, magnitude, rate, samples=None):
+        resolution = rate / (2 * magnitude.size)
+        k = coarse_peak(magnitude)
+        offset = parabolic_offset(*self.values(magnitude, k))
+        return (k + offset) * resolution, self.bias * resolution
+
+
+class GaussianEstimator(ParabolicEstimator):
+    # parabola through the log magnitudes, exact for a Gaussian peak shape
+    name = 'gaussian'
+    bias = GAUSSIAN_BIAS
+
+    def values(self, magnitude, k):
+        return np.log(magnitude[k - 1:k + 2].astype(np.float64) + 1e-12)
+
+
+class PhaseVocoderEstimator(PeakEstimator):
+    # Instantaneous frequency from the phase advance of the peak bin between two
+    # windows `lag` samples apart. Only the peak bin is evaluated, not two full FFTs.
+    # The phase is unambiguous for peaks within window / (2 * lag) bins of the coarse bin.
+    name = 'phase'
+
+    def __init__(self, engine, lag=2048):
+        super().__init__(engine)
+        self.lag = lag
+        self.lookback = lag
+        self.basis = {}
+
+    def bin_basis(self, n, k):
+        key = (n, k)
+        basis = self.basis.get(key)
+        if basis is None:
+            self.basis.clear()
+            basis = np.exp(-2j * np.pi * k * np.arange(n) / n).astype(np.complex64)
+            self.basis[key] = basis
+        return basis
+
+    def estimate(self, magnitude, rate, samples=None):
+        n = 2 * magnitude.size
+        lag = min(self.lag, n // 2)
+        resolution = rate / n
+        k = coarse_peak(magnitude)
+        if samples is None or samples.size < n + lag:
+            return k * resolution, resolution / 2
+        window = self.engine.plan(n, rate).window
+        basis = self.bin_basis(n, k)
+        older = np.dot(samples[-n - lag:-lag] * window, basis)
+        newer = np.dot(samples[-n:] * window, basis)
+        expected = 2 * np.pi * k * lag / n
+        deviation = wrap_phase(np.angle(newer) - np.angle(older) - expected)
+        hz = (k + deviation * n / (2 * np.pi * lag)) * resolution
+        # phase noise of a bin is about 1 / SNR radians, the difference of two doubles the variance
+        snr = magnitude[k] / (np.median(magnitude) + 1e-12)
+        error = np.sqrt(2) / snr * rate / (2 * np.pi * lag)
+        return float(hz), float(error)
+
+
+class ZoomEstimator(PeakEstimator):
+    # Evaluates the spectrum on a fine grid of `points` frequencies spanning one bin
+    # either side of the coarse peak (chirp-z transform), then interpolates on that grid.
+    name = 'zoom'
+
+    def __init__(self, engine, points=64):
+        super().__init__(engine)
+        self.points = points
+        self.czt = load_czt()
+
+    def estimate(self, magnitude, rate, samples=None):
+        n = 2 * magnitude.size
+        resolution = rate / n
+        k = coarse_peak(magnitude)
+        if samples is None or samples.size < n:
+            return k * resolution, resolution / 2
+        x = samples[-n:] * self.engine.plan(n, rate).window
+        start = (k - 1) * resolution
+        step = 2 * resolution / (self.points - 1)
+        if self.czt is not None:
+            zoomed = self.czt(x, m=self.points, w=np.exp(-2j * np.pi * step / rate),
+                              a=np.exp(2j * np.pi * start / rate))
+        else:
+            t = np.arange(n) / rate
+            zoomed = np.array([np.dot(x, np.exp(-2j * np.pi * (start + i * step) * t))
+                               for i in range(self.points)])
+        zoomed = np.abs(zoomed)
+        j = min(max(int(np.argmax(zoomed)), 1), self.points - 2)
+        offset = parabolic_offset(*zoomed[j - 1:j + 2])
+        return start + (j + offset) * step, PARABOLIC_BIAS * step
+
+
+ESTIMATORS = {
+    'argmax': PeakEstimator,
+    'parabolic': ParabolicEstimator,
+    'gaussian': GaussianEstimator,
+    'phase': PhaseVocoderEstimator,
+    'zoom': ZoomEstimator,
+}
+
+
+def make_estimator(name, engine, **kwargs):
+    return ESTIMATORS[name](engine, **kwargs)
@@ -0,0 +1,301 @@
+import numpy as np
+
+from PeakEstimator import parabolic_offset
+
+# silence below this RMS (int16 units) has no pitch
+MIN_RMS = 1.0
+# spectral detectors treat log magnitudes less than this above the median (20 dB) as noise
+NOISE_MARGIN = np.log(10.0)
+# HPS reads an octave down when the odd harmonics of half its estimate carry this share
+# (-13 dB) of the power on the estimate's own harmonics
+SUBOCTAVE_RATIO = 0.05
+# confidence of an HPS estimate whose sub-octave is below fmin: under PitchTrack's default
+# min_confidence, as the estimate is likely an octave too high
+AMBIGUOUS_CONFIDENCE = 0.25
+
+
+class PitchDetector:
+    # Base of the fundamental-frequency detectors. __call__(samples, rate) analyses the
+    # newest `size` samples and returns (hz, confidence 0..1), hz is nan when nothing
+    # was found. `size` follows from fmin and the rate (a few periods of the lowest
+    # pitch), scratch buffers are allocated once per rate and reused on every hop.
+    name = None
+
+    def __init__(self, engine, fmin=50.0, fmax=2000.0):
+        self.engine = engine
+        self.fmin = fmin
+        self.fmax = fmax
+        self.rate = None
+        self.size = None
+
+    def window_size(self, rate):
+        # power of two holding four periods of fmin
+        return int(2 ** np.ceil(np.log2(4 * rate / self.fmin)))
+
+    def prepare(self, rate):
+        if rate != self.rate:
+            self.rate = rate
+            self.size = self.window_size(rate)
+            self.allocate()
+
+    def allocate(self):
+        pass
+
+    def __call__(self, samples, rate):
+        self.prepare(rate)
+        if samples.shape[0] < self.size:
+            return np.nan, 0.0
+        samples = samples[-self.size:]
+        if np.sqrt(np.mean(np.square(samples, dtype=np.float64))) < MIN_RMS:
+            return np.nan, 0.0
+        return self.detect(samples)
+
+
+class YinDetector(PitchDetector):
+    # YIN: cumulative mean normalized difference function, with the autocorrelation
+    # part done by one batched FFT of the window and its first half. The first dip
+    # below `threshold` is the period, confidence is 1 - its depth.
+    name = 'yin'
+
+    def __init__(self, engine, fmin=50.0, fmax=2000.0, threshold=0.15):
+        super().__init__(engine, fmin, fmax)
+        self.threshold = threshold
+
+    def allocate(self):
+        n = self.size
+        self.width = n // 2
+        # rows: window, its first `width` samples; zero padded to 2n for a linear correlation
+        self.frames = np.zeros((2, 2 * n), dtype=np.float32)
+        self.squares = np.zeros(n + 1)
+        self.lags = np.arange(self.width, dtype=np.float64)
+        self.first = max(2, int(self.rate / self.fmax))
+        self.last = min(self.width - 1, int(np.ceil(self.rate / self.fmin)) + 1)
+
+    def detect(self, samples):
+        n, width = self.size, self.width
+        self.frames[0, :n] = samples
+        self.frames[1, :width] = samples[:width]
+        spectra = self.engine.rfft_batch(self.frames)
+        correlation = self.engine.irfft_batch(spectra[0] * np.conj(spectra[1]), 2 * n)[:width]
+        np.cumsum(np.square(self.frames[0, :n], dtype=np.float64), out=self.squares[1:])
+        if self.squares[width] < width * MIN_RMS ** 2:
+            # silent reference half: the difference function is zero at every lag
+            return np.nan, 0.0
+        # energy of samples[lag:lag + width]
+        energy = self.squares[width:2 * width] - self.squares[:width]
+        difference = energy[0] + energy - 2 * correlation
+        difference[0] = 0.0
+        total = np.cumsum(difference)
+        total[0] = 1.0
+        normalized = difference * self.lags / np.maximum(total, 1e-12)
+        normalized[0] = 1.0
+        search = normalized[self.first:self.last]
+        below = np.flatnonzero(search < self.threshold)
+        if below.size:
+            lag = self.first + int(below[0])
+            # down to the bottom of that dip
+            while lag + 1 < self.last and normalized[lag + 1] < normalized[lag]:
+                lag += 1
+        else:
+            lag = self.first + int(np.argmin(search))
+        lag = min(max(lag, 1), self.width - 2)
+        period = lag + parabolic_offset(*normalized[lag - 1:lag + 2])
+        confidence = float(np.clip(1.0 - normalized[lag], 0.0, 1.0))
+        return self.rate / period, confidence
+
+
+class SpectralPitchDetector(PitchDetector):
+    # Shared part of the spectrum based detectors: Hann windowed, 2x zero padded log
+    # magnitude spectrum, refinement of a coarse estimate on its strongest harmonic, and
+    # a harmonicity confidence: the share of the power lying on the harmonics of the
+    # estimate, rescaled so white noise reads 0.
+    padding = 2
+    # harmonics counted for the confidence
+    harmonics = 10
+
+    def allocate(self):
+        n = self.size
+        self.length = self.padding * n
+        self.window = np.hanning(n).astype(np.float32)
+        self.work = np.zeros(self.length, dtype=np.float32)
+        self.bins = self.length // 2 + 1
+        self.resolution = self.rate / self.length
+        self.power = np.empty(self.bins)
+        self.log = np.empty(self.bins)
+        # main lobe half width of the padded Hann window, in bins
+        self.lobe = 2 * self.padding
+        self.lobe_offsets = np.arange(-self.lobe, self.lobe + 1)
+
+    def spectrum(self, samples):
+        np.multiply(samples, self.window, out=self.work[:self.size])
+        magnitude = np.abs(self.engine.rfft_batch(self.work))
+        np.square(magnitude, out=self.power)
+        np.log(magnitude + 1e-6, out=self.log)
+
+    def refine(self, f0_bin, count):
+        # interpolated peak of the strongest of the first `count` harmonics, divided by its number
+        count = int(max(1, min(count, (self.bins - self.lobe - 2) / f0_bin)))
+        centres = np.rint(f0_bin * np.arange(1, count + 1)).astype(int)
+        around = centres[:, None] + self.lobe_offsets
+        flat = int(np.argmax(self.log[around]))
+        h, k = flat // around.shape[1] + 1, int(around.flat[flat])
+        return (k + parabolic_offset(*self.log[k - 1:k + 2])) / h
+
+    def harmonicity(self, f0_bin):
+        count = int(min(self.harmonics, (self.bins - self.lobe - 1) / f0_bin))
+        total = self.power.sum()
+        if count < 1 or total <= 0:
+            return 0.0
+        centres = np.rint(f0_bin * np.arange(1, count + 1)).astype(int)
+        share = self.power[np.unique(centres[:, None] + self.lobe_offsets)].sum() / total
+        # share a flat spectrum would give
+        expected = min(1.0, (2 * self.lobe + 1) / f0_bin)
+        if expected >= 1.0:
+            return 0.0
+        return float(np.clip((share - expected) / (1.0 - expected), 0.0, 1.0))
+
+
+class HpsDetector(SpectralPitchDetector):
+    # Harmonic product spectrum: sum of the log spectrum decimated by 1..`order`,
+    # the fundamental is the bin where all the harmonics line up. Candidates whose own
+    # bin is at the noise floor are skipped, otherwise a pure tone ties with all of its
+    # subharmonics. A missing fundamental would then read an octave up, so the odd
+    # harmonics of half the estimate (which the estimate lacks) are checked as well.
+    name = 'hps'
+
+    def __init__(self, engine, fmin=50.0, fmax=2000.0, order=4):
+        super().__init__(engine, fmin, fmax)
+        self.order = order
+
+    def allocate(self):
+        super().allocate()
+        first = max(2, int(self.fmin / self.resolution))
+        last = min(int(np.ceil(self.fmax / self.resolution)) + 2, (self.bins - 1) // self.order)
+        self.candidates = np.arange(first, last)
+        # (candidates, order) indices of each candidate's harmonics
+        self.indices = self.candidates[:, None] * np.arange(1, self.order + 1)
+        self.product = np.empty(len(self.candidates))
+        # odd harmonics of half a candidate, in candidate bins
+        self.odd_halves = np.arange(1, 2 * self.order, 2) / 2
+
+    def detect(self, samples):
+        self.spectrum(samples)
+        np.sum(self.log[self.indices], axis=1, out=self.product)
+        floor = np.median(self.log) + NOISE_MARGIN
+        self.product[self.log[self.candidates] < floor] = -np.inf
+        j = int(np.argmax(self.product))
+        if np.isinf(self.product[j]):
+            return np.nan, 0.0
+        coarse, limit = self.candidates[j], 1.0
+        if self.suboctave(coarse):
+            if coarse / 2 >= self.candidates[0]:
+                coarse = coarse / 2
+            else:
+                limit = AMBIGUOUS_CONFIDENCE
+        # the product is too coarse to interpolate
+        f0_bin = self.refine(coarse, self.order)
+        return f0_bin * self.resolution, min(self.harmonicity(f0_bin), limit)
+
+    def suboctave(self, candidate):
+        # whether candidate / 2 is the fundamental: there is power on its odd harmonics,
+        # halfway between those of the candidate (peaks within a bin, half a candidate is
+        # rarely a whole bin)
+        own = self.harmonic_power(candidate * np.arange(1, self.order + 1))
+        return self.harmonic_power(candidate * self.odd_halves) >= SUBOCTAVE_RATIO * own
+
+    def harmonic_power(self, bins):
+        centres = np.rint(bins).astype(int)
+        return self.power[centres[:, None] + np.arange(-1, 2)].max(axis=1).sum()
+
+
+class CepstrumDetector(SpectralPitchDetector):
+    # Real cepstrum: the harmonic comb of the log spectrum becomes a peak at the
+    # quefrency (in samples) of the period, and at its multiples. The first local
+    # maximum reaching `ratio` of the largest one is taken, as in YIN; the decaying
+    # spectral envelope at low quefrencies has no maximum and is passed over.
+    # Needs harmonic input, a pure tone has no comb and reads with low confidence.
+    name = 'cepstrum'
+
+    def __init__(self, engine, fmin=50.0, fmax=2000.0, ratio=0.6):
+        super().__init__(engine, fmin, fmax)
+        self.ratio = ratio
+
+    def allocate(self):
+        super().allocate()
+        self.first = max(2, int(self.rate / self.fmax))
+        self.last = min(self.size - 2, int(np.ceil(self.rate / self.fmin)) + 2)
+
+    def detect(self, samples):
+        self.spectrum(samples)
+        # noise bins clipped to one level, so only the harmonic comb shapes the cepstrum
+        np.maximum(self.log, np.median(self.log) + NOISE_MARGIN, out=self.log)
+        cepstrum = self.engine.irfft_batch(self.log, self.length)
+        search = cepstrum[self.first - 1:self.last + 1]
+        peaks = np.flatnonzero((search[1:-1] > search[:-2]) & (search[1:-1] >= search[2:]))
+        if peaks.size == 0:
+            return np.nan, 0.0
+        heights = search[peaks + 1]
+        q = self.first + int(peaks[np.flatnonzero(heights >= self.ratio * heights.max())[0]])
+        period = q + parabolic_offset(*cepstrum[q - 1:q + 2])
+        # one quefrency sample is a coarse step at high pitches
+        f0_bin = self.refine(self.rate / period / self.resolution, self.harmonics)
+        return f0_bin * self.resolution, self.harmonicity(f0_bin)
+
+
+PITCH_DETECTORS = {
+    'yin': YinDetector,
+    'hps': HpsDetector,
+    'cepstrum': CepstrumDetector,
+}
+
+
+def make_detector(name, engine, **kwargs):
+    return PITCH_DETECTORS[name](engine, **kwargs)
+
+
+class PitchTrack:
+    # Smooths per-hop estimates into a display track. Estimates below `min_confidence`
+    # are unvoiced, voiced ones go through a running median of the last `length`
+    # (drops single-hop octave errors); the track holds its value over `hold` unvoiced
+    # hops, then reads nan and the next note starts from scratch.
+
+    def __init__(self, length=5, min_confidence=0.5, hold=3):
+        self.min_confidence = min_confidence
+        self.hold = hold
+        self.values = np.full(length, np.nan)
+        self.count = 0
+        self.unvoiced = 0
+        self.value = np.nan
+
+    def reset(self):
+        self.values[:] = np.nan
+        self.count = 0
+        self.unvoiced = 0
+        self.value = np.nan
+
+    def update(self, hz, confidence):
+        if np.isnan(hz) or confidence < self.min_confidence:
+            self.unvoiced += 1
+            if self.unvoiced > self.hold:
+                self.reset()
+            return self.value
+        self.unvoiced = 0
+        self.values[self.count % self.values.size] = hz
+        self.count += 1
+        self.value = float(np.nanmedian(self.values))
+        return self.value
+
+
+class PitchTracker:
+    # One detector plus its track: __call__(samples, rate) -> (smoothed hz, confidence)
+    def __init__(self, engine, method='yin', fmin=50.0, fmax=2000.0, length=5, min_confidence=0.5, hold=3):
+        self.method = method
+        self.detector = make_detector(method, engine, fmin=fmin, fmax=fmax)
+        self.track = PitchTrack(length, min_confidence, hold)
+
+    def window_size(self, rate):
+        return self.detector.window_size(rate)
+
+    def __call__(self, samples, rate):
+        hz, confidence = self.detector(samples, rate)
+        return self.track.update(hz, confidence), confidence
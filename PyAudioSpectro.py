@@ -1,5 +1,10 @@
 import sys
 from AudioInputStream import AudioIn
+from SpectralEngine import SpectralEngine
+from DspWorker import InlineWorker, DspWorker
+from Instrumentation import Instrumentation, JsonDumper
+from Waterfall import Waterfall, palette
+from SpectrumServer import RemoteWorker, RemoteSource, KIND_BANDS
 import numpy as np
 import pygame
 import random
@@ -20,6 +25,12 @@ WALL_SIZE = 1
 
 SCREENWIDTH = CELL_SIZE * BOARD_WIDTH
 SCREENHEIGHT = CELL_SIZE * BOARD_HEIGHT
+# width of the stats overlay in pixels
+STATS_WIDTH = 260
+# waterfall view ('w' key): history length and dB colour scale
+WATERFALL_SECONDS = 60
+WATERFALL_FLOOR_DB = 0.0
+WATERFALL_RANGE_DB = 80.0
 
 def translate(value, leftMin, leftMax, rightMin, rightMax):
     # Figure out how 'wide' each range is
@@ -34,99 +45,197 @@ def translate(value, leftMin, leftMax, rightMin, rightMax):
 
 
 class Spectrum:
+    # The analyzer as a component: __init__ only sets things up (no display, no capture),
+    # open() starts pygame, the capture and the worker, frame() runs one pass of the event
+    # loop and close() ends it. run() is the standalone program, a host application can
+    # call frame() from its own loop instead (pass it its screen).
 
-    def __init__(self, fps=10):
-        pygame.init()
-
-        size = (SCREENWIDTH, SCREENHEIGHT)
-        self.screen = pygame.display.set_mode(size)
-        pygame.display.set_caption("Spectrum Analyzer")
-
+    def __init__(self, fps=10, scale='log', bars=False, channels=1, channel_mode='sum', dsp='thread',
+                 backend=None, stats_file=None, palette_name='heat', remote=None, sample_format='int16'):
         self.fps = fps
-
-        # This will be a list that will contain all the sprites we intend to use in our game.
-        self.all_sprites_list = pygame.sprite.Group()
-        self.all_cells_rows = list()
-
-        self.init_cells()
+        self.bars = bars
+        self.screen = None
+        self.renderer = None
 
         # save the last value for every frequency
         self.max_values = [0 for _ in range (BOARD_WIDTH)]
 
-        # init pyaudio input device at default device (None)
-        self.myaudio = AudioIn()
+        # stage timings and counters; 's' toggles the overlay, stats_file gets JSON snapshots
+        self.stats = Instrumentation()
+        self.show_stats = False
+        self.stats_font = None
+        self.stats_dumper = None
+        if stats_file:
+            self.stats_dumper = JsonDumper(self.stats, stats_file)
+
+        # init pyaudio input device at default device (None), or with remote='host:port'
+        # show the spectra of a SpectrumServer without opening a device (thin client)
+        if remote:
+            self.myaudio = RemoteSource(remote, stats=self.stats)
+        else:
+            self.myaudio = AudioIn(backend=backend, stats=self.stats, sample_format=sample_format)
+        self.engine = SpectralEngine()
+        self.rate = 11025
+        # 'linear', 'log' or 'octave' column layout
+        self.scale = scale
+        # with several channels the columns show their 'sum', 'diff', one channel number,
+        # or with 'channels' the board is split into one group of columns per channel
+        self.channels = channels
+        self.channel_mode = channel_mode
+        self.show_spectrum = False
+
+        # one waterfall row per analysed block, shown full screen instead of the board;
+        # the (columns, rows) 8-bit surface is palette mapped and refilled with one blit_array
+        self.waterfall = Waterfall(WATERFALL_SECONDS * self.rate // self.myaudio.chunk, self.myaudio.chunk // 2,
+                                   floor_db=WATERFALL_FLOOR_DB, range_db=WATERFALL_RANGE_DB)
+        self.show_waterfall = False
+        self.palette = palette(palette_name)
+        self.waterfall_surface = None
+
+        # the spectrum of each new block is computed on a DSP thread ('thread') or in
+        # the frame loop ('inline'); either way the loop only picks up the latest columns
+        self.task = BoardTask(self)
+        if remote:
+            self.worker = RemoteWorker(remote, stats=self.stats, convert=self.remote_board_data)
+        elif dsp == 'thread':
+            self.worker = DspWorker(self.myaudio, self.task)
+        else:
+            self.worker = InlineWorker(self.myaudio, self.task)
+        self.no_data = (np.zeros(BOARD_WIDTH, dtype=int), None)
+        self.last_sequence = 0
+        # between frames the loop sleeps until the worker has something new (the inline
+        # worker: until a block arrived), waking every WAIT_TIMEOUT for keys and window events
+        self.wakeup = self.worker.wakeup
+        self.seen = 0
+
+    def open(self, screen=None):
+        pygame.init()
+        if screen is None:
+            screen = pygame.display.set_mode((SCREENWIDTH, SCREENHEIGHT))
+            pygame.display.set_caption("Spectrum Analyzer")
+        self.screen = screen
+        # only columns whose height changed get redrawn, see GridRenderer
+        self.renderer = GridRenderer(self.screen, bars=self.bars)
+        if self.stats_dumper is not None:
+            self.stats_dumper.start()
         # print(self.myaudio.get_input_devices_info())
         default_device = self.myaudio.get_default_input_device().get('index')
-        self.myaudio.start_stream(output=False, rate=11025, chunk=1024, device=default_device)
+        self.myaudio.start_stream(output=False, rate=self.rate, chunk=1024, device=default_device,
+                                  channels=self.channels)
         self.show_spectrum = True
+        self.worker.start()
 
-        # Allowing the user to close the window...
-        carry_on = True
+    def run(self):
+        self.open()
         clock = pygame.time.Clock()
-
-        while carry_on:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    carry_on = False
-            keys = pygame.key.get_pressed()
-            if keys[pygame.K_KP_MINUS]:
-                self.fps -= 1
-            if keys[pygame.K_KP_PLUS]:
-                self.fps += 1
-            if keys[pygame.K_ESCAPE]:
-                pygame.quit()
-                sys.exit()
-            if keys[pygame.K_SPACE]:
-                time.sleep(0.1)
-                if self.show_spectrum:
-                    self.myaudio.stop_stream()
-                    self.show_spectrum = False
-                else:
-                    self.myaudio.start_stream(output=False, device=None)
-                    self.show_spectrum = True
-
-            # Game Logic
-            # self.all_sprites_list.update()
-            data = self.make_spectrum_data(self.myaudio.audio)
-            self.update_cells(data)
-
-            # draw all the sprites in one go
-            self.all_sprites_list.draw(self.screen)
+        while self.frame():
+            # Number of frames per second, at most
+            clock.tick(self.fps)
+            self.seen = self.wakeup.wait(self.seen)
+        self.close()
+
+    def frame(self):
+        # one pass of the loop: input, the worker's latest columns, drawing; False once
+        # the window was closed or Escape pressed
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_s:
+                self.show_stats = not self.show_stats
+                self.renderer.invalidate(self.stats_columns())
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_w:
+                self.show_waterfall = not self.show_waterfall
+                self.renderer.invalidate()
+        keys = pygame.key.get_pressed()
+        if keys[pygame.K_KP_MINUS]:
+            self.fps -= 1
+        if keys[pygame.K_KP_PLUS]:
+            self.fps += 1
+        if keys[pygame.K_ESCAPE]:
+            return False
+        if keys[pygame.K_SPACE]:
+            time.sleep(0.1)
+            if self.show_spectrum:
+                self.myaudio.stop_stream()
+                self.show_spectrum = False
+            else:
+                self.myaudio.start_stream(output=False, rate=self.rate, chunk=1024, device=None,
+                                          channels=self.channels)
+                self.show_spectrum = True
+
+        # Game Logic
+        sequence, data = self.worker.latest()
+        if data is None:
+            data = self.no_data
+        elif sequence == self.last_sequence:
+            # the loop outran the analysis and shows the same columns again
+            self.stats.count('duplicated_frames')
+        else:
+            if self.last_sequence and sequence - self.last_sequence > 1:
+                self.stats.count('dropped_results', sequence - self.last_sequence - 1)
+            self.last_sequence = sequence
+            if data[1] is not None:
+                self.waterfall.push(data[1])
+            # approximate: the task may already be on the next block
+            captured = self.myaudio.sample_time(self.task.last_index - 1)
+            if captured is not None:
+                self.stats.record('latency', time.perf_counter() - captured)
+        with self.stats.timer('render'):
+            if self.show_waterfall:
+                dirty_rects = [self.draw_waterfall()]
+            else:
+                if self.show_stats:
+                    self.renderer.invalidate(self.stats_columns())
+                dirty_rects = self.update_cells(data[0])
 
             # draw fps
             #self.draw_fps()
-
-            # Refresh Screen
-            pygame.display.flip()
-
-            # Number of frames per second
-            clock.tick(self.fps)
-
+            if self.show_stats:
+                dirty_rects.append(self.draw_stats())
+
+        # Refresh only the changed parts of the screen
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
+        return True
+
+    def close(self):
+        self.worker.stop()
+        self.myaudio.close()
+        if self.stats_dumper is not None:
+            self.stats_dumper.stop()
         pygame.quit()
 
     def make_spectrum_data(self, data):
-
-        # define spectrogram
-        t = np.linspace(0, 1, len(data))
-        s = data
-        T = t[1] - t[0]  # sampling interval
-        N = s.size
-        fft = np.fft.fft(data)
-        # 1/T = frequency
-        f = np.linspace(0, 1 / T, N)
-        abs_data = np.abs(fft)
-        bar_data = abs_data[:N // 2] * 1 / N
-
-        l = len(bar_data)
-        r = int(l / BOARD_WIDTH)
-        the_data = []
-        for i in range(BOARD_WIDTH):
-            m = 0
-            for p in range(r):
-                m += bar_data[i * r + p]
-            the_data.append(int(m / r))
+        # column heights and the magnitude spectrum they were binned from (for the waterfall)
+        stats = self.myaudio.stats
+        with stats.timer('fft'):
+            bar_data = self.engine.channel_magnitudes(data, self.rate, self.channel_mode)
+        with stats.timer('binning'):
+            return self.board_data(bar_data, data.shape[0], self.rate), bar_data
+
+    def board_data(self, bar_data, chunk, rate):
+        # column heights of a spectrum or (channels, bins) spectra from a `chunk` sample FFT
+        if bar_data.ndim == 1:
+            bands = self.engine.bands(chunk, rate, BOARD_WIDTH, scale=self.scale)
+            return bands.apply(bar_data).astype(int)
+        # one group of columns per channel, leftover columns stay empty
+        count = BOARD_WIDTH // len(bar_data)
+        bands = self.engine.bands(chunk, rate, count, scale=self.scale)
+        the_data = np.zeros(BOARD_WIDTH, dtype=int)
+        the_data[:count * len(bar_data)] = bands.apply(bar_data).ravel()
         return the_data
 
+    def remote_board_data(self, frame):
+        # RemoteWorker convert: a SpectrumFrame to (heights, spectrum) like BoardTask
+        if frame.kind == KIND_BANDS:
+            # band energies are used as they come, one per column
+            values = frame.values.max(axis=0) if frame.values.ndim == 2 else frame.values
+            the_data = np.zeros(BOARD_WIDTH, dtype=int)
+            count = min(BOARD_WIDTH, len(values))
+            the_data[:count] = values[:count]
+            return the_data, frame.values
+        return self.board_data(frame.values, frame.size, frame.rate), frame.values
+
     def update_cells(self, the_data):
         #the_data = [random.randint(0, BOARD_HEIGHT) for x in range(BOARD_WIDTH)]
         #print(the_data)
@@ -141,32 +250,32 @@ class Spectrum:
             elif self.max_values[i] > 0:
                 self.max_values[i] -= 1
 
-        for x in range(BOARD_WIDTH):
-            for y in range(BOARD_HEIGHT):
-                if y < BOARD_HEIGHT - self.max_values[x]:
-                    color = WHITE
-                elif y < 2:
-                    color = RED
-                elif y < 5:
-                    color = ORANGE
-                else:
-                    color = GREEN
-                cell = self.all_cells_rows[y][x]
-                cell.fill(color)
-                cell.draw_walls()
-
-    # initiates all cells with WHITE bg and saves them to all sprites and to all_cells_rows
-    def init_cells(self):
-        for y in range(BOARD_HEIGHT):
-            row = list()
-            for x in range(BOARD_WIDTH):
-                cell = Cell(WHITE, CELL_SIZE, CELL_SIZE)
-                cell.rect.x = x * CELL_SIZE
-                cell.rect.y = y * CELL_SIZE
-                # Add the car to the list of objects
-                self.all_sprites_list.add(cell)
-                row.append(cell)
-            self.all_cells_rows.append(row)
+        return self.renderer.render(self.max_values)
+
+    def draw_waterfall(self):
+        # newest row at the top, low frequencies on the left
+        pixels = self.waterfall.levels()
+        size = (pixels.shape[1], pixels.shape[0])
+        if self.waterfall_surface is None or self.waterfall_surface.get_size() != size:
+            self.waterfall_surface = pygame.Surface(size, depth=8)
+            self.waterfall_surface.set_palette([tuple(color) for color in self.palette])
+        pygame.surfarray.blit_array(self.waterfall_surface, pixels[::-1].T)
+        self.screen.blit(pygame.transform.scale(self.waterfall_surface, (SCREENWIDTH, SCREENHEIGHT)), (0, 0))
+        return self.screen.get_rect()
+
+    def stats_columns(self):
+        # board columns under the stats overlay
+        return range(STATS_WIDTH // CELL_SIZE + 1)
+
+    def draw_stats(self):
+        # overlay in the top left corner, drawn over freshly redrawn columns every frame
+        if self.stats_font is None:
+            self.stats_font = pygame.font.SysFont('monospace', 14)
+        y = 0
+        for line in self.stats.summary_lines():
+            self.screen.blit(self.stats_font.render(line, True, BLACK, GREY), (0, y))
+            y += self.stats_font.get_linesize()
+        return pygame.Rect(0, 0, STATS_WIDTH, max(y, 1))
 
     def draw_fps(self):
         # defining a font
@@ -177,6 +286,94 @@ class Spectrum:
         self.screen.blit(text, (SCREENWIDTH - 100, SCREENHEIGHT - 50))
 
 
+class BoardTask:
+    # DspWorker task for the board: column heights of the newest chunk, computed only
+    # when a new block has landed in the capture ring
+    def __init__(self, spectrum):
+        self.spectrum = spectrum
+        self.last_index = -1
+
+    def setup(self):
+        self.last_index = -1
+
+    def configure(self, **changes):
+        pass
+
+    def __call__(self, ring):
+        if ring.write_index == self.last_index:
+            return None
+        self.last_index = ring.write_index
+        return self.spectrum.make_spectrum_data(ring.latest(self.spectrum.myaudio.chunk))
+
+
+def cell_color(y, top):
+    # colour of the cell in row y of a column lit from row `top` downwards
+    if y < top:
+        return WHITE
+    elif y < 2:
+        return RED
+    elif y < 5:
+        return ORANGE
+    return GREEN
+
+
+class GridRenderer:
+    # Draws the board column by column, touching only the rows between a column's
+    # old and new height. Cells are blitted from pre-rendered tiles (one per colour);
+    # with bars=True every colour run of a column is a single screen.fill instead.
+
+    def __init__(self, screen, bars=False):
+        self.screen = screen
+        self.bars = bars
+        self.tiles = {}
+        # None forces a full draw of every column on the first frame
+        self.heights = [None for _ in range(BOARD_WIDTH)]
+
+    def tile(self, color):
+        tile = self.tiles.get(color)
+        if tile is None:
+            cell = Cell(color, CELL_SIZE, CELL_SIZE)
+            cell.draw_walls()
+            tile = cell.image
+            self.tiles[color] = tile
+        return tile
+
+    def invalidate(self, columns=None):
+        # redraw the given columns (default all) in full on the next render
+        for x in (range(BOARD_WIDTH) if columns is None else columns):
+            self.heights[x] = None
+
+    def render(self, heights):
+        # returns the dirty rects for pygame.display.update
+        dirty_rects = []
+        for x, height in enumerate(heights):
+            old = self.heights[x]
+            if old == height:
+                continue
+            top = BOARD_HEIGHT - height
+            if old is None:
+                first, last = 0, BOARD_HEIGHT
+            else:
+                first, last = sorted((top, BOARD_HEIGHT - old))
+            dirty_rects.append(self.draw_rows(x, first, last, top))
+            self.heights[x] = height
+        return dirty_rects
+
+    def draw_rows(self, x, first, last, top):
+        left = x * CELL_SIZE
+        if self.bars:
+            # one rect per colour run: white above the bar, then red, orange and green
+            for color, start, stop in ((WHITE, 0, top), (RED, max(top, 0), 2),
+                                       (ORANGE, max(top, 2), 5), (GREEN, max(top, 5), BOARD_HEIGHT)):
+                start, stop = max(start, first), min(stop, last)
+                if start < stop:
+                    self.screen.fill(color, (left, start * CELL_SIZE, CELL_SIZE, (stop - start) * CELL_SIZE))
+        else:
+            self.screen.blits([(self.tile(cell_color(y, top)), (left, y * CELL_SIZE))
+                               for y in range(first, last)], doreturn=False)
+        return pygame.Rect(left, first * CELL_SIZE, CELL_SIZE, (last - first) * CELL_SIZE)
+
+
 class Cell(pygame.sprite.Sprite):
     # This class represents a cell. It derives from the "Sprite" class in Pygame.
 
@@ -228,4 +425,5 @@ class Cell(pygame.sprite.Sprite):
             pygame.draw.rect(self.image, BLACK, r, 0)
 
 if __name__ == '__main__':
-    cells = Spectrum(fps=20)
+    # PyAudioSpectro.py host:port shows the spectra of a SpectrumServer instead of a local input
+    Spectrum(fps=20, remote=sys.argv[1] if len(sys.argv) > 1 else None).run()
@@ -0,0 +1,175 @@
+import numpy as np
+from multiprocessing.shared_memory import SharedMemory
+
+
+class RingBuffer:
+    # Preallocated single-producer / single-consumer sample ring.
+    # The storage is mirrored (every sample lives at i and i + capacity) so that any
+    # window of up to `capacity` samples is one contiguous slice and can be handed
+    # out as a view without copying.
+    # The producer (PortAudio callback) only touches write_index, the consumer only
+    # touches read_index, so no lock is needed under the GIL.
+    # Indices count frames; mono rings are 1-D, multi-channel rings hold (frames, channels).
+
+    def __init__(self, capacity, dtype=np.int16, channels=1):
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self.shape = (2 * self.capacity,) if channels == 1 else (2 * self.capacity, channels)
+        self.allocate()
+        self.read_index = 0
+        self.overruns = 0
+
+    def allocate(self):
+        self.buffer = np.zeros(self.shape, dtype=self.dtype)
+        self.write_index = 0
+
+    def write(self, data, gain=None):
+        # with gain, samples are scaled and converted to the ring dtype during the copy
+        n = len(data)
+        if n > self.capacity:
+            # only the tail survives, but keep the index counting every sample
+            self.write_index += n - self.capacity
+            data = data[-self.capacity:]
+            n = self.capacity
+        cap = self.capacity
+        pos = self.write_index % cap
+        head = min(n, cap - pos)
+        if gain is None:
+            self.buffer[pos:pos + n] = data
+        else:
+            np.multiply(data, gain, out=self.buffer[pos:pos + n], casting='unsafe')
+        # mirror copies come from the converted samples
+        self.buffer[pos + cap:pos + cap + head] = self.buffer[pos:pos + head]
+        if head < n:
+            self.buffer[:n - head] = self.buffer[cap:cap + n - head]
+        self.write_index += n
+
+    def _view(self, start, n):
+        view = self.buffer[start:start + n]
+        view.flags.writeable = False
+        return view
+
+    def latest(self, n):
+        # read-only view of the most recent n samples (zero padded before the first write)
+        return self.window(self.write_index, n)
+
+    def window(self, end, n):
+        # read-only view of the n samples before absolute sample index `end`,
+        # only meaningful while write_index - end + n <= capacity
+        n = min(int(n), self.capacity)
+        stop = end % self.capacity + self.capacity
+        return self._view(stop - n, n)
+
+    def available(self):
+        return self.write_index - self.read_index
+
+    def read(self, n):
+        # next unread block of n samples as a read-only view, or None if not yet complete
+        n = min(int(n), self.capacity)
+        write_index = self.write_index
+        if write_index - self.read_index > self.capacity:
+            # producer lapped us, skip to the oldest sample still in the buffer
+            self.overruns += 1
+            self.read_index = write_index - self.capacity
+        if write_index - self.read_index < n:
+            return None
+        view = self._view(self.read_index % self.capacity, n)
+        self.read_index += n
+        return view
+
+    def read_all(self, n):
+        # every complete unread block of n samples, oldest first
+        blocks = []
+        block = self.read(n)
+        while block is not None:
+            blocks.append(block)
+            block = self.read(n)
+        return blocks
+
+    def close(self):
+        pass
+
+    def reset(self):
+        self.buffer[:] = 0
+        self.write_index = 0
+        self.read_index = 0
+        self.overruns = 0
+
+
+def attach_shared_memory(name):
+    # attach to a block created by another process, the creator owns and unlinks it.
+    # Children share the creator's resource tracker, so nothing to unregister here.
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # track= only exists from Python 3.13 on
+        return SharedMemory(name=name)
+
+
+class SharedRingBuffer(RingBuffer):
+    # RingBuffer whose samples and write index live in multiprocessing shared memory.
+    # The capturing process creates it, a reader in another process attaches with the
+    # same capacity/dtype/channels and the block name. Each process keeps its own read_index.
+    HEADER = 8
+
+    def __init__(self, capacity, dtype=np.int16, channels=1, name=None):
+        self.name = name
+        super().__init__(capacity, dtype=dtype, channels=channels)
+
+    def allocate(self):
+        nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        if self.name is None:
+            self.shm = SharedMemory(create=True, size=self.HEADER + nbytes)
+            self.name = self.shm.name
+            self.owner = True
+        else:
+            self.shm = attach_shared_memory(self.name)
+            self.owner = False
+        self.counter = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.buffer = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=self.HEADER)
+        if self.owner:
+            self.buffer[:] = 0
+            self.counter[0] = 0
+
+    @property
+    def write_index(self):
+        return int(self.counter[0])
+
+    @write_index.setter
+    def write_index(self, value):
+        self.counter[0] = value
+
+    def spec(self):
+        # everything another process needs to attach
+        return (self.capacity, self.dtype.str, self.channels, self.name)
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.counter = None
+        self.buffer = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+
+
+class MappedRingBuffer(RingBuffer):
+    # RingBuffer whose storage is a file mapped with np.memmap, for histories of many
+    # seconds that should live in the page cache rather than in the process heap.
+    # The file is created (sparse, zero filled) at `path` and replaced if it exists.
+
+    def __init__(self, capacity, path, dtype=np.int16, channels=1):
+        self.path = path
+        super().__init__(capacity, dtype=dtype, channels=channels)
+
+    def allocate(self):
+        self.buffer = np.memmap(self.path, dtype=self.dtype, mode='w+', shape=self.shape)
+        self.write_index = 0
+
+    def close(self):
+        if self.buffer is None:
+            return
+        self.buffer.flush()
+        self.buffer = None
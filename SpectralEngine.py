@@ -0,0 +1,426 @@
+import os
+import pickle
+import sys
+import numpy as np
+
+from RingBuffer import RingBuffer
+
+# optional faster FFT backends, numpy.fft is always there as fallback. They are imported
+# by the first engine that uses them (load_backend), not with this module: scipy.fft alone
+# adds about a quarter of a second to the start-up of every tool.
+scipy_fft = None
+pyfftw = None
+
+
+def load_backend(name):
+    # imports the 'scipy' or 'fftw' backend once, returns False when it is not installed
+    global scipy_fft, pyfftw
+    try:
+        if name == 'scipy' and scipy_fft is None:
+            import scipy.fft
+            scipy_fft = scipy.fft
+        elif name == 'fftw' and pyfftw is None:
+            import pyfftw.builders
+            import pyfftw.interfaces.numpy_fft
+            pyfftw = sys.modules['pyfftw']
+    except ImportError:
+        return False
+    return True
+
+WINDOWS = {
+    'hann': np.hanning,
+    'hamming': np.hamming,
+    'blackman': np.blackman,
+    'rect': np.ones,
+}
+
+
+class SpectralPlan:
+    # everything that only depends on (chunk, rate): window, normalization,
+    # frequency axis and the scratch buffer the windowed samples are written to
+    def __init__(self, chunk, rate, window='hann'):
+        self.chunk = chunk
+        self.rate = rate
+        self.window = WINDOWS[window](chunk).astype(np.float32)
+        # amplitude normalization: a full-scale sine of amplitude A reads A/2,
+        # same as the old unwindowed abs(fft) / N
+        self.scale = np.float32(1.0 / self.window.sum())
+        self.bins = chunk // 2
+        self.frequencies = (np.arange(self.bins) * (rate / chunk)).astype(np.float32)
+        self.work = np.empty(chunk, dtype=np.float32)
+        self.fftw = None
+
+
+class BandMap:
+    # Reduces a magnitude spectrum to `count` bands with one np.add.reduceat call.
+    # Bin edges are computed once; scale is 'linear', 'log' or 'octave' (1/fraction octave bands).
+    def __init__(self, chunk, rate, count, scale='linear', fmin=20.0, fraction=3):
+        self.chunk = chunk
+        self.rate = rate
+        self.count = count
+        self.scale = scale
+        bins = chunk // 2
+        resolution = rate / chunk
+        nyquist = rate / 2
+        fmin = max(fmin, resolution)
+        if scale == 'linear':
+            edges = np.linspace(0, nyquist, count + 1)
+        elif scale == 'log':
+            edges = np.geomspace(fmin, nyquist, count + 1)
+        elif scale == 'octave':
+            # bands on the base-ten nominal grid around 1 kHz, starting at the first one above fmin
+            first = int(np.ceil(fraction * np.log2(fmin / 1000.0)))
+            k = np.arange(first, first + count + 1)
+            edges = np.minimum(1000.0 * 2.0 ** ((k - 0.5) / fraction), nyquist)
+        else:
+            raise ValueError(f'unknown band scale: {scale}')
+
+        index = np.clip(np.ceil(edges / resolution).astype(np.intp), 0, bins)
+        # narrow low bands would collapse onto one bin, give each band at least one bin while there are bins left
+        for i in range(1, len(index)):
+            if index[i] <= index[i - 1] and index[i - 1] < bins:
+                index[i] = index[i - 1] + 1
+        self.edges = index
+        widths = np.diff(index)
+        # bands past Nyquist stay empty and read 0, reduceat only sees the non-empty ones
+        self.active = widths > 0
+        self.starts = index[:-1][self.active]
+        self.widths = widths[self.active].astype(np.float32)
+        self.stop = index[-1]
+        self.frequencies = (index * resolution).astype(np.float32)
+        # centre of each band on its own scale (geometric for log and octave bands)
+        lower, upper = self.frequencies[:-1], self.frequencies[1:]
+        self.centres = (lower + upper) / 2 if scale == 'linear' else np.sqrt(lower * upper)
+
+    def apply(self, spectrum):
+        # mean magnitude per band, works on a single spectrum or on the last axis of a batch
+        bands = np.zeros(spectrum.shape[:-1] + (self.count,), dtype=np.float32)
+        if self.starts.size:
+            bands[..., self.active] = np.add.reduceat(spectrum[..., :self.stop], self.starts, axis=-1) / self.widths
+        return bands
+
+
+# zoom decimation filters: stopband attenuation of the Kaiser design, and the share of
+# the decimated band kept free of aliases (the rest is the filter's transition band)
+DECIMATION_ATTENUATION_DB = 80.0
+DECIMATION_PASSBAND = 0.8
+
+
+def fast_length(n):
+    # smallest length >= n the FFT handles quickly (no prime factors above 5); the same in
+    # every process whichever FFT backend it loaded, result shapes depend on it
+    n = int(n)
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def zoom_plan(size, rate, fmax):
+    # (factor, length) of a zoom on 0..fmax Hz: decimation by `factor` keeps fmax inside
+    # the alias-free band, `length` is the FFT size at the decimated rate with bins at
+    # least as fine as size at rate. fmax 0 (or one that rules out decimating) is (1, size).
+    # The length is even: spectra keep length // 2 bins and the estimators take the bin
+    # spacing as rate / (2 * bins).
+    factor = int(DECIMATION_PASSBAND * rate / (2 * fmax)) if fmax else 1
+    if factor < 2:
+        return 1, size
+    return factor, 2 * fast_length(-(-size // (2 * factor)))
+
+
+class Decimator:
+    # Anti-alias low-pass plus decimation by `factor`. The taps are a Kaiser windowed
+    # sinc with its cutoff at the decimated Nyquist frequency, so aliases only fold into
+    # the top (1 - DECIMATION_PASSBAND) of the new band. Only every factor-th output is
+    # computed, each as the dot product of a strided input view with the taps (the
+    # polyphase form), which costs taps / factor multiplies per input sample.
+
+    def __init__(self, factor, attenuation=DECIMATION_ATTENUATION_DB, passband=DECIMATION_PASSBAND):
+        self.factor = factor
+        nyquist = 0.5 / factor
+        # transition width in cycles per input sample, mirrored around the cutoff
+        width = 2 * (1.0 - passband) * nyquist
+        count = int(np.ceil((attenuation - 7.95) / (14.36 * width))) | 1
+        beta = 0.1102 * (attenuation - 8.7)
+        n = np.arange(count) - (count - 1) / 2
+        taps = 2 * nyquist * np.sinc(2 * nyquist * n) * np.kaiser(count, beta)
+        # unity gain at DC, reversed so a window of past samples dots straight into it
+        self.taps = (taps / taps.sum())[::-1].astype(np.float32)
+        self.length = count
+
+    def apply(self, samples):
+        # outputs for the windows ending at samples[length - 1::factor], a 1-D or
+        # (frames, channels) block; returns float32 (outputs,) or (outputs, channels)
+        windows = np.lib.stride_tricks.sliding_window_view(samples, self.length, axis=0)[::self.factor]
+        return np.matmul(windows, self.taps, dtype=np.float32)
+
+
+# how multi-channel spectra are shown: 'sum' (downmix), 'diff' (first minus second
+# channel), 'channels' (one spectrum per channel) or a channel number
+CHANNEL_MODES = ('sum', 'diff', 'channels')
+
+
+def select_channels(samples, mode):
+    # time-domain counterpart of channel_magnitudes for consumers that need one signal
+    if samples.ndim == 1:
+        return samples
+    if mode == 'sum':
+        return samples.mean(axis=1, dtype=np.float32)
+    if mode == 'diff':
+        return (samples[:, 0].astype(np.float32) - samples[:, 1]) / 2
+    if mode == 'channels':
+        return samples[:, 0]
+    return samples[:, int(mode)]
+
+
+class SpectralEngine:
+
+    def __init__(self, window='hann', backend='auto', workers=-1, wisdom_file=None):
+        self.window = window
+        self.workers = workers
+        self.wisdom_file = wisdom_file
+        if backend == 'auto':
+            backend = 'scipy' if load_backend('scipy') else 'numpy'
+        if backend == 'scipy' and not load_backend('scipy'):
+            raise ImportError('scipy is required for the scipy FFT backend')
+        if backend == 'fftw' and not load_backend('fftw'):
+            raise ImportError('pyFFTW is required for the fftw FFT backend')
+        self.backend = backend
+        self.plans = {}
+        self.band_maps = {}
+        self.decimators = {}
+        if self.backend == 'fftw':
+            self.load_wisdom()
+
+    def plan(self, chunk, rate):
+        key = (chunk, rate)
+        plan = self.plans.get(key)
+        if plan is None:
+            plan = SpectralPlan(chunk, rate, self.window)
+            if self.backend == 'fftw':
+                plan.fftw = pyfftw.builders.rfft(plan.work, threads=max(os.cpu_count() or 1, 1),
+                                                 planner_effort='FFTW_MEASURE')
+                self.save_wisdom()
+            self.plans[key] = plan
+        return plan
+
+    def bands(self, chunk, rate, count, scale='linear', fraction=3):
+        key = (chunk, rate, count, scale, fraction)
+        band_map = self.band_maps.get(key)
+        if band_map is None:
+            band_map = BandMap(chunk, rate, count, scale=scale, fraction=fraction)
+            self.band_maps[key] = band_map
+        return band_map
+
+    def decimator(self, factor):
+        decimator = self.decimators.get(factor)
+        if decimator is None:
+            decimator = Decimator(factor)
+            self.decimators[factor] = decimator
+        return decimator
+
+    def frequencies(self, chunk, rate):
+        return self.plan(chunk, rate).frequencies
+
+    def rfft(self, plan):
+        if self.backend == 'fftw':
+            return plan.fftw(plan.work)
+        if self.backend == 'scipy':
+            return scipy_fft.rfft(plan.work, workers=self.workers)
+        return np.fft.rfft(plan.work)
+
+    def rfft_batch(self, frames):
+        if self.backend == 'fftw':
+            return pyfftw.interfaces.numpy_fft.rfft(frames, axis=-1, threads=os.cpu_count() or 1)
+        if self.backend == 'scipy':
+            return scipy_fft.rfft(frames, axis=-1, workers=self.workers)
+        return np.fft.rfft(frames, axis=-1)
+
+    def irfft_batch(self, spectra, n):
+        if self.backend == 'fftw':
+            return pyfftw.interfaces.numpy_fft.irfft(spectra, n, axis=-1, threads=os.cpu_count() or 1)
+        if self.backend == 'scipy':
+            return scipy_fft.irfft(spectra, n, axis=-1, workers=self.workers)
+        return np.fft.irfft(spectra, n, axis=-1)
+
+    def magnitudes(self, frames, rate, work=None):
+        # batched magnitude() for a (frames, chunk) array: one FFT call for all rows.
+        # `work` is an optional float32 scratch array of at least the same shape
+        plan = self.plan(frames.shape[-1], rate)
+        if work is None:
+            work = np.empty(frames.shape, dtype=np.float32)
+        else:
+            work = work[:frames.shape[0]]
+        np.multiply(frames, plan.window, out=work, casting='unsafe')
+        spectra = self.rfft_batch(work)[..., :plan.bins]
+        magnitudes = np.abs(spectra).astype(np.float32, copy=False)
+        magnitudes *= plan.scale
+        return magnitudes
+
+    def channel_spectra(self, data, rate):
+        # complex spectra of a (chunk, channels) block, all channels in one FFT call
+        plan = self.plan(data.shape[0], rate)
+        work = np.multiply(data.T, plan.window, dtype=np.float32)
+        spectra = self.rfft_batch(work)[..., :plan.bins]
+        spectra *= plan.scale
+        return spectra
+
+    def channel_magnitudes(self, data, rate, mode='sum'):
+        # magnitude spectrum of a multi-channel block according to one of CHANNEL_MODES;
+        # 'sum' and 'diff' are averaged so they read like a single channel
+        if data.ndim == 1:
+            return self.magnitude(data, rate)
+        spectra = self.channel_spectra(data, rate)
+        if mode == 'sum':
+            combined = spectra.sum(axis=0) / spectra.shape[0]
+        elif mode == 'diff':
+            combined = (spectra[0] - spectra[1]) / 2
+        elif mode == 'channels':
+            combined = spectra
+        else:
+            combined = spectra[int(mode)]
+        return np.abs(combined).astype(np.float32, copy=False)
+
+    def magnitude(self, data, rate):
+        # float32 magnitude spectrum of one block, DC up to (not including) Nyquist
+        plan = self.plan(data.shape[0], rate)
+        np.multiply(data, plan.window, out=plan.work, casting='unsafe')
+        spectrum = self.rfft(plan)[:plan.bins]
+        magnitude = np.abs(spectrum).astype(np.float32, copy=False)
+        magnitude *= plan.scale
+        return magnitude
+
+    def load_wisdom(self):
+        if self.wisdom_file and os.path.exists(self.wisdom_file):
+            with open(self.wisdom_file, 'rb') as f:
+                pyfftw.import_wisdom(pickle.load(f))
+
+    def save_wisdom(self):
+        if self.wisdom_file:
+            with open(self.wisdom_file, 'wb') as f:
+                pickle.dump(pyfftw.export_wisdom(), f)
+
+
+class SlidingSpectrum:
+    # Overlapping STFT over a capture ring: the FFT size stays fixed and every `hop`
+    # new samples yield one spectrum of the trailing `size` samples. When the caller
+    # polls slower than the hop rate only the newest frame is computed and the
+    # others are counted in `skipped`. The ring needs room for size + hop samples.
+
+    def __init__(self, engine, size, rate, hop, mode='sum'):
+        self.engine = engine
+        self.size = size
+        self.rate = rate
+        # multi-channel rings are combined according to this CHANNEL_MODES entry
+        self.mode = mode
+        self.skipped = 0
+        # absolute ring index the last spectrum ended at
+        self.end = 0
+        self.set_hop(hop)
+
+    def set_hop(self, hop):
+        # takes effect on the next update, capture keeps running
+        self.hop = int(hop)
+        self.next_index = None
+
+    def set_size(self, size, rate=None):
+        # new FFT size and/or sample rate, the plan comes from the engine cache
+        self.size = size
+        if rate is not None:
+            self.rate = rate
+        self.next_index = None
+
+    def update(self, ring):
+        written = ring.write_index
+        if self.next_index is None or self.next_index - written > self.hop:
+            # first call, new hop or a fresh ring: analyse what is there right away
+            end = written
+        elif written < self.next_index:
+            return None
+        else:
+            hops = (written - self.next_index) // self.hop
+            end = self.next_index + hops * self.hop
+            self.skipped += hops
+        self.next_index = end + self.hop
+        self.end = end
+        return self.transform(ring, end)
+
+    def transform(self, ring, end):
+        return self.engine.channel_magnitudes(ring.window(end, self.size), self.rate, self.mode)
+
+    @property
+    def output_size(self):
+        # FFT size and sample rate of the spectra, the peak estimators work on these
+        return self.size
+
+    @property
+    def output_rate(self):
+        return self.rate
+
+    def samples(self, ring, n):
+        # the n samples at output_rate up to where the last spectrum ended
+        return ring.window(self.end, n)
+
+
+class ZoomSpectrum(SlidingSpectrum):
+    # SlidingSpectrum of the band 0..fmax only: the capture is low-passed and decimated
+    # (zoom_plan) into a float32 ring of its own, and the FFT runs on that, a factor
+    # fewer samples for at least the same bin spacing. The decimated ring is fed just
+    # the samples that arrived since the last spectrum, it is refilled from the capture
+    # ring after a settings change or a ring swap. `end` stays a capture ring index.
+
+    def __init__(self, engine, size, rate, hop, fmax, mode='sum'):
+        self.fmax = fmax
+        self.decimated = None
+        super().__init__(engine, size, rate, hop, mode=mode)
+        self.plan_zoom()
+
+    def plan_zoom(self):
+        self.factor, self.length = zoom_plan(self.size, self.rate, self.fmax)
+        self.decimator = self.engine.decimator(self.factor)
+        self.decimated = None
+        # next decimated index to compute, output j covers capture samples up to j * factor
+        self.fed = None
+
+    def set_size(self, size, rate=None):
+        super().set_size(size, rate)
+        self.plan_zoom()
+
+    @property
+    def output_size(self):
+        return self.length
+
+    @property
+    def output_rate(self):
+        return self.rate / self.factor
+
+    def samples(self, ring, n):
+        return self.decimated.window(self.decimated.write_index, n)
+
+    def transform(self, ring, end):
+        self.feed(ring, end)
+        return self.engine.channel_magnitudes(self.samples(ring, self.length), self.output_rate, self.mode)
+
+    def feed(self, ring, end):
+        factor, taps = self.factor, self.decimator.length
+        if self.decimated is None or self.decimated.channels != ring.channels:
+            # room for the peak estimators' lookback behind the FFT window
+            self.decimated = RingBuffer(2 * self.length, dtype=np.float32, channels=ring.channels)
+        stop = (end - 1) // factor + 1
+        # oldest output whose inputs are all still in the capture ring
+        oldest = -(-(end - ring.capacity + taps - 1) // factor)
+        start = max(stop - self.decimated.capacity, oldest)
+        if self.fed is None or not start <= self.fed <= stop:
+            # first spectrum, new settings or a fresh ring
+            self.fed = start
+            self.decimated.write_index = start
+        count = stop - self.fed
+        if count <= 0:
+            return
+        span = (count - 1) * factor + taps
+        self.decimated.write(self.decimator.apply(ring.window((stop - 1) * factor + 1, span)))
+        self.fed = stop
@@ -0,0 +1,514 @@
+import argparse
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+
+from AudioInputStream import AudioIn, SAMPLE_FORMATS
+from DspWorker import SpectrumTask, DspWorker, ResultSlot, AnalysisResult
+from SpectralEngine import SpectralEngine, BandMap, CHANNEL_MODES
+from PitchTracker import PITCH_DETECTORS
+from Instrumentation import Instrumentation
+from Waterfall import MIN_LEVEL
+from Wakeup import WAIT_TIMEOUT
+
+DEFAULT_PORT = 50007
+MAGIC = b'SPEC'
+VERSION = 2
+
+# payload encodings: dB levels quantized to uint8, or plain float16 magnitudes
+ENCODING_UINT8_DB = 0
+ENCODING_FLOAT16 = 1
+ENCODINGS = {'uint8': ENCODING_UINT8_DB, 'float16': ENCODING_FLOAT16}
+# payload kinds: rfft bins, or band energies of a BandMap with the given scale
+KIND_BINS = 0
+KIND_BANDS = 1
+SCALES = ('linear', 'log', 'octave')
+
+# Every frame is a uint32 length followed by the header and channels x values payload:
+# magic, version, encoding, kind, scale, channels, values, sequence, capture time
+# (wall clock), sample rate, FFT size, peak hz, peak error, pitch (nan when unvoiced),
+# pitch confidence, uint8 floor and range in dB
+LENGTH = struct.Struct('<I')
+HEADER = struct.Struct('<4sBBBBHIQdIIffffff')
+# largest UDP payload, bigger frames only go out over TCP
+UDP_MAX = 65507
+
+SpectrumFrame = namedtuple('SpectrumFrame', ['sequence', 'timestamp', 'rate', 'size', 'kind', 'scale',
+                                             'hz', 'error', 'pitch', 'confidence', 'values'])
+
+
+def encode_frame(values, sequence, timestamp, rate, size, hz=0.0, error=0.0, pitch=np.nan, confidence=0.0,
+                 encoding=ENCODING_UINT8_DB, kind=KIND_BINS, scale='linear', floor_db=0.0, range_db=96.0):
+    # one length-prefixed frame; values is one spectrum or (channels, n)
+    values = np.atleast_2d(values)
+    if encoding == ENCODING_UINT8_DB:
+        levels = np.log10(np.maximum(values, MIN_LEVEL))
+        levels *= 20.0
+        levels -= floor_db
+        levels *= 255.0 / range_db
+        payload = np.clip(levels + 0.5, 0, 255).astype(np.uint8)
+    else:
+        payload = values.astype('<f2')
+    header = HEADER.pack(MAGIC, VERSION, encoding, kind, SCALES.index(scale), values.shape[0], values.shape[1],
+                         sequence, timestamp, rate, size, hz, error, pitch, confidence, floor_db, range_db)
+    return LENGTH.pack(HEADER.size + payload.nbytes) + header + payload.tobytes()
+
+
+def decode_frame(body):
+    # frame body without the length prefix -> SpectrumFrame with float32 magnitudes
+    (magic, version, encoding, kind, scale, channels, count, sequence, timestamp, rate, size,
+     hz, error, pitch, confidence, floor_db, range_db) = HEADER.unpack_from(body)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'not a version {VERSION} spectrum frame')
+    if encoding == ENCODING_UINT8_DB:
+        payload = np.frombuffer(body, np.uint8, count=channels * count, offset=HEADER.size)
+        # 256 entry table back to magnitudes
+        table = 10 ** ((np.arange(256) * (range_db / 255.0) + floor_db) / 20.0)
+        values = table.astype(np.float32)[payload]
+    elif encoding == ENCODING_FLOAT16:
+        payload = np.frombuffer(body, '<f2', count=channels * count, offset=HEADER.size)
+        values = payload.astype(np.float32)
+    else:
+        raise ValueError(f'unknown frame encoding {encoding}')
+    values = values.reshape(channels, count)
+    return SpectrumFrame(sequence, timestamp, rate, size, kind, SCALES[scale], hz, error, pitch, confidence,
+                         values[0] if channels == 1 else values)
+
+
+class Subscriber:
+    # one TCP viewer; `pending` is the unsent rest of its current frame
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.pending = None
+        self.dropped = 0
+
+
+class SpectrumServer:
+    # Publishes every new result of a worker (DspWorker interface, fed by one capture)
+    # to any number of TCP subscribers and optional UDP destinations. Each frame is
+    # encoded once. A subscriber whose socket has not drained the previous frame skips
+    # the new one, so slow viewers lose frames but never stall the capture or the others.
+    # The worker's wakeup writes a byte into a socket pair watched by the same selector,
+    # so the loop sleeps until a result or a socket needs it (workers without one are
+    # polled every `interval`).
+
+    def __init__(self, worker, audio=None, host='0.0.0.0', port=DEFAULT_PORT, encoding='uint8', bands=None,
+                 scale='log', udp=(), floor_db=0.0, range_db=96.0, stats=None, interval=0.002, recorder=None):
+        self.worker = worker
+        # with the AudioIn, frames carry the capture time of their newest sample
+        self.audio = audio
+        self.address = (host, port)
+        self.encoding = ENCODINGS[encoding]
+        self.bands = bands
+        self.scale = scale
+        self.udp = [parse_address(target) for target in udp]
+        self.floor_db = floor_db
+        self.range_db = range_db
+        self.stats = stats if stats is not None else Instrumentation()
+        self.interval = interval
+        # optional EventRecorder, sees every published result
+        self.recorder = recorder
+        self.engine = SpectralEngine()
+        self.subscribers = []
+        self.last_sequence = 0
+        self.running = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen()
+        self.listener.setblocking(False)
+        # the port actually bound, port 0 picks a free one
+        self.address = self.listener.getsockname()
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if self.udp else None
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+        self.wakeup = getattr(self.worker, 'wakeup', None)
+        if self.wakeup is not None:
+            self.wakeup.subscribe(self.wake)
+        self.running.set()
+        self.thread = threading.Thread(target=self.run, name='spectrum-server', daemon=True)
+        self.thread.start()
+
+    def wake(self, sequence):
+        # runs on the worker's thread
+        try:
+            self.wake_writer.send(b'\0')
+        except OSError:
+            # pair full (the loop is awake anyway) or already closed
+            pass
+
+    def run(self):
+        timeout = self.interval if self.wakeup is None else WAIT_TIMEOUT
+        while self.running.is_set():
+            for key, events in self.selector.select(timeout=timeout):
+                if key.fileobj is self.listener:
+                    self.accept()
+                    continue
+                if key.fileobj is self.wake_reader:
+                    self.drain_wakeups()
+                    continue
+                if events & selectors.EVENT_READ:
+                    self.receive(key.data)
+                if events & selectors.EVENT_WRITE and key.data in self.subscribers:
+                    self.flush(key.data)
+            sequence, result = self.worker.latest()
+            if result is not None and sequence != self.last_sequence:
+                self.last_sequence = sequence
+                if self.recorder is not None:
+                    self.recorder.submit(result)
+                with self.stats.timer('publish'):
+                    self.broadcast(self.encode(sequence, result))
+        for subscriber in list(self.subscribers):
+            self.drop(subscriber)
+        if self.wakeup is not None:
+            self.wakeup.unsubscribe(self.wake)
+        self.selector.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+        self.listener.close()
+        if self.udp_socket is not None:
+            self.udp_socket.close()
+
+    def encode(self, sequence, result):
+        timestamp = time.time()
+        if self.audio is not None:
+            captured = self.audio.sample_time(result.end - 1)
+            if captured is not None:
+                timestamp -= time.perf_counter() - captured
+        size, rate = self.worker.task.size, self.worker.task.rate
+        values, kind = result.spectrum, KIND_BINS
+        if self.bands:
+            values = self.engine.bands(size, rate, self.bands, scale=self.scale).apply(values)
+            kind = KIND_BANDS
+        return encode_frame(values, sequence, timestamp, rate, size, result.hz, result.error,
+                            result.pitch, result.confidence, encoding=self.encoding, kind=kind, scale=self.scale,
+                            floor_db=self.floor_db, range_db=self.range_db)
+
+    def drain_wakeups(self):
+        try:
+            while self.wake_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def accept(self):
+        try:
+            sock, address = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        subscriber = Subscriber(sock, address)
+        self.subscribers.append(subscriber)
+        self.selector.register(sock, selectors.EVENT_READ, subscriber)
+        self.stats.count('subscribers')
+
+    def receive(self, subscriber):
+        # viewers don't send anything, readable means closed (or junk to discard)
+        try:
+            if subscriber.sock.recv(4096):
+                return
+        except BlockingIOError:
+            return
+        except OSError:
+            pass
+        self.drop(subscriber)
+
+    def broadcast(self, frame):
+        for subscriber in list(self.subscribers):
+            if subscriber.pending is not None:
+                # still busy with an older frame, this one is skipped for it
+                subscriber.dropped += 1
+                self.stats.count('subscriber_dropped_frames')
+                continue
+            subscriber.pending = memoryview(frame)
+            self.flush(subscriber)
+        if self.udp_socket is not None and len(frame) - LENGTH.size <= UDP_MAX:
+            for target in self.udp:
+                try:
+                    self.udp_socket.sendto(frame[LENGTH.size:], target)
+                except OSError:
+                    self.stats.count('udp_errors')
+
+    def flush(self, subscriber):
+        try:
+            sent = subscriber.sock.send(subscriber.pending)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.drop(subscriber)
+            return
+        subscriber.pending = subscriber.pending[sent:] if sent < len(subscriber.pending) else None
+        events = selectors.EVENT_READ if subscriber.pending is None else selectors.EVENT_READ | selectors.EVENT_WRITE
+        self.selector.modify(subscriber.sock, events, subscriber)
+
+    def drop(self, subscriber):
+        self.subscribers.remove(subscriber)
+        self.selector.unregister(subscriber.sock)
+        subscriber.sock.close()
+        self.stats.count('subscribers', -1)
+
+    def stop(self):
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def parse_address(text, default_host='127.0.0.1'):
+    # 'host:port', ':port' or 'port' -> (host, port)
+    host, _, port = text.rpartition(':')
+    return host or default_host, int(port)
+
+
+class RemoteWorker:
+    # DspWorker interface for thin clients: results come from a SpectrumServer instead
+    # of a local capture. 'host:port' subscribes over TCP (reconnecting while running),
+    # 'udp://:port' listens for datagrams. `convert` turns each SpectrumFrame into the
+    # result the GUI expects; by default an AnalysisResult whose `end` is the sequence.
+
+    def __init__(self, address, stats=None, convert=None, retry=1.0):
+        self.udp = address.startswith('udp://')
+        self.address = parse_address(address[len('udp://'):] if self.udp else address,
+                                     default_host='0.0.0.0' if self.udp else '127.0.0.1')
+        self.stats = stats if stats is not None else Instrumentation()
+        self.convert = convert or (lambda frame: AnalysisResult(frame.values, frame.hz, frame.error, frame.sequence,
+                                                                frame.pitch, frame.confidence))
+        self.retry = retry
+        self.slot = ResultSlot()
+        self.wakeup = self.slot.wakeup
+        # settings of the newest frame; `bands` is the BandMap its values came from,
+        # None when they are rfft bins
+        self.frame = None
+        self.size = None
+        self.rate = None
+        self.bands = None
+        self.running = threading.Event()
+        self.sock = None
+        self.thread = None
+
+    def start(self):
+        self.running.set()
+        self.thread = threading.Thread(target=self.run, name='remote-worker', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running.is_set():
+            try:
+                if self.udp:
+                    self.receive_datagrams()
+                else:
+                    self.receive_stream()
+            except (OSError, ValueError) as e:
+                if self.running.is_set():
+                    print(f'spectrum server {self.address}: {e}', file=sys.stderr)
+                    self.stats.count('reconnects')
+                    time.sleep(self.retry)
+            finally:
+                if self.sock is not None:
+                    self.sock.close()
+                    self.sock = None
+
+    def receive_stream(self):
+        self.sock = socket.create_connection(self.address, timeout=self.retry)
+        self.sock.settimeout(0.2)
+        while self.running.is_set():
+            header = self.receive_exactly(LENGTH.size)
+            if header is None:
+                continue
+            (length,) = LENGTH.unpack(header)
+            body = None
+            while body is None and self.running.is_set():
+                body = self.receive_exactly(length)
+            if body is not None:
+                self.deliver(body)
+
+    def receive_exactly(self, n):
+        # n bytes, None on a timeout before the first byte; raises if the server went away
+        buffer = bytearray(n)
+        view = memoryview(buffer)
+        got = 0
+        while got < n:
+            try:
+                received = self.sock.recv_into(view[got:])
+            except socket.timeout:
+                if got == 0:
+                    return None
+                continue
+            if received == 0:
+                raise ConnectionError('connection closed')
+            got += received
+        return buffer
+
+    def receive_datagrams(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(self.address)
+        self.sock.settimeout(0.2)
+        while self.running.is_set():
+            try:
+                body = self.sock.recv(UDP_MAX)
+            except socket.timeout:
+                continue
+            self.deliver(body)
+
+    def deliver(self, body):
+        frame = decode_frame(body)
+        if self.frame is not None and frame.sequence > self.frame.sequence + 1:
+            # skipped by the server for this client, or lost on the way (UDP)
+            self.stats.count('remote_dropped_frames', frame.sequence - self.frame.sequence - 1)
+        self.stats.record('remote_latency', max(time.time() - frame.timestamp, 0.0))
+        self.frame = frame
+        self.size = frame.size
+        self.rate = frame.rate
+        if frame.kind != KIND_BANDS:
+            self.bands = None
+        else:
+            # the server's own map, rebuilt only when its settings change
+            count = frame.values.shape[-1]
+            bands = self.bands
+            if bands is None or (bands.chunk, bands.rate, bands.count, bands.scale) != (frame.size, frame.rate, count,
+                                                                                         frame.scale):
+                self.bands = BandMap(frame.size, frame.rate, count, scale=frame.scale)
+        self.slot.publish(self.convert(frame))
+
+    def configure(self, **changes):
+        # analysis settings belong to the server
+        pass
+
+    def latest(self):
+        return self.slot.latest()
+
+    def stop(self):
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class RemoteSource:
+    # Stands in for AudioIn in thin-client GUIs: no device is opened, the only "input"
+    # is the server. Capture times of remote frames are not known locally.
+
+    def __init__(self, address, chunk=1024, rate=44100, stats=None):
+        self.address = address
+        self.chunk = chunk
+        self.rate = rate
+        self.channels = 1
+        self.stats = stats if stats is not None else Instrumentation()
+        self.device_info = {'index': 0, 'name': f'remote {address}', 'maxInputChannels': 1}
+
+    def start_stream(self, **settings):
+        pass
+
+    def stop_stream(self):
+        pass
+
+    def reconfigure(self, **settings):
+        pass
+
+    def close(self):
+        pass
+
+    def sample_time(self, index):
+        return None
+
+    def get_input_devices_info(self):
+        return [self.device_info]
+
+    def get_device_index_by_name(self, name):
+        return 0
+
+    def get_device_info(self, index):
+        return self.device_info
+
+    def get_default_input_device(self):
+        return self.device_info
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless capture publishing spectra to remote viewers')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--udp', action='append', default=[], help='also send frames to this host:port')
+    parser.add_argument('--encoding', default='uint8', choices=sorted(ENCODINGS))
+    parser.add_argument('--bands', type=int, help='send this many band energies instead of all bins')
+    parser.add_argument('--scale', default='log', choices=SCALES)
+    parser.add_argument('--range-db', type=float, default=96.0, help='dB range of uint8 frames')
+    parser.add_argument('--rate', type=int, default=44100)
+    parser.add_argument('--size', type=int, default=44100, help='FFT size in samples')
+    parser.add_argument('--hop', type=int, default=4410, help='samples between spectra')
+    parser.add_argument('--block', type=int, default=512, help='capture block size')
+    parser.add_argument('--device', type=int)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--format', default='int16', choices=list(SAMPLE_FORMATS), help='capture sample format')
+    parser.add_argument('--mode', default='sum', help=f'channel mode: {", ".join(CHANNEL_MODES)} or a channel number')
+    parser.add_argument('--estimator', default='gaussian')
+    parser.add_argument('--pitch', default='off', choices=['off'] + list(PITCH_DETECTORS),
+                        help='pitch tracker sent along with every frame')
+    parser.add_argument('--synthetic', action='store_true', help='serve the synthetic test signal')
+    parser.add_argument('--record', metavar='DIR', help='dump triggered events (WAV + spectra) into DIR')
+    parser.add_argument('--history', type=float, default=30.0, help='seconds of raw history kept on disk')
+    parser.add_argument('--pre', type=float, default=2.0, help='seconds recorded before a trigger')
+    parser.add_argument('--post', type=float, default=2.0, help='seconds recorded after a trigger')
+    parser.add_argument('--trigger-level', type=float, help='trigger when a bin magnitude exceeds this')
+    parser.add_argument('--trigger-band', nargs=2, type=float, metavar=('LOW', 'HIGH'),
+                        help='trigger when the peak frequency enters LOW..HIGH Hz')
+    args = parser.parse_args(argv)
+
+    backend = None
+    if args.synthetic:
+        from AudioSources import SyntheticBackend
+        backend = SyntheticBackend()
+    stats = Instrumentation()
+    audio = AudioIn(chunk=args.block, history=2 * args.size, channels=args.channels, backend=backend, stats=stats,
+                    sample_format=args.format)
+    task = SpectrumTask(args.size, args.rate, args.hop, mode=args.mode, estimator=args.estimator, pitch=args.pitch,
+                        stats=stats)
+    worker = DspWorker(audio, task)
+    recorder = None
+    if args.record:
+        from EventRecorder import EventRecorder, LevelTrigger, BandTrigger
+        triggers = []
+        if args.trigger_level is not None:
+            triggers.append(LevelTrigger(args.trigger_level))
+        if args.trigger_band:
+            triggers.append(BandTrigger(*args.trigger_band))
+        recorder = EventRecorder(audio, triggers, args.record, seconds=args.history, pre=args.pre, post=args.post,
+                                 stats=stats)
+    server = SpectrumServer(worker, audio, host=args.host, port=args.port, encoding=args.encoding,
+                            bands=args.bands, scale=args.scale, udp=args.udp, range_db=args.range_db, stats=stats,
+                            recorder=recorder)
+    audio.start_stream(rate=args.rate, chunk=args.block, device=args.device, channels=args.channels)
+    worker.start()
+    if recorder is not None:
+        recorder.start()
+    server.start()
+    print(f'serving spectra on {server.address[0]}:{server.address[1]}', file=sys.stderr)
+    try:
+        while True:
+            time.sleep(10)
+            print(' | '.join(stats.summary_lines()), file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+    if recorder is not None:
+        recorder.stop()
+    worker.stop()
+    audio.close()
+
+
+if __name__ == '__main__':
+    main()
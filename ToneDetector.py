@@ -0,0 +1,232 @@
+import argparse
+import json
+import sys
+import time
+from collections import namedtuple, deque
+import numpy as np
+
+from AudioInputStream import AudioIn, SAMPLE_FORMATS
+from SpectralEngine import select_channels
+from DspWorker import DspWorker
+from Instrumentation import Instrumentation
+
+# ring samples are in int16 units whatever the capture format, levels are dB below this
+FULL_SCALE = 32768.0
+# silence floor of the levels
+MIN_LEVEL_DB = -140.0
+
+# one tone crossing its threshold: kind 'on' when it rose above, 'off' when it fell below
+# threshold - hysteresis; `end` is the capture ring index the measurement ended at
+ToneEvent = namedtuple('ToneEvent', ['end', 'hz', 'kind', 'level'])
+# levels (dBFS) and on/off state per tone; `events` holds the most recent events, newest
+# last, so a reader that skipped results takes the ones past the last `end` it handled
+ToneResult = namedtuple('ToneResult', ['levels', 'active', 'events', 'end'])
+
+
+class ToneBank:
+    # Sliding DFT of a fixed set of frequencies over the last `size` samples of a ring,
+    # updated incrementally: every update adds the contribution of the samples that
+    # arrived and subtracts that of the ones that left the window, one real (6 * tones, new)
+    # matrix product, so the cost is O(tones) per sample whatever the window length.
+    # Sums are referenced to absolute ring indices, which makes them independent of the
+    # block sizes. Each tone is tracked at f and f +- rate/size, the three combine into a
+    # Hann windowed value (leakage of neighbouring tones drops from -13 to -31 dB). A tone
+    # reads amplitude / 2, the scale of the SpectralEngine magnitudes.
+
+    def __init__(self, tones, rate, window=0.1, mode='sum'):
+        self.tones = np.asarray(tones, dtype=np.float64)
+        self.rate = rate
+        # multi-channel rings are combined according to this CHANNEL_MODES entry
+        self.mode = mode
+        self.size = max(2, int(round(window * rate)))
+        step = rate / self.size
+        # (tones, 3): f - step, f, f + step
+        frequencies = self.tones[:, None] + step * np.arange(-1, 2)
+        self.omega = (2 * np.pi / rate * frequencies).ravel()
+        # real and imaginary parts of exp(-j w m) for m < size stacked into one real matrix,
+        # BLAS only takes real-by-real products at full speed
+        angles = np.outer(self.omega, np.arange(self.size))
+        self.basis = np.concatenate((np.cos(angles), -np.sin(angles)))
+        self.leaving = np.exp(1j * self.omega * self.size)
+        self.sums = np.zeros(self.omega.size, dtype=np.complex128)
+        # absolute ring index the sums end at
+        self.index = None
+        self.magnitudes = np.zeros(self.tones.size)
+
+    def complex(self, stacked):
+        half = self.omega.size
+        return stacked[:half] + 1j * stacked[half:]
+
+    def phase(self, index):
+        return np.exp(-1j * ((self.omega * index) % (2 * np.pi)))
+
+    def update(self, ring):
+        # brings the sums up to ring.write_index, returns False when nothing arrived
+        written = ring.write_index
+        count = 0 if self.index is None else written - self.index
+        if self.index is not None and count == 0:
+            return False
+        if self.index is None or not 0 < count < self.size or count + self.size > ring.capacity:
+            # first update, a fresh ring or too far behind: the whole window from scratch
+            window = select_channels(ring.window(written, self.size), self.mode)
+            self.sums = self.phase(written - self.size) * self.complex(self.basis @ window)
+        else:
+            # float64 sums, the rounding drift stays far below the int16 noise floor
+            arrived = select_channels(ring.window(written, count), self.mode)
+            left = select_channels(ring.window(written - self.size, count), self.mode)
+            columns = np.column_stack((arrived, left)).astype(np.float64)
+            delta = self.complex(self.basis[:, :count] @ columns)
+            self.sums += self.phase(self.index) * (delta[:, 0] - self.leaving * delta[:, 1])
+        self.index = written
+        lower, centre, upper = self.sums.reshape(-1, 3).T
+        # Hann window applied in the frequency domain, relative to the window start
+        rotation = np.exp(-2j * np.pi * ((written - self.size) % self.size) / self.size)
+        hann = 0.5 * centre - 0.25 * rotation * lower - 0.25 * np.conj(rotation) * upper
+        np.abs(hann, out=self.magnitudes)
+        self.magnitudes /= self.size / 2
+        return True
+
+    def levels(self):
+        # dBFS of each tone's amplitude
+        return 20 * np.log10(np.maximum(2 * self.magnitudes / FULL_SCALE, 10 ** (MIN_LEVEL_DB / 20)))
+
+
+class ToneTask:
+    # DspWorker task for tone monitoring: a ToneBank over the ring plus a threshold per
+    # tone with hysteresis. A result comes every `hop` samples; the state changes in it
+    # are ToneEvents, the last `history` of which travel along with every result.
+    # Plain settings until setup(), like SpectrumTask.
+
+    def __init__(self, tones, rate, hop=512, window=0.1, threshold=-60.0, hysteresis=3.0, mode='sum', history=64,
+                 stats=None):
+        self.tones = list(tones)
+        self.rate = rate
+        self.hop = hop
+        self.window = window
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.mode = mode
+        self.history = history
+        self.stats = stats if stats is not None else Instrumentation()
+        self.bank = None
+        self.active = None
+        self.replan = False
+
+    def setup(self):
+        if self.bank is None or not np.array_equal(self.bank.tones, self.tones):
+            # states and events of the tones being watched survive other setting changes
+            self.active = np.zeros(len(self.tones), dtype=bool)
+            self.events = deque(maxlen=self.history)
+        self.bank = ToneBank(self.tones, self.rate, self.window, mode=self.mode)
+        self.next_index = None
+        # ring index from which on the window holds only samples taken with these settings
+        self.settled = None
+        self.replan = False
+
+    def configure(self, tones=None, rate=None, hop=None, window=None, threshold=None, hysteresis=None, mode=None):
+        if tones is not None:
+            self.tones = list(tones)
+        if rate is not None:
+            self.rate = rate
+        if hop is not None:
+            self.hop = hop
+        if window is not None:
+            self.window = window
+        if threshold is not None:
+            self.threshold = threshold
+        if hysteresis is not None:
+            self.hysteresis = hysteresis
+        if mode is not None:
+            self.mode = mode
+        if self.bank is not None and (tones is not None or rate is not None or window is not None or mode is not None):
+            # rebuilt by the next call, on the worker's thread
+            self.replan = True
+
+    def __call__(self, ring):
+        if self.replan:
+            self.setup()
+        written = ring.write_index
+        if self.next_index is not None and self.next_index - self.hop <= written < self.next_index:
+            # still inside the current hop (an index behind it means a fresh ring)
+            return None
+        if self.next_index is None or written < self.next_index - self.hop:
+            # first call after setup() or a fresh ring: the window still holds zero padding or
+            # samples from before the change, which splatter across the tones for one window
+            self.settled = written + self.bank.size
+        with self.stats.timer('tones'):
+            if not self.bank.update(ring):
+                return None
+            self.next_index = written + self.hop
+            levels = self.bank.levels()
+            # on at the threshold, off only once below threshold - hysteresis
+            active = np.where(self.active, levels >= self.threshold - self.hysteresis, levels >= self.threshold)
+            if written < self.settled:
+                active = self.active
+            for i in np.flatnonzero(active != self.active):
+                self.events.append(ToneEvent(written, self.tones[i], 'on' if active[i] else 'off', float(levels[i])))
+                self.stats.count('tone_events')
+            self.active = active
+        return ToneResult(levels, active.copy(), tuple(self.events), written)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless tone monitor: per-tone levels and threshold events '
+                                                 'as JSON lines')
+    parser.add_argument('tones', type=float, nargs='+', help='frequencies to watch, in Hz')
+    parser.add_argument('--threshold', type=float, default=-60.0, help='dBFS at which a tone counts as on')
+    parser.add_argument('--hysteresis', type=float, default=3.0, help='dB below the threshold before it is off')
+    parser.add_argument('--window', type=float, default=0.1, help='seconds of input per measurement')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between level lines, 0 for events only')
+    parser.add_argument('--seconds', type=float, help='stop after this long')
+    parser.add_argument('--rate', type=int, default=44100)
+    parser.add_argument('--block', type=int, default=512, help='capture block size')
+    parser.add_argument('--device', type=int)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--format', default='int16', choices=list(SAMPLE_FORMATS), help='capture sample format')
+    parser.add_argument('--synthetic', action='store_true', help='monitor a synthetic sweep instead of a device')
+    args = parser.parse_args(argv)
+
+    backend = None
+    if args.synthetic:
+        from AudioSources import SyntheticBackend, SignalGenerator
+        # a 10 s sweep across the watched range turns every tone on and off once per pass
+        sweep = (0.5 * min(args.tones), 1.5 * max(args.tones), 10.0, 8000.0)
+        backend = SyntheticBackend(SignalGenerator(tones=(), sweep=sweep, noise=20.0))
+    stats = Instrumentation()
+    size = int(args.window * args.rate)
+    audio = AudioIn(chunk=args.block, history=2 * size + args.block, channels=args.channels, backend=backend,
+                    stats=stats, sample_format=args.format)
+    task = ToneTask(args.tones, args.rate, hop=args.block, window=args.window, threshold=args.threshold,
+                    hysteresis=args.hysteresis, stats=stats)
+    worker = DspWorker(audio, task)
+    audio.start_stream(rate=args.rate, chunk=args.block, device=args.device, channels=args.channels)
+    worker.start()
+    started = time.time()
+    next_report = started
+    sequence = last_end = 0
+    try:
+        while args.seconds is None or time.time() - started < args.seconds:
+            sequence = worker.wakeup.wait(sequence)
+            _, result = worker.latest()
+            if result is None:
+                continue
+            now = time.time()
+            for event in result.events:
+                if event.end > last_end:
+                    print(json.dumps({'time': round(now, 3), 'hz': event.hz, 'event': event.kind,
+                                      'level_db': round(event.level, 1)}), flush=True)
+            last_end = result.end
+            if args.interval and now >= next_report:
+                next_report = now + args.interval
+                print(json.dumps({'time': round(now, 3), 'levels_db': {f'{hz:g}': round(float(level), 1)
+                                                                       for hz, level in zip(task.tones, result.levels)}}),
+                      flush=True)
+    except KeyboardInterrupt:
+        pass
+    worker.stop()
+    audio.close()
+    print(' | '.join(stats.summary_lines()), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+# longest a waiting thread sleeps before it re-checks whether it should stop
+WAIT_TIMEOUT = 0.1
+
+
+class Wakeup:
+    # A monotonically increasing sequence number and the ways to wait for it to move:
+    # wait() for threads (a Condition), subscribe() for callbacks run on the producer's
+    # thread (a Qt signal's emit, a socket write for a selector), and next() for asyncio.
+    # The producer calls bump() once per new block or result; consumers remember the
+    # sequence they handled, so several bumps before they wake coalesce into one.
+
+    def __init__(self):
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.callbacks = []
+
+    def bump(self):
+        with self.condition:
+            self.sequence += 1
+            self.condition.notify_all()
+        for callback in self.callbacks:
+            callback(self.sequence)
+
+    def wait(self, sequence, timeout=WAIT_TIMEOUT):
+        # blocks until the sequence differs from `sequence` or the timeout passed,
+        # returns the current sequence
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != sequence, timeout)
+            return self.sequence
+
+    def subscribe(self, callback):
+        # callback(sequence) after every bump; keep it short, it runs on the producer
+        # (for AudioIn that is the PortAudio callback)
+        self.callbacks = self.callbacks + [callback]
+
+    def unsubscribe(self, callback):
+        self.callbacks = [c for c in self.callbacks if c is not callback]
+
+    async def next(self, sequence):
+        # asyncio: resolves to the current sequence once it differs from `sequence`
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(value):
+            if not future.done():
+                future.set_result(value)
+
+        def wake(value):
+            loop.call_soon_threadsafe(resolve, value)
+
+        self.subscribe(wake)
+        try:
+            if self.sequence != sequence:
+                return self.sequence
+            return await future
+        finally:
+            self.unsubscribe(wake)
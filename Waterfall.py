@@ -0,0 +1,106 @@
+import numpy as np
+
+from RingBuffer import RingBuffer
+
+# magnitudes below this count as silence when converting to dB
+MIN_LEVEL = 1e-3
+
+
+class Waterfall:
+    # Scrolling spectrogram history: the last `depth` spectra as float32 dB rows in a
+    # mirrored RingBuffer, so the time-ordered (depth, columns) image is always one
+    # contiguous view and adding a row is a single row write, never an np.roll.
+    # The image is kept near display size, since renderers pay per pixel: with columns
+    # set, bins are max-pooled into that many columns, and each row holds the peak of
+    # `stride` consecutive frames. Peak hold keeps a narrow or short tone visible.
+
+    def __init__(self, depth, bins, columns=None, stride=1, floor_db=0.0, range_db=80.0, reference=1.0):
+        self.depth = depth
+        self.stride = stride
+        self.floor_db = floor_db
+        self.range_db = range_db
+        self.reference = reference
+        self.set_bins(bins, columns)
+
+    def set_bins(self, bins, columns=None):
+        # (re)allocates for a new spectrum length, the history starts empty
+        self.bins = bins
+        self.group = 1 if columns is None else max(1, -(-bins // columns))
+        self.columns = -(-bins // self.group)
+        self.starts = np.arange(0, bins, self.group)
+        self.ring = RingBuffer(self.depth, dtype=np.float32, channels=self.columns)
+        self.ring.buffer[:] = self.floor_db
+        self.row = np.empty((1, self.columns), dtype=np.float32)
+        self.incoming = np.empty(self.columns, dtype=np.float32)
+        # frames folded into `row` so far
+        self.held = 0
+        self.indices = np.empty((self.depth, self.columns), dtype=np.float32)
+        self.pixels = np.empty((self.depth, self.columns), dtype=np.uint8)
+
+    def set_depth(self, depth):
+        if depth != self.depth:
+            self.depth = depth
+            self.set_bins(self.bins, None if self.group == 1 else self.columns)
+
+    def set_stride(self, stride):
+        # frames per row from the next row on, rows already in the history stay
+        self.stride = max(1, int(stride))
+
+    def push(self, spectrum):
+        # one analysis frame, returns True when it completed a row;
+        # (channels, bins) spectra are reduced to their maximum
+        spectrum = np.asarray(spectrum)
+        if spectrum.ndim == 2:
+            spectrum = spectrum.max(axis=0)
+        if spectrum.shape[0] != self.bins:
+            self.set_bins(spectrum.shape[0], None if self.group == 1 else self.columns)
+        row = self.row[0]
+        incoming = row if self.held == 0 else self.incoming
+        if self.group == 1:
+            incoming[:] = spectrum
+        else:
+            np.maximum.reduceat(spectrum, self.starts, out=incoming)
+        if self.held:
+            np.maximum(row, incoming, out=row)
+        self.held += 1
+        if self.held < self.stride:
+            return False
+        # dB only once per row, the peak of the magnitudes is the peak of their levels
+        np.maximum(row, MIN_LEVEL * self.reference, out=row)
+        row /= self.reference
+        np.log10(row, out=row)
+        row *= 20.0
+        self.ring.write(self.row)
+        self.held = 0
+        return True
+
+    def image(self):
+        # read-only (depth, columns) dB view, oldest row first
+        return self.ring.latest(self.depth)
+
+    @property
+    def column_width(self):
+        # spectrum bins per image column
+        return self.group
+
+    def levels(self):
+        # image as 0..255 colour indices for palette based renderers, into a reused array
+        np.subtract(self.image(), self.floor_db, out=self.indices)
+        self.indices *= 255.0 / self.range_db
+        np.clip(self.indices, 0, 255, out=self.indices)
+        self.pixels[:] = self.indices
+        return self.pixels
+
+
+def palette(name='heat'):
+    # (256, 3) uint8 colour table: 'heat' runs black - blue - red - yellow - white
+    ramp = np.linspace(0.0, 1.0, 256)
+    if name == 'grey':
+        colors = np.column_stack((ramp, ramp, ramp))
+    elif name == 'heat':
+        stops = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+        points = np.array([[0, 0, 0], [0, 0, 0.6], [0.8, 0, 0.2], [1, 0.85, 0], [1, 1, 1]])
+        colors = np.column_stack([np.interp(ramp, stops, points[:, c]) for c in range(3)])
+    else:
+        raise ValueError(f'unknown palette {name!r}')
+    return (colors * 255).astype(np.uint8)
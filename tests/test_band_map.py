@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from SpectralEngine import BandMap
+
+CHUNK = 4096
+RATE = 48000
+BINS = CHUNK // 2
+
+
+@pytest.mark.parametrize('scale', ['linear', 'log', 'octave'])
+def test_edges_are_bins_in_order(scale):
+    bands = BandMap(CHUNK, RATE, 30, scale=scale)
+    assert bands.edges.dtype.kind == 'i'
+    assert bands.edges[0] >= 0 and bands.edges[-1] <= BINS
+    assert np.all(np.diff(bands.edges) >= 0)
+    assert np.all(bands.centres >= bands.frequencies[:-1])
+    assert np.all(bands.centres <= bands.frequencies[1:])
+
+
+def test_linear_bands_cover_every_bin():
+    bands = BandMap(CHUNK, RATE, 64)
+    assert bands.edges[0] == 0 and bands.edges[-1] == BINS
+    assert np.all(np.diff(bands.edges) > 0)
+
+
+def test_narrow_log_bands_get_a_bin_each():
+    # 40 log bands from 20 Hz: the lowest are far narrower than the 11.7 Hz bins
+    bands = BandMap(CHUNK, RATE, 40, scale='log')
+    assert np.all(np.diff(bands.edges) >= 1)
+    assert bands.edges[-1] == BINS
+    assert bands.active.all()
+
+
+def test_octave_bands_sit_on_the_nominal_grid():
+    chunk = 65536
+    resolution = RATE / chunk
+    bands = BandMap(chunk, RATE, 30, scale='octave', fmin=20.0)
+    # third octave band edges around 1 kHz are 1000 * 2 ** (+-1 / 6)
+    k = int(np.argmin(np.abs(bands.centres - 1000.0)))
+    assert bands.frequencies[k] == pytest.approx(1000.0 * 2 ** (-1 / 6), abs=resolution)
+    assert bands.frequencies[k + 1] == pytest.approx(1000.0 * 2 ** (1 / 6), abs=resolution)
+    assert bands.frequencies[0] >= 20.0 * 2 ** (-1 / 6) - resolution
+
+
+def test_bands_past_nyquist_are_empty_and_read_zero():
+    # 1/3 octaves from 1 kHz: the top of 30 bands would be far above 24 kHz
+    bands = BandMap(CHUNK, RATE, 30, scale='octave', fmin=1000.0)
+    assert not bands.active.all()
+    assert bands.edges[-1] == BINS
+    result = bands.apply(np.ones(BINS, dtype=np.float32))
+    np.testing.assert_array_equal(result[~bands.active], 0.0)
+    np.testing.assert_allclose(result[bands.active], 1.0)
+
+
+def test_apply_is_the_mean_magnitude_per_band():
+    bands = BandMap(CHUNK, RATE, 24, scale='log')
+    spectra = np.random.default_rng(0).random((3, BINS)).astype(np.float32)
+    result = bands.apply(spectra)
+    assert result.shape == (3, 24)
+    expected = [[row[a:b].mean() for a, b in zip(bands.edges[:-1], bands.edges[1:])] for row in spectra]
+    np.testing.assert_allclose(result, expected, rtol=1e-5)
+
+
+def test_unknown_scale_is_rejected():
+    with pytest.raises(ValueError):
+        BandMap(CHUNK, RATE, 10, scale='mel')
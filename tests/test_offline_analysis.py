@@ -0,0 +1,148 @@
+import struct
+import numpy as np
+import pytest
+
+from OfflineAnalysis import (wav_dtype, full_scale, open_wav, open_raw, write_wav, analyze,
+                             WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_EXTENSIBLE)
+from AudioSources import SignalGenerator, WavReplay
+
+RATE = 48000
+
+
+def pcm_wav(path, samples, bits, extensible=False):
+    # int32 (frames, channels) samples holding `bits`-bit values as a PCM WAV file, with
+    # the sample format either in the fmt chunk or in a WAVE_FORMAT_EXTENSIBLE subformat
+    frames, channels = samples.shape
+    width = bits // 8
+    data = np.ascontiguousarray(samples, dtype='<i4').view(np.uint8).reshape(frames, channels, 4)[..., :width]
+    if extensible:
+        fmt = struct.pack('<HHIIHHHHIH14s', WAVE_FORMAT_EXTENSIBLE, channels, RATE, RATE * channels * width,
+                          channels * width, bits, 22, bits, 0, WAVE_FORMAT_PCM, bytes(14))
+    else:
+        fmt = struct.pack('<HHIIHH', WAVE_FORMAT_PCM, channels, RATE, RATE * channels * width,
+                          channels * width, bits)
+    # an unknown chunk before the data, which the reader has to skip
+    body = (b'WAVE' + struct.pack('<4sI', b'fmt ', len(fmt)) + fmt + struct.pack('<4sI', b'LIST', 3) + b'abc\0' +
+            struct.pack('<4sI', b'data', data.size) + data.tobytes())
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sI', b'RIFF', len(body)) + body)
+
+
+def stereo(frames, bits):
+    # two tones at half and quarter full scale of a `bits`-bit format
+    peak = 2 ** (bits - 1) - 1
+    left = SignalGenerator(tones=[(1000.0, 0.5 * peak)]).generate(0, frames, RATE)
+    right = SignalGenerator(tones=[(300.0, -0.25 * peak)]).generate(0, frames, RATE)
+    return np.round(np.column_stack((left, right))).astype(np.int32)
+
+
+@pytest.mark.parametrize('format_tag, bits, dtype', [
+    (WAVE_FORMAT_PCM, 16, '<i2'),
+    (WAVE_FORMAT_PCM, 32, '<i4'),
+    (WAVE_FORMAT_IEEE_FLOAT, 32, '<f4'),
+])
+def test_wav_dtype(format_tag, bits, dtype):
+    assert wav_dtype(format_tag, bits) == np.dtype(dtype)
+
+
+def test_wav_dtype_maps_24_bit_as_byte_triples():
+    assert wav_dtype(WAVE_FORMAT_PCM, 24).itemsize == 3
+
+
+@pytest.mark.parametrize('format_tag, bits', [(WAVE_FORMAT_PCM, 8), (WAVE_FORMAT_IEEE_FLOAT, 64), (2, 16)])
+def test_wav_dtype_rejects_other_formats(format_tag, bits):
+    with pytest.raises(ValueError):
+        wav_dtype(format_tag, bits)
+
+
+def test_full_scale():
+    assert full_scale(np.dtype(np.int16)) == 32768.0
+    assert full_scale(np.dtype(np.int32)) == 2.0 ** 31
+    assert full_scale(np.dtype(np.float32)) == 1.0
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.float32])
+def test_write_wav_round_trip(tmp_path, dtype):
+    samples = stereo(1000, 16).astype(dtype)
+    path = str(tmp_path / 'round.wav')
+    write_wav(path, samples, RATE, block=256)
+    read, rate = open_wav(path)
+    assert rate == RATE
+    assert read.shape == samples.shape
+    # float files hold int16 units scaled to +-1
+    np.testing.assert_allclose(read * (32768.0 / full_scale(read.dtype)), samples, rtol=1e-6)
+
+
+@pytest.mark.parametrize('extensible', [False, True])
+def test_24_bit_pcm(tmp_path, extensible):
+    samples = stereo(1000, 24)
+    path = str(tmp_path / 'deep.wav')
+    pcm_wav(path, samples, 24, extensible)
+    read, rate = open_wav(path)
+    assert rate == RATE
+    assert read.shape == (1000, 2)
+    assert full_scale(read.dtype) == 2.0 ** 31
+    # the samples end up in the top 24 bits of an int32
+    np.testing.assert_array_equal(read[:, 0], samples[:, 0] << 8)
+    np.testing.assert_array_equal(read[100:110], samples[100:110] << 8)
+
+
+def test_24_bit_reads_like_16_bit(tmp_path):
+    paths = []
+    for bits in (16, 24):
+        paths.append(str(tmp_path / f'{bits}.wav'))
+        pcm_wav(paths[-1], stereo(RATE // 2, bits), bits)
+    levels = []
+    for path in paths:
+        samples, _ = open_wav(path)
+        analyze(samples[:, 0], RATE, path[:-4], batch=8)
+        peaks = np.loadtxt(path[:-4] + '_peaks.csv', delimiter=',', skiprows=1)
+        assert peaks[:, 1] == pytest.approx(1000.0, abs=1.0)
+        levels.append(peaks[:, 2])
+    np.testing.assert_allclose(levels[1], levels[0], rtol=1e-3)
+
+
+def test_wav_replay_of_24_bit_in_int16_units(tmp_path):
+    path = str(tmp_path / 'deep.wav')
+    samples = stereo(1000, 24)
+    pcm_wav(path, samples, 24)
+    block = WavReplay(path).read(100, 2, RATE)
+    expected = stereo(1000, 16)[:100]
+    np.testing.assert_allclose(block, expected, atol=1.0)
+
+
+def test_open_wav_rejects_other_files(tmp_path):
+    path = tmp_path / 'not.wav'
+    path.write_bytes(b'RIFX' + bytes(40))
+    with pytest.raises(ValueError):
+        open_wav(str(path))
+    path.write_bytes(struct.pack('<4sI4s', b'RIFF', 4, b'WAVE'))
+    with pytest.raises(ValueError):
+        open_wav(str(path))
+
+
+def test_open_raw(tmp_path):
+    path = tmp_path / 'raw.pcm'
+    samples = stereo(101, 16).astype('<i2')
+    # a trailing partial frame is dropped
+    path.write_bytes(samples.tobytes() + b'\0\0')
+    read, rate = open_raw(str(path), RATE, channels=2)
+    assert rate == RATE
+    np.testing.assert_array_equal(read, samples)
+
+
+def test_analyze_outputs(tmp_path):
+    # on bin 20 of the 2048 point FFT, no scalloping loss
+    samples = SignalGenerator(tones=[(468.75, 8000.0)]).generate(0, 20000, RATE).astype(np.int16)
+    prefix = str(tmp_path / 'tone')
+    count = analyze(samples, RATE, prefix, size=2048, hop=512, batch=7, bands=16)
+    assert count == (20000 - 2048) // 512 + 1
+    spectrogram = np.load(prefix + '_spectrogram.npy')
+    bands = np.load(prefix + '_bands.npy')
+    peaks = np.loadtxt(prefix + '_peaks.csv', delimiter=',', skiprows=1)
+    assert spectrogram.shape == (count, 1024)
+    assert bands.shape == (count, 16)
+    assert peaks.shape == (count, 3)
+    assert peaks[:, 1] == pytest.approx(468.75, abs=0.1)
+    # a tone of amplitude A reads A / 2
+    assert spectrogram.max(axis=1) == pytest.approx(4000.0, rel=1e-3)
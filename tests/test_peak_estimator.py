@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from SpectralEngine import SpectralEngine
+from AudioSources import SignalGenerator
+from PeakEstimator import make_estimator, interpolate_peaks
+
+SIZE = 4096
+RATE = 48000
+RESOLUTION = RATE / SIZE
+# tones from on a bin to almost one bin above it
+OFFSETS = np.linspace(0.0, 0.95, 20)
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return SpectralEngine(backend='numpy')
+
+
+def tone(hz, frames):
+    # noise-free float samples, SignalGenerator.read would add int16 rounding
+    return SignalGenerator(tones=[(hz, 8000.0)]).generate(0, frames, RATE)
+
+
+def errors(engine, estimator):
+    # (|estimate - true|, expected error) in bins for tones across one bin
+    results = []
+    for offset in OFFSETS:
+        hz = (200 + offset) * RESOLUTION
+        samples = tone(hz, SIZE + estimator.lookback)
+        estimate, expected = estimator.estimate(engine.magnitude(samples[-SIZE:], RATE), RATE, samples)
+        results.append((abs(estimate - hz) / RESOLUTION, expected / RESOLUTION))
+    return np.array(results)
+
+
+@pytest.mark.parametrize('name', ['argmax', 'parabolic', 'gaussian', 'zoom'])
+def test_bias_within_the_expected_error(engine, name):
+    results = errors(engine, make_estimator(name, engine))
+    assert np.all(results[:, 0] <= results[:, 1])
+
+
+def test_gaussian_beats_parabolic(engine):
+    parabolic = errors(engine, make_estimator('parabolic', engine))[:, 0].max()
+    gaussian = errors(engine, make_estimator('gaussian', engine))[:, 0].max()
+    assert gaussian < parabolic / 2
+
+
+def test_phase_vocoder_is_exact_on_a_steady_tone(engine):
+    assert errors(engine, make_estimator('phase', engine))[:, 0].max() < 1e-3
+
+
+def test_phase_vocoder_without_lookback_falls_back_to_the_bin(engine):
+    estimator = make_estimator('phase', engine)
+    samples = tone(200.5 * RESOLUTION, SIZE)
+    hz, expected = estimator.estimate(engine.magnitude(samples, RATE), RATE, samples)
+    assert hz / RESOLUTION == pytest.approx(round(hz / RESOLUTION))
+    assert expected == RESOLUTION / 2
+
+
+def test_zoom_without_chirp_z(engine):
+    estimator = make_estimator('zoom', engine)
+    estimator.czt = None
+    results = errors(engine, estimator)
+    assert np.all(results[:, 0] <= results[:, 1])
+
+
+def test_interpolate_peaks_matches_the_gaussian_estimator(engine):
+    estimator = make_estimator('gaussian', engine)
+    magnitudes = np.array([engine.magnitude(tone((300 + offset) * RESOLUTION, SIZE), RATE) for offset in OFFSETS])
+    hz, levels = interpolate_peaks(magnitudes, RATE)
+    expected = [estimator.estimate(magnitude, RATE)[0] for magnitude in magnitudes]
+    np.testing.assert_allclose(hz, expected, rtol=1e-6)
+    assert np.all(levels > 0)
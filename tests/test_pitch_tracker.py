@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from SpectralEngine import SpectralEngine
+from AudioSources import SignalGenerator
+from PitchTracker import PITCH_DETECTORS, make_detector, PitchTrack
+
+RATE = 48000
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return SpectralEngine(backend='numpy')
+
+
+def harmonic(f0, harmonics, frames=8192, noise=3.0):
+    # 1 / h amplitudes, int16 units
+    tones = [(h * f0, 8000.0 / h) for h in harmonics]
+    return SignalGenerator(tones=tones, noise=noise, seed=1).generate(0, frames, RATE).astype(np.float32)
+
+
+@pytest.mark.parametrize('name', sorted(PITCH_DETECTORS))
+@pytest.mark.parametrize('f0', [82.4, 220.0, 587.3])
+def test_harmonic_tone(engine, name, f0):
+    hz, confidence = make_detector(name, engine)(harmonic(f0, range(1, 7)), RATE)
+    assert hz == pytest.approx(f0, rel=0.005)
+    assert confidence >= 0.5
+
+
+@pytest.mark.parametrize('f0', [110.0, 146.8, 261.6, 440.0])
+def test_hps_missing_fundamental_is_not_an_octave_up(engine, f0):
+    hz, confidence = make_detector('hps', engine)(harmonic(f0, range(2, 7)), RATE)
+    assert hz == pytest.approx(f0, rel=0.005)
+    assert confidence >= 0.5
+
+
+def test_hps_pure_tone_is_not_halved(engine):
+    hz, _ = make_detector('hps', engine)(harmonic(440.0, [1], noise=30.0), RATE)
+    assert hz == pytest.approx(440.0, rel=0.005)
+
+
+@pytest.mark.parametrize('name', sorted(PITCH_DETECTORS))
+def test_no_pitch_from_silence_or_a_short_window(engine, name):
+    detector = make_detector(name, engine)
+    hz, confidence = detector(np.zeros(8192, dtype=np.float32), RATE)
+    assert np.isnan(hz) and confidence == 0.0
+    hz, confidence = detector(harmonic(220.0, range(1, 7), frames=detector.window_size(RATE) - 1), RATE)
+    assert np.isnan(hz) and confidence == 0.0
+
+
+def test_track_drops_single_octave_errors_and_holds_over_gaps():
+    track = PitchTrack(length=5, min_confidence=0.5, hold=2)
+    for hz in [220.0, 221.0, 440.0, 219.0, 220.5]:
+        value = track.update(hz, 0.9)
+    assert value == pytest.approx(220.5)
+    # unvoiced hops: the value holds for `hold` of them, then the track starts over
+    assert track.update(np.nan, 0.0) == value
+    assert track.update(300.0, 0.2) == value
+    assert np.isnan(track.update(np.nan, 0.0))
+    assert track.update(330.0, 0.9) == 330.0
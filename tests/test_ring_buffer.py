@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from RingBuffer import RingBuffer, SharedRingBuffer
+
+
+def test_window_across_wrap_is_contiguous():
+    ring = RingBuffer(8)
+    ring.write(np.arange(6, dtype=np.int16))
+    ring.write(np.arange(6, 11, dtype=np.int16))
+    # written 0..10, the last 8 wrap around the end of the storage
+    window = ring.latest(8)
+    assert window.flags.c_contiguous
+    np.testing.assert_array_equal(window, np.arange(3, 11))
+    np.testing.assert_array_equal(ring.window(9, 4), np.arange(5, 9))
+
+
+def test_views_are_read_only():
+    ring = RingBuffer(4)
+    ring.write(np.ones(3, dtype=np.int16))
+    with pytest.raises(ValueError):
+        ring.latest(2)[0] = 5
+
+
+def test_latest_is_zero_padded_before_the_first_writes():
+    ring = RingBuffer(8)
+    ring.write(np.array([1, 2, 3], dtype=np.int16))
+    np.testing.assert_array_equal(ring.latest(5), [0, 0, 1, 2, 3])
+
+
+def test_oversized_write_keeps_the_tail_and_counts_every_sample():
+    ring = RingBuffer(4)
+    ring.write(np.arange(10, dtype=np.int16))
+    assert ring.write_index == 10
+    np.testing.assert_array_equal(ring.latest(4), [6, 7, 8, 9])
+
+
+def test_read_blocks_in_order_across_wrap():
+    ring = RingBuffer(8)
+    blocks = []
+    for start in range(0, 35, 5):
+        ring.write(np.arange(start, start + 5, dtype=np.int16))
+        blocks.extend(block.copy() for block in ring.read_all(3))
+    # 35 written, 33 read in blocks of 3, the rest waits for a complete block
+    assert ring.overruns == 0
+    np.testing.assert_array_equal(np.concatenate(blocks), np.arange(33))
+    assert ring.read(3) is None
+
+
+def test_lapped_reader_skips_to_the_oldest_sample():
+    ring = RingBuffer(4)
+    ring.write(np.arange(10, dtype=np.int16))
+    np.testing.assert_array_equal(ring.read(2), [6, 7])
+    assert ring.overruns == 1
+    assert ring.available() == 2
+
+
+def test_write_with_gain_converts_into_the_ring_dtype():
+    ring = RingBuffer(4, dtype=np.float32)
+    ring.write(np.array([65536, -65536, 131072], dtype=np.int32), gain=2.0 ** -16)
+    ring.write(np.array([32768, 0], dtype=np.int32), gain=2.0 ** -16)
+    np.testing.assert_array_equal(ring.latest(4), [-1.0, 2.0, 0.5, 0.0])
+
+
+def test_multi_channel_frames_wrap_together():
+    ring = RingBuffer(4, channels=2)
+    frames = np.arange(14, dtype=np.int16).reshape(7, 2)
+    ring.write(frames[:3])
+    ring.write(frames[3:])
+    assert ring.latest(4).shape == (4, 2)
+    np.testing.assert_array_equal(ring.latest(4), frames[3:])
+
+
+def test_shared_ring_is_visible_to_an_attached_copy():
+    ring = SharedRingBuffer(8)
+    try:
+        other = SharedRingBuffer(8, name=ring.name)
+        try:
+            ring.write(np.arange(12, dtype=np.int16))
+            assert other.write_index == 12
+            np.testing.assert_array_equal(other.latest(8), np.arange(4, 12))
+        finally:
+            other.close()
+    finally:
+        ring.close()
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from SpectrumServer import (encode_frame, decode_frame, LENGTH, HEADER, MAGIC, ENCODING_UINT8_DB,
+                            ENCODING_FLOAT16, KIND_BINS, KIND_BANDS)
+
+
+def spectrum(count, channels=1):
+    # magnitudes from -20 to 70 dB, inside the -20 dB floor + 96 dB range used below
+    values = 10 ** (np.random.default_rng(1).uniform(-1, 3.5, (channels, count)))
+    return values[0].astype(np.float32) if channels == 1 else values.astype(np.float32)
+
+
+def round_trip(values, **kwargs):
+    frame = encode_frame(values, 7, 1234.5, 48000, 4096, **kwargs)
+    length, = LENGTH.unpack_from(frame)
+    assert length == len(frame) - LENGTH.size
+    return decode_frame(frame[LENGTH.size:])
+
+
+def test_header_fields_survive():
+    frame = round_trip(spectrum(2048), hz=440.25, error=0.5, pitch=220.0, confidence=0.75)
+    assert frame.sequence == 7
+    assert frame.timestamp == 1234.5
+    assert frame.rate == 48000 and frame.size == 4096
+    assert frame.kind == KIND_BINS and frame.scale == 'linear'
+    assert frame.hz == 440.25 and frame.error == 0.5
+    assert frame.pitch == 220.0 and frame.confidence == 0.75
+
+
+@pytest.mark.parametrize('encoding, width', [(ENCODING_UINT8_DB, 1), (ENCODING_FLOAT16, 2)])
+def test_payload_size(encoding, width):
+    frame = encode_frame(spectrum(100, channels=2), 0, 0.0, 48000, 200, encoding=encoding)
+    assert len(frame) == LENGTH.size + HEADER.size + 2 * 100 * width
+
+
+def test_unvoiced_pitch_is_nan():
+    assert np.isnan(round_trip(spectrum(16)).pitch)
+
+
+def test_float16_round_trip():
+    values = spectrum(2048)
+    frame = round_trip(values, encoding=ENCODING_FLOAT16)
+    assert frame.values.dtype == np.float32
+    np.testing.assert_allclose(frame.values, values, rtol=1e-3)
+
+
+def test_uint8_round_trip_within_one_step():
+    values = spectrum(2048)
+    range_db = 96.0
+    frame = round_trip(values, encoding=ENCODING_UINT8_DB, floor_db=-20.0, range_db=range_db)
+    error_db = np.abs(20 * np.log10(frame.values / values))
+    # rounded to the nearest of 256 levels, half a step at most
+    assert error_db.max() <= range_db / 255 / 2 + 1e-3
+
+
+def test_uint8_clips_to_the_range():
+    values = np.array([1e-3, 1.0, 1e6], dtype=np.float32)
+    frame = round_trip(values, encoding=ENCODING_UINT8_DB, floor_db=0.0, range_db=96.0)
+    np.testing.assert_allclose(20 * np.log10(frame.values), [0.0, 0.0, 96.0], atol=1e-3)
+
+
+@pytest.mark.parametrize('encoding', [ENCODING_UINT8_DB, ENCODING_FLOAT16])
+def test_channels_keep_their_shape(encoding):
+    values = spectrum(512, channels=3)
+    frame = round_trip(values, encoding=encoding, floor_db=-20.0)
+    assert frame.values.shape == (3, 512)
+    np.testing.assert_allclose(frame.values, values, rtol=0.03)
+
+
+@pytest.mark.parametrize('scale', ['linear', 'log', 'octave'])
+def test_band_frames_carry_their_scale(scale):
+    frame = round_trip(spectrum(30), kind=KIND_BANDS, scale=scale)
+    assert frame.kind == KIND_BANDS and frame.scale == scale
+    assert frame.values.shape == (30,)
+
+
+def test_foreign_frames_are_rejected():
+    body = encode_frame(spectrum(8), 0, 0.0, 48000, 16)[LENGTH.size:]
+    with pytest.raises(ValueError):
+        decode_frame(b'XXXX' + body[len(MAGIC):])
+    # an encoding this version does not know, right after magic and version
+    unknown = body[:len(MAGIC) + 1] + bytes([9]) + body[len(MAGIC) + 2:]
+    with pytest.raises(ValueError):
+        decode_frame(unknown)
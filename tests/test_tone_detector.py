@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from AudioInputStream import AudioIn, SAMPLE_FORMATS
+from AudioSources import SyntheticBackend, SignalGenerator, encode_block
+from ToneDetector import ToneBank, ToneTask
+
+RATE = 48000
+TONES = [1000.0, 1500.0, 2000.0]
+
+
+def capture(audio, sizes):
+    # blocks of the given sizes from the backend's source through the capture callback,
+    # as its stream would deliver them but without a thread or real-time pacing
+    pa_format = SAMPLE_FORMATS[audio.sample_format][0]
+    for size in sizes:
+        block = audio.p.source.read(size, audio.channels, audio.rate)
+        audio.callback(encode_block(block, pa_format), size, None, 0)
+
+
+def make_audio(source, channels=1, sample_format='int16'):
+    audio = AudioIn(chunk=512, sample_rate=RATE, blocks=32, channels=channels, sample_format=sample_format,
+                    backend=SyntheticBackend(source))
+    audio.prepare(RATE, 512, channels)
+    return audio
+
+
+def dbfs(amplitude):
+    return 20 * np.log10(amplitude / 32768.0)
+
+
+@pytest.mark.parametrize('sample_format', ['int16', 'int24', 'float32'])
+def test_levels_of_present_and_absent_tones(sample_format):
+    audio = make_audio(SignalGenerator(tones=[(1000.0, 8000.0), (1500.0, 800.0)]), sample_format=sample_format)
+    bank = ToneBank(TONES, RATE, window=0.1)
+    capture(audio, [512] * 20)
+    assert bank.update(audio.ring)
+    levels = bank.levels()
+    assert levels[0] == pytest.approx(dbfs(8000.0), abs=0.05)
+    assert levels[1] == pytest.approx(dbfs(800.0), abs=0.05)
+    assert levels[2] < -80.0
+
+
+def test_incremental_updates_match_a_fresh_window():
+    audio = make_audio(SignalGenerator(tones=[(1000.0, 8000.0), (1730.0, 3000.0)], noise=100.0))
+    incremental = ToneBank(TONES + [1730.0], RATE, window=0.1)
+    rng = np.random.default_rng(0)
+    for _ in range(60):
+        # uneven blocks, some shorter and some longer than the window step
+        capture(audio, [int(rng.integers(1, 2000))])
+        incremental.update(audio.ring)
+    assert not incremental.update(audio.ring)
+    fresh = ToneBank(TONES + [1730.0], RATE, window=0.1)
+    fresh.update(audio.ring)
+    np.testing.assert_allclose(incremental.magnitudes, fresh.magnitudes, rtol=1e-6)
+
+
+def test_off_bin_tone_is_separated_from_its_neighbour():
+    # 1005 Hz lies between the 10 Hz steps of a 0.1 s window, the Hann window keeps its
+    # leakage into the 1030 Hz tone far below the 1030 Hz tone's own level
+    audio = make_audio(SignalGenerator(tones=[(1005.0, 8000.0)]))
+    bank = ToneBank([1005.0, 1030.0], RATE, window=0.1)
+    capture(audio, [512] * 20)
+    bank.update(audio.ring)
+    levels = bank.levels()
+    assert levels[0] == pytest.approx(dbfs(8000.0), abs=1.5)
+    assert levels[1] < levels[0] - 30.0
+
+
+def test_channel_modes():
+    audio = make_audio(SignalGenerator(tones=[(1000.0, 8000.0)]), channels=2)
+    capture(audio, [512] * 20)
+    both = ToneBank(TONES, RATE, mode='sum')
+    both.update(audio.ring)
+    assert both.levels()[0] == pytest.approx(dbfs(8000.0), abs=0.05)
+    # the same signal on both channels cancels in the difference
+    difference = ToneBank(TONES, RATE, mode='diff')
+    difference.update(audio.ring)
+    assert difference.levels()[0] < -100.0
+
+
+def test_task_reports_on_and_off_events():
+    source = SignalGenerator(tones=[(1500.0, 8000.0)])
+    audio = make_audio(source)
+    task = ToneTask(TONES, RATE, hop=512, threshold=-30.0)
+    task.setup()
+
+    def run(blocks):
+        results = []
+        for _ in range(blocks):
+            capture(audio, [512])
+            result = task(audio.ring)
+            if result is not None:
+                results.append(result)
+        return results
+
+    results = run(30)
+    assert results[-1].active.tolist() == [False, True, False]
+    source.tones = [(1000.0, 8000.0)]
+    results = run(30)
+    assert results[-1].active.tolist() == [True, False, False]
+    events = results[-1].events
+    # the new tone crosses the threshold on the way up before the old one falls below
+    # threshold - hysteresis on the way down
+    assert [(event.hz, event.kind) for event in events] == [(1500.0, 'on'), (1000.0, 'on'), (1500.0, 'off')]
+    # nothing fires while the first window still holds the ring's zero padding
+    assert events[0].end >= task.bank.size
+    assert all(result.end % 512 == 0 for result in results)